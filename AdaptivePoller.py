@@ -0,0 +1,182 @@
+import random
+from ShardedCollection import ShardRow
+from Metrics import registry
+
+
+class AdaptivePoller:
+    """
+        A class to poll each station at its own rate instead of sweeping every station on every tick.
+
+        Every station has a polling interval in ticks. A station whose value changes by more than change_threshold,
+        or whose value is at least busy_threshold, is polled on every tick. A station whose value stays the same,
+        including one that keeps returning no data, doubles its interval after every idle_polls polls without a
+        change, up to max_interval, so stale, unavailable and flat stations back off gradually and are re-probed at
+        least every max_interval ticks. The first change polled resets the interval to one tick. Intervals longer
+        than one tick are shortened by a random jitter of up to a quarter, so stations that backed off together
+        are not all re-probed on the same tick.
+
+        The stations due on a tick are swept with the given sweeper, which may also be a ShardCoordinator. The
+        stations not polled are added to the dumper row as missing, or with their last polled value when fill is
+        'last', without being passed to the dumper's monitor, so rows keep the full station set and tables are not
+        rotated. Values carried over with 'last' are stored, rolled up and delta encoded like polled values, so
+        rollup sample counts and means then include them; with 'gap' they count as missing instead.
+
+        Attributes:
+        - max_interval (int): Longest polling interval in ticks.
+        - idle_polls (int): Number of polls without a change after which the interval is doubled.
+        - change_threshold (float): Smallest change of a value that counts as a change.
+        - busy_threshold (float or None): Value at or above which a station is polled on every tick, None for none.
+        - fill (str): 'gap' to add stations not polled as missing, 'last' to add them with their last polled value.
+        - ticks (int): Number of ticks polled.
+        - polled_total (int): Number of station polls since start.
+        - skipped_total (int): Number of station polls saved since start.
+        - polled_last (int): Number of stations polled on the last tick.
+        - _interval (dict): Polling interval per station. Note: Internal attribute, avoid direct access.
+        - _next_due (dict): Tick a station is polled next. Note: Internal attribute, avoid direct access.
+        - _idle (dict): Polls without a change since the last change of interval. Note: Internal attribute.
+        - _last_value (dict): Last polled value per station. Note: Internal attribute, avoid direct access.
+        - _stations (tuple): Stations of the last tick. Note: Internal attribute, avoid direct access.
+        - _random (random.Random): Source of the jitter. Note: Internal attribute, avoid direct access.
+    """
+    fills = ('gap', 'last')
+
+    def __init__(self, max_interval=16, idle_polls=3, change_threshold=0.01, busy_threshold=None, fill='gap',
+                 seed=None):
+        """
+            Initializes the AdaptivePoller instance.
+
+            Args:
+            - max_interval (int): Longest polling interval in ticks.
+            - idle_polls (int): Number of polls without a change after which the interval is doubled.
+            - change_threshold (float): Smallest change of a value that counts as a change.
+            - busy_threshold (float or None): Value at or above which a station is polled on every tick.
+            - fill (str): 'gap' or 'last', how stations not polled are added to the row.
+            - seed (int or None): Seed of the jitter.
+
+            Raises:
+            - ValueError: If fill is not one of 'last' and 'gap'.
+        """
+        if fill not in self.fills:
+            raise ValueError(f"fill must be one of {self.fills}, got {fill}.")
+        self.max_interval = max(1, max_interval)
+        self.idle_polls = max(1, idle_polls)
+        self.change_threshold = change_threshold
+        self.busy_threshold = busy_threshold
+        self.fill = fill
+        self.ticks = 0
+        self.polled_total = 0
+        self.skipped_total = 0
+        self.polled_last = 0
+        self._interval = {}
+        self._next_due = {}
+        self._idle = {}
+        self._last_value = {}
+        self._stations = ()
+        self._random = random.Random(seed)
+
+    def due_stations(self, naptan_ids):
+        """
+            Returns the stations to poll on the current tick. Stations not seen before are always due, and the
+            state of stations no longer listed is dropped.
+
+            Args:
+            - naptan_ids (tuple): Naptan IDs of all stations.
+
+            Returns:
+            - tuple: Naptan IDs of the due stations, in the order of naptan_ids.
+        """
+        naptan_ids = tuple(naptan_ids)
+        if naptan_ids != self._stations:
+            listed = set(naptan_ids)
+            for state in (self._interval, self._next_due, self._idle, self._last_value):
+                for naptan_id in [n_id for n_id in state if n_id not in listed]:
+                    del state[naptan_id]
+            self._stations = naptan_ids
+        return tuple(naptan_id for naptan_id in naptan_ids if self._next_due.get(naptan_id, 0) <= self.ticks)
+
+    def _update(self, naptan_id, crowding_data):
+        """
+            Updates the polling interval of a polled station.
+
+            Args:
+            - naptan_id (str): The Naptan ID of the station.
+            - crowding_data (float or None): Polled value, None if missing.
+        """
+        interval = self._interval.get(naptan_id, 1)
+        if naptan_id not in self._last_value:
+            changed = True
+        else:
+            previous = self._last_value[naptan_id]
+            if previous is None or crowding_data is None:
+                changed = (previous is None) != (crowding_data is None)
+            else:
+                changed = abs(crowding_data - previous) > self.change_threshold
+        busy = self.busy_threshold is not None and crowding_data is not None and crowding_data >= self.busy_threshold
+
+        if changed or busy:
+            interval = 1
+            self._idle[naptan_id] = 0
+        else:
+            self._idle[naptan_id] = self._idle.get(naptan_id, 0) + 1
+            if self._idle[naptan_id] >= self.idle_polls:
+                interval = min(2 * interval, self.max_interval)
+                self._idle[naptan_id] = 0
+
+        self._interval[naptan_id] = interval
+        self._last_value[naptan_id] = crowding_data
+        self._next_due[naptan_id] = self.ticks + interval - self._random.randint(0, (interval - 1) // 4)
+
+    def sweep(self, sweeper, naptan_ids, dumper):
+        """
+            Polls the due stations with the sweeper and adds all stations to the latest row of the dumper, in the
+            order of naptan_ids. Intervals are only updated if the sweep is kept, so the stations of a dropped
+            sweep stay due.
+
+            Args:
+            - sweeper (CrowdingSweeper or ShardCoordinator): Sweeper the due stations are fetched with.
+            - naptan_ids (tuple): Naptan IDs of all stations.
+            - dumper (DataDumper): Dumper whose latest row is filled.
+
+            Returns:
+            - tuple: Naptan IDs of the polled stations.
+
+            Raises:
+            - Exception: If the sweep of the due stations fails.
+        """
+        due = self.due_stations(naptan_ids)
+        row = ShardRow()
+        if due:
+            sweeper.sweep(due, row)
+
+        for naptan_id in naptan_ids:
+            if naptan_id in row.values:
+                crowding_data = row.values[naptan_id]
+                self._update(naptan_id, crowding_data)
+                dumper.add_station_to_row(station_name=naptan_id, crowding_data=crowding_data)
+            else:
+                crowding_data = self._last_value.get(naptan_id) if self.fill == 'last' else None
+                dumper.add_station_to_row(station_name=naptan_id, crowding_data=crowding_data, sampled=False)
+
+        skipped = len(naptan_ids) - len(due)
+        self.ticks += 1
+        self.polled_last = len(due)
+        self.polled_total += len(due)
+        self.skipped_total += skipped
+        registry.inc('station_polls_skipped_total', skipped)
+        return due
+
+    def get_stats(self):
+        """
+            Returns polling counters.
+
+            Returns:
+            - dict: Ticks, stations polled on the last tick, polls made and saved since start, the saved fraction
+              and the number of stations per polling interval.
+        """
+        intervals = {}
+        for interval in self._interval.values():
+            intervals[interval] = intervals.get(interval, 0) + 1
+        polls = self.polled_total + self.skipped_total
+        return {'ticks': self.ticks, 'polled_last': self.polled_last, 'polled_total': self.polled_total,
+                'skipped_total': self.skipped_total, 'skipped_fraction': self.skipped_total / polls if polls else 0.0,
+                'stations_per_interval': {str(interval): count for interval, count in sorted(intervals.items())}}
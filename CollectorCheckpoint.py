@@ -0,0 +1,84 @@
+import json
+import os
+import threading
+import time
+
+
+class CollectorCheckpoint:
+    """
+        A class to keep the state a restarted collector needs to take its first sample at once, in a JSON file.
+
+        The state is split into sections, such as 'database' with the current table, its row count and station
+        sequence, and 'topology' with the last station set. Each update rewrites the whole file atomically, so
+        a crash leaves either the previous or the new checkpoint. A missing, unreadable or outdated file is
+        treated as empty, the collector then falls back to introspecting the database and crawling the topology.
+
+        Attributes:
+        - path (str): Path of the checkpoint file.
+        - version (int): Format version, files of other versions are ignored.
+        - loaded (bool): Whether a checkpoint was read from the file.
+        - _state (dict): State per section. Note: Internal attribute, avoid direct access.
+        - _lock (threading.Lock): Lock serialising updates of the flushing and sampling threads. Note: Internal.
+    """
+    version = 1
+
+    def __init__(self, path):
+        """
+            Initializes the CollectorCheckpoint instance and loads the checkpoint file if it exists.
+
+            Args:
+            - path (str): Path of the checkpoint file.
+        """
+        self.path = path
+        self.loaded = False
+        self._state = {}
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        """Loads the checkpoint file, keeping an empty state if it is missing, unreadable or of another version."""
+        try:
+            with open(self.path, 'r') as checkpoint_file:
+                checkpoint = json.load(checkpoint_file)
+        except (OSError, ValueError):
+            return
+        if isinstance(checkpoint, dict) and checkpoint.get('version') == self.version:
+            self._state = checkpoint.get('sections', {})
+            self.loaded = True
+
+    def get(self, section):
+        """
+            Returns the state of a section.
+
+            Args:
+            - section (str): Name of the section.
+
+            Returns:
+            - dict or None: Copy of the section state, None if the checkpoint has no such section.
+        """
+        with self._lock:
+            state = self._state.get(section)
+            return dict(state) if state is not None else None
+
+    def update(self, section, state):
+        """
+            Replaces the state of a section and writes the checkpoint file atomically.
+
+            Args:
+            - section (str): Name of the section.
+            - state (dict): JSON serialisable state of the section.
+
+            Raises:
+            - Exception: If the checkpoint file cannot be written.
+        """
+        try:
+            with self._lock:
+                self._state[section] = dict(state, saved_at=time.time())
+                tmp_path = f"{self.path}.tmp"
+                with open(tmp_path, 'w') as checkpoint_file:
+                    json.dump({'version': self.version, 'sections': self._state}, checkpoint_file)
+                    checkpoint_file.flush()
+                    os.fsync(checkpoint_file.fileno())
+                os.replace(tmp_path, self.path)
+        except Exception as err:
+            raise Exception(f"[update] {err}")
@@ -0,0 +1,320 @@
+import argparse
+import json
+import os
+import numpy as np
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.ipc
+import pyarrow.parquet as pq
+from CrowdingReader import CrowdingReader
+
+
+class CrowdingExporter:
+    """
+        A class to export crowding data incrementally from the database to time-partitioned columnar files.
+
+        Each export reads the rows after the watermark of the previous export through a CrowdingReader and writes
+        them to files under <export_dir>/<partition>=<key>/, keeping the c_timestamp and NUMERIC(5,4) station
+        layout of the data tables. The station columns of a run are the union of the stations of all tables it
+        reads, so rows of tables without a station hold nulls. Files of different runs may have different
+        station columns; read_export unifies them.
+
+        Files are named after their first timestamp, so an export interrupted before its watermark was saved
+        overwrites its own files when it is run again instead of duplicating rows.
+
+        Rows can reach the database after rows with later timestamps, e.g. a spool backlog drained after an outage
+        or a replayed response archive. Each export therefore re-reads overlap_hours before the watermark and
+        skips the timestamps already in the exported files of those partitions, so late rows within the overlap
+        are exported in files of their own.
+
+        Attributes:
+        - reader (CrowdingReader): Reader of the database.
+        - export_dir (str): Directory of the exported files and the watermark.
+        - file_format (str): 'parquet' or 'arrow' (Arrow IPC).
+        - partition (str): Time partitioning of the files, 'day' or 'month'.
+        - rows_per_file (int): Maximum number of rows in a file.
+        - compression (str): Parquet compression codec.
+        - overlap_hours (float): Time before the watermark re-read by each export for late rows, in hours.
+    """
+    file_formats = {'parquet': '.parquet', 'arrow': '.arrow'}
+    partition_units = {'day': 'D', 'month': 'M'}
+    value_type = pa.decimal128(5, 4)
+
+    def __init__(self, reader, export_dir, file_format='parquet', partition='day', rows_per_file=500000,
+                 compression='zstd', overlap_hours=24):
+        """
+            Initializes the CrowdingExporter instance.
+
+            Args:
+            - reader (CrowdingReader): Reader of the database.
+            - export_dir (str): Directory of the exported files and the watermark.
+            - file_format (str): 'parquet' or 'arrow' (Arrow IPC).
+            - partition (str): Time partitioning of the files, 'day' or 'month'.
+            - rows_per_file (int): Maximum number of rows in a file.
+            - compression (str): Parquet compression codec.
+            - overlap_hours (float): Time before the watermark re-read by each export for late rows, in hours.
+        """
+        if file_format not in self.file_formats:
+            raise ValueError(f"Unknown file format {file_format}, expected one of {tuple(self.file_formats)}.")
+        if partition not in self.partition_units:
+            raise ValueError(f"Unknown partition {partition}, expected one of {tuple(self.partition_units)}.")
+        self.reader = reader
+        self.export_dir = export_dir
+        self.file_format = file_format
+        self.partition = partition
+        self.rows_per_file = rows_per_file
+        self.compression = compression
+        self.overlap_hours = overlap_hours
+
+    @property
+    def watermark_path(self):
+        """
+            Returns the path of the watermark file.
+
+            Returns:
+            - str: Path of the watermark file.
+        """
+        return os.path.join(self.export_dir, '_watermark.json')
+
+    def load_watermark(self):
+        """
+            Returns the last exported timestamp.
+
+            Returns:
+            - str or None: Timestamp 'YYYY-MM-DD HH:MM:SS', None if nothing was exported yet.
+        """
+        if not os.path.exists(self.watermark_path):
+            return None
+        with open(self.watermark_path) as watermark_file:
+            return json.load(watermark_file)['last_timestamp']
+
+    def save_watermark(self, last_timestamp):
+        """
+            Saves the last exported timestamp, replacing the watermark file atomically.
+
+            Args:
+            - last_timestamp (str): Timestamp 'YYYY-MM-DD HH:MM:SS'.
+        """
+        tmp_path = f"{self.watermark_path}.tmp"
+        with open(tmp_path, 'w') as watermark_file:
+            json.dump({'last_timestamp': last_timestamp}, watermark_file)
+            watermark_file.flush()
+            os.fsync(watermark_file.fileno())
+        os.replace(tmp_path, self.watermark_path)
+
+    def partition_keys(self, timestamps):
+        """
+            Returns the partition key of each timestamp.
+
+            Args:
+            - timestamps (numpy.ndarray): datetime64[s] timestamps.
+
+            Returns:
+            - numpy.ndarray: Keys such as '2024-05-01' for day partitions or '2024-05' for month partitions.
+        """
+        return np.datetime_as_string(timestamps.astype(f"datetime64[{self.partition_units[self.partition]}]"))
+
+    def exported_timestamps(self, start):
+        """
+            Reads the timestamps already exported to the partitions from the one of a timestamp on.
+
+            Args:
+            - start (numpy.datetime64): First timestamp of interest.
+
+            Returns:
+            - numpy.ndarray: datetime64[s] timestamps of the exported rows, in no particular order.
+        """
+        first_key = str(self.partition_keys(np.array([start], dtype='datetime64[s]'))[0])
+        extension = self.file_formats[self.file_format]
+        dataset_format = 'parquet' if self.file_format == 'parquet' else 'ipc'
+        prefix = f"{self.partition}="
+        chunks = [np.empty(0, dtype='datetime64[s]')]
+        for name in sorted(os.listdir(self.export_dir)):
+            if not name.startswith(prefix) or name[len(prefix):] < first_key:
+                continue
+            directory = os.path.join(self.export_dir, name)
+            files = [os.path.join(directory, file_name) for file_name in os.listdir(directory)
+                     if file_name.endswith(extension)]
+            if files:
+                column = ds.dataset(files, format=dataset_format).to_table(columns=['c_timestamp']).column(0)
+                chunks.append(column.to_numpy().astype('datetime64[s]'))
+        return np.concatenate(chunks)
+
+    def build_table(self, timestamps, values, naptan_ids):
+        """
+            Builds an Arrow table of rows in the layout of the data tables.
+
+            Args:
+            - timestamps (numpy.ndarray): datetime64[s] timestamps.
+            - values (numpy.ndarray): float64 values of shape (rows, stations) with NaN for missing values.
+            - naptan_ids (list): Station of each column of values.
+
+            Returns:
+            - pyarrow.Table: c_timestamp and one decimal(5,4) column per station, null for missing values.
+        """
+        columns = [pa.array(timestamps, type=pa.timestamp('s'))]
+        columns.extend(pa.array(values[:, index], from_pandas=True).cast(self.value_type)
+                       for index in range(len(naptan_ids)))
+        return pa.Table.from_arrays(columns, names=['c_timestamp'] + list(naptan_ids))
+
+    def write_table(self, table, key):
+        """
+            Writes a table to a file of its partition, named after its first timestamp.
+
+            Args:
+            - table (pyarrow.Table): Rows of a single partition in time order.
+            - key (str): Partition key of the rows.
+
+            Returns:
+            - str: Path of the written file.
+        """
+        directory = os.path.join(self.export_dir, f"{self.partition}={key}")
+        os.makedirs(directory, exist_ok=True)
+        first = table.column('c_timestamp')[0].as_py().strftime('%Y%m%dT%H%M%S')
+        path = os.path.join(directory, f"part-{first}{self.file_formats[self.file_format]}")
+        tmp_path = f"{path}.tmp"
+        if self.file_format == 'parquet':
+            pq.write_table(table, tmp_path, compression=self.compression)
+        else:
+            with pa.OSFile(tmp_path, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(tmp_path, path)
+        return path
+
+    def export(self, until='9999-12-31 23:59:59'):
+        """
+            Exports the rows after the watermark up to a timestamp and advances the watermark after each file.
+            Rows within overlap_hours before the watermark that were not exported yet are exported as well.
+
+            Args:
+            - until (str): Last timestamp to export, 'YYYY-MM-DD HH:MM:SS'.
+
+            Returns:
+            - dict: Number of rows and files written, of late rows among them and the new watermark.
+
+            Raises:
+            - Exception: If reading or writing fails. Files written before the failure stay exported.
+        """
+        try:
+            os.makedirs(self.export_dir, exist_ok=True)
+            watermark = self.load_watermark()
+            start = '0001-01-01 00:00:00'
+            exported = None
+            if watermark is not None:
+                watermark_time = np.datetime64(watermark.replace(' ', 'T'), 's')
+                overlap_start = watermark_time - np.timedelta64(int(self.overlap_hours * 3600), 's')
+                start = str(overlap_start).replace('T', ' ')
+                exported = self.exported_timestamps(overlap_start)
+
+            naptan_ids = sorted({n_id for _, table_stations in self.reader.tables_in_range(start, until)
+                                 for n_id in table_stations})
+            stats = {'rows': 0, 'files': 0, 'late_rows': 0, 'watermark': watermark}
+            if not naptan_ids:
+                return stats
+
+            pending = []
+            pending_key = None
+
+            def flush():
+                table = pa.concat_tables(pending)
+                self.write_table(table, pending_key)
+                last_timestamp = table.column('c_timestamp')[-1].as_py().strftime('%Y-%m-%d %H:%M:%S')
+                if stats['watermark'] is not None:
+                    last_timestamp = max(last_timestamp, stats['watermark'])
+                self.save_watermark(last_timestamp)
+                stats['rows'] += table.num_rows
+                stats['files'] += 1
+                stats['watermark'] = last_timestamp
+
+            for timestamps, values in self.reader.iter_arrays(start, until, naptan_ids):
+                if exported is not None:
+                    new_rows = ~np.isin(timestamps.astype('datetime64[s]'), exported)
+                    stats['late_rows'] += int(np.count_nonzero(new_rows & (timestamps <= watermark_time)))
+                    timestamps, values = timestamps[new_rows], values[new_rows]
+                    if len(timestamps) == 0:
+                        continue
+                keys = self.partition_keys(timestamps)
+                boundaries = np.flatnonzero(keys[1:] != keys[:-1]) + 1
+                for begin, end in zip(np.r_[0, boundaries], np.r_[boundaries, len(keys)]):
+                    key = keys[begin]
+                    if pending and (key != pending_key or sum(t.num_rows for t in pending) >= self.rows_per_file):
+                        flush()
+                        pending = []
+                    pending_key = key
+                    pending.append(self.build_table(timestamps[begin:end], values[begin:end], naptan_ids))
+            if pending:
+                flush()
+            return stats
+        except Exception as err:
+            raise Exception(f"[export] {err}")
+
+
+def read_export(export_dir, file_format='parquet', columns=None, as_float=True):
+    """
+    Reads exported files into one DataFrame, unifying the station columns of all files.
+
+    Parameters:
+    export_dir (str): Directory of the exported files.
+    file_format (str): 'parquet' or 'arrow'.
+    columns (list or None): Columns to read, e.g. ['c_timestamp', '940GZZLUOXC'], all columns if None.
+    as_float (bool): Whether to convert the decimal station values to float64 with NaN for nulls.
+
+    Returns:
+    pandas.DataFrame: Rows in time order with missing values for stations a file does not have.
+
+    Raises:
+    Exception: If the directory has no exported files.
+    """
+    try:
+        dataset_format = 'parquet' if file_format == 'parquet' else 'ipc'
+        extension = CrowdingExporter.file_formats[file_format]
+        files = sorted(os.path.join(directory, name) for directory, _, names in os.walk(export_dir)
+                       for name in names if name.endswith(extension))
+        if not files:
+            raise Exception(f"No {file_format} files in {export_dir}.")
+        schema = pa.unify_schemas([ds.dataset(path, format=dataset_format).schema for path in files])
+        table = ds.dataset(files, schema=schema, format=dataset_format).to_table(columns=columns)
+        if as_float:
+            table = table.cast(pa.schema([pa.field(field.name, pa.float64()) if pa.types.is_decimal(field.type)
+                                          else field for field in table.schema]))
+        return table.sort_by('c_timestamp').to_pandas()
+    except Exception as err:
+        raise Exception(f"[read_export] {err}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export crowding data written since the last export to "
+                                                 "time-partitioned Parquet or Arrow files.")
+
+    parser.add_argument("-o", "--export_dir", type=str, required=True,
+                        help="Directory of the exported files and the watermark")
+    parser.add_argument("-f", "--file_format", type=str, default='parquet', choices=tuple(CrowdingExporter.file_formats),
+                        help="Parquet files or Arrow IPC files")
+    parser.add_argument("-p", "--partition", type=str, default='day', choices=tuple(CrowdingExporter.partition_units),
+                        help="Time partitioning of the files")
+    parser.add_argument("-u", "--until", type=str, default='9999-12-31 23:59:59',
+                        help="Last timestamp to export, 'YYYY-MM-DD HH:MM:SS'")
+    parser.add_argument("-r", "--rows_per_file", type=int, default=500000,
+                        help="Maximum number of rows in a file")
+    parser.add_argument("-ov", "--overlap_hours", type=float, default=24,
+                        help="Time before the watermark re-read for rows that reached the database late, e.g. a "
+                             "spool drained after an outage or a replayed archive")
+    parser.add_argument("-cr", "--chunk_rows", type=int, default=50000,
+                        help="Number of rows fetched from the database at once")
+    parser.add_argument("-rc", "--rebuild_catalog", action="store_true",
+                        help="Register data tables written before the catalog existed before exporting")
+
+    args = parser.parse_args()
+
+    from config import db_params
+
+    crowding_reader = CrowdingReader(db_params, chunk_rows=args.chunk_rows)
+    try:
+        if args.rebuild_catalog:
+            crowding_reader.rebuild_catalog()
+        exporter = CrowdingExporter(crowding_reader, args.export_dir, args.file_format, args.partition,
+                                    args.rows_per_file, overlap_hours=args.overlap_hours)
+        result = exporter.export(args.until)
+        print(f"Exported {result['rows']} rows to {result['files']} files, watermark {result['watermark']}.")
+    finally:
+        crowding_reader.close()
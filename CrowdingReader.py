@@ -0,0 +1,236 @@
+import uuid
+import numpy as np
+import pandas as pd
+import psycopg2
+from DatabaseHandler import DatabaseHandler
+
+
+class CrowdingReader:
+    """
+        A class to read crowding data of a time range across all data tables without loading it into memory at once.
+
+        The tables overlapping the range are looked up in the catalog kept by DatabaseHandler. Each one is read
+        through a server-side cursor, fetching at most chunk_rows rows at a time and only the requested stations.
+
+        Attributes:
+        - db_params (dict): Database connection parameters.
+        - catalog_table (str): Table recording the time range and station columns of each data table.
+        - chunk_rows (int): Maximum number of rows in each yielded chunk.
+        - connection: psycopg2 connection object, open while connected.
+    """
+    def __init__(self, db_params, catalog_table=DatabaseHandler.catalog_table, chunk_rows=10000):
+        """
+            Initializes the CrowdingReader instance.
+
+            Args:
+            - db_params (dict): Database connection parameters.
+            - catalog_table (str): Table recording the time range and station columns of each data table.
+            - chunk_rows (int): Maximum number of rows in each yielded chunk.
+        """
+        self.db_params = db_params
+        self.catalog_table = catalog_table
+        self.chunk_rows = chunk_rows
+        self.connection = None
+
+    def connect(self):
+        """
+            Opens the database connection unless it is already open.
+
+            Raises:
+            - Exception: If the connection cannot be opened.
+        """
+        try:
+            if self.connection is None or self.connection.closed:
+                self.connection = psycopg2.connect(**self.db_params)
+        except Exception as err:
+            raise Exception(f"[connect] {err}")
+
+    def close(self):
+        """Closes the database connection."""
+        if self.connection is not None and not self.connection.closed:
+            self.connection.close()
+        self.connection = None
+
+    def rebuild_catalog(self, table_pattern='crowding_data%'):
+        """
+            Registers the data tables missing from the catalog, e.g. written before the catalog existed,
+            with the time range and row count of their rows. Partitions are covered by their parent table.
+
+            Args:
+            - table_pattern (str): LIKE pattern of the data table names.
+
+            Returns:
+            - list: Names of the newly registered tables.
+
+            Raises:
+            - Exception: If an error occurs while scanning or registering the tables.
+        """
+        try:
+            self.connect()
+            with self.connection.cursor() as cursor:
+                cursor.execute(DatabaseHandler.catalog_definition.format(catalog_table=self.catalog_table))
+                cursor.execute(f"""
+                    SELECT c.relname FROM pg_class c
+                    JOIN pg_namespace n ON n.oid = c.relnamespace
+                    WHERE c.relname LIKE %s AND c.relkind IN ('r', 'p') AND NOT c.relispartition
+                      AND n.nspname = current_schema()
+                      AND c.relname NOT IN (SELECT table_name FROM {self.catalog_table})
+                      AND EXISTS (SELECT 1 FROM pg_attribute a
+                                  WHERE a.attrelid = c.oid AND a.attname = 'c_timestamp' AND NOT a.attisdropped)
+                    ORDER BY c.relname;
+                """, (table_pattern,))
+                tables = [row[0] for row in cursor.fetchall()]
+
+                for table in tables:
+                    cursor.execute("""
+                        SELECT column_name FROM information_schema.columns
+                        WHERE table_schema = current_schema() AND table_name = %s AND column_name != 'c_timestamp'
+                        ORDER BY column_name;
+                    """, (table,))
+                    naptan_ids = [row[0] for row in cursor.fetchall()]
+                    cursor.execute(f"""
+                        INSERT INTO {self.catalog_table}
+                            (table_name, naptan_ids, first_timestamp, last_timestamp, row_count)
+                        SELECT %s, %s, MIN(c_timestamp), MAX(c_timestamp), COUNT(*) FROM {table};
+                    """, (table, naptan_ids))
+            self.connection.commit()
+            return tables
+        except Exception as err:
+            if self.connection is not None:
+                self.connection.rollback()
+            raise Exception(f"[rebuild_catalog] {err}")
+
+    def tables_in_range(self, start, end, naptan_ids=None):
+        """
+            Returns the data tables with rows in a time range, in time order.
+
+            Args:
+            - start (str): First timestamp of the range, 'YYYY-MM-DD HH:MM:SS'.
+            - end (str): Last timestamp of the range, 'YYYY-MM-DD HH:MM:SS'.
+            - naptan_ids (list or None): Only tables with at least one of these stations, any table if None.
+
+            Returns:
+            - list: (table_name, naptan_ids) of the overlapping tables.
+
+            Raises:
+            - Exception: If the catalog cannot be read.
+        """
+        try:
+            self.connect()
+            station_filter = "" if naptan_ids is None else "AND naptan_ids && %(naptan_ids)s::text[]"
+            with self.connection.cursor() as cursor:
+                cursor.execute(f"""
+                    SELECT table_name, naptan_ids FROM {self.catalog_table}
+                    WHERE first_timestamp <= %(end)s AND last_timestamp >= %(start)s {station_filter}
+                    ORDER BY first_timestamp;
+                """, {'start': start, 'end': end, 'naptan_ids': list(naptan_ids or [])})
+                tables = [(table_name, tuple(table_stations)) for table_name, table_stations in cursor.fetchall()]
+            self.connection.commit()
+            return tables
+        except Exception as err:
+            if self.connection is not None:
+                self.connection.rollback()
+            raise Exception(f"[tables_in_range] {err}")
+
+    def iter_table_arrays(self, table, table_stations, start, end, naptan_ids):
+        """
+            Streams crowding data of selected stations in a time range of a single data table as NumPy chunks.
+
+            Args:
+            - table (str): Name of the data table.
+            - table_stations (tuple): Station columns of the table, as recorded in the catalog.
+            - start (str): First timestamp of the range, 'YYYY-MM-DD HH:MM:SS'.
+            - end (str): Last timestamp of the range, 'YYYY-MM-DD HH:MM:SS'.
+            - naptan_ids (list): Stations to read. Stations missing from the table are NaN.
+
+            Yields:
+            - tuple: (timestamps, values) where timestamps is a datetime64[s] array of up to chunk_rows rows
+              and values a float64 array of shape (rows, len(naptan_ids)) with NaN for missing values.
+
+            Raises:
+            - Exception: If an error occurs while reading.
+        """
+        try:
+            self.connect()
+            naptan_ids = list(naptan_ids)
+            present = set(table_stations)
+            columns = ', '.join(f'"{n_id}"::float8' if n_id in present else 'NULL::float8' for n_id in naptan_ids)
+            cursor = self.connection.cursor(name=f"crowding_reader_{uuid.uuid4().hex}")
+            try:
+                cursor.itersize = self.chunk_rows
+                cursor.execute(f"""
+                    SELECT c_timestamp, {columns} FROM {table}
+                    WHERE c_timestamp BETWEEN %s AND %s
+                    ORDER BY c_timestamp;
+                """, (start, end))
+                while True:
+                    rows = cursor.fetchmany(self.chunk_rows)
+                    if not rows:
+                        break
+                    timestamps = np.array([row[0] for row in rows], dtype='datetime64[s]')
+                    values = np.array([row[1:] for row in rows], dtype=np.float64).reshape(len(rows), len(naptan_ids))
+                    yield timestamps, values
+            finally:
+                cursor.close()
+                self.connection.commit()
+        except Exception as err:
+            if self.connection is not None and not self.connection.closed:
+                self.connection.rollback()
+            raise Exception(f"[iter_table_arrays] {err}")
+
+    def iter_arrays(self, start, end, naptan_ids):
+        """
+            Streams crowding data of selected stations in a time range as NumPy chunks in time order.
+
+            Args:
+            - start (str): First timestamp of the range, 'YYYY-MM-DD HH:MM:SS'.
+            - end (str): Last timestamp of the range, 'YYYY-MM-DD HH:MM:SS'.
+            - naptan_ids (list): Stations to read. Stations missing from a table are NaN in its chunks.
+
+            Yields:
+            - tuple: (timestamps, values) where timestamps is a datetime64[s] array of up to chunk_rows rows
+              and values a float64 array of shape (rows, len(naptan_ids)) with NaN for missing values.
+
+            Raises:
+            - Exception: If an error occurs while reading.
+        """
+        try:
+            naptan_ids = list(naptan_ids)
+            for table, table_stations in self.tables_in_range(start, end, naptan_ids):
+                yield from self.iter_table_arrays(table, table_stations, start, end, naptan_ids)
+        except Exception as err:
+            raise Exception(f"[iter_arrays] {err}")
+
+    def iter_frames(self, start, end, naptan_ids):
+        """
+            Streams crowding data of selected stations in a time range as pandas chunks in time order.
+
+            Args:
+            - start (str): First timestamp of the range, 'YYYY-MM-DD HH:MM:SS'.
+            - end (str): Last timestamp of the range, 'YYYY-MM-DD HH:MM:SS'.
+            - naptan_ids (list): Stations to read, one column each.
+
+            Yields:
+            - pandas.DataFrame: Up to chunk_rows rows indexed by c_timestamp with NaN for missing values.
+        """
+        naptan_ids = list(naptan_ids)
+        for timestamps, values in self.iter_arrays(start, end, naptan_ids):
+            yield pd.DataFrame(values, index=pd.DatetimeIndex(timestamps, name='c_timestamp'), columns=naptan_ids)
+
+    def read_range(self, start, end, naptan_ids):
+        """
+            Reads crowding data of selected stations in a time range into one DataFrame.
+
+            Args:
+            - start (str): First timestamp of the range, 'YYYY-MM-DD HH:MM:SS'.
+            - end (str): Last timestamp of the range, 'YYYY-MM-DD HH:MM:SS'.
+            - naptan_ids (list): Stations to read, one column each.
+
+            Returns:
+            - pandas.DataFrame: Rows indexed by c_timestamp with NaN for missing values.
+        """
+        naptan_ids = list(naptan_ids)
+        frames = list(self.iter_frames(start, end, naptan_ids))
+        if not frames:
+            return pd.DataFrame(columns=naptan_ids, index=pd.DatetimeIndex([], name='c_timestamp'), dtype=np.float64)
+        return pd.concat(frames)
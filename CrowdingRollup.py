@@ -0,0 +1,234 @@
+import numpy as np
+import pandas as pd
+import psycopg2.extras
+
+
+class CrowdingRollup:
+    """
+        A class to maintain downsampled per-station crowding rollups incrementally as rows are written.
+
+        Each resolution has its own table with one row per station and bucket holding the sum and maximum of the
+        sampled values, the number of samples and the number of missing values. A batch of rows is aggregated in
+        memory and only the buckets it touches are upserted, adding to what earlier batches stored. Applied in
+        the transaction that inserts the rows, the rollups never count a row twice or miss one.
+
+        Attributes:
+        - table_prefix (str): Prefix of the rollup tables, one table <prefix>_<resolution> per resolution.
+        - resolutions (dict): Bucket width in seconds per resolution name.
+    """
+    resolutions = {'5min': 300, 'hour': 3600, 'day': 86400}
+
+    def __init__(self, table_prefix='crowding_rollup'):
+        """
+            Initializes the CrowdingRollup instance.
+
+            Args:
+            - table_prefix (str): Prefix of the rollup tables.
+        """
+        self.table_prefix = table_prefix
+
+    def table_name(self, resolution):
+        """
+            Returns the rollup table of a resolution.
+
+            Args:
+            - resolution (str): Resolution name, a key of resolutions.
+
+            Returns:
+            - str: Table name.
+        """
+        if resolution not in self.resolutions:
+            raise ValueError(f"Unknown resolution {resolution}, expected one of {tuple(self.resolutions)}.")
+        return f"{self.table_prefix}_{resolution}"
+
+    def create_tables(self, cursor):
+        """
+            Creates the rollup tables if they do not exist, within the current transaction.
+
+            Args:
+            - cursor: psycopg2 cursor object.
+        """
+        for resolution in self.resolutions:
+            cursor.execute(f"""
+                CREATE TABLE IF NOT EXISTS {self.table_name(resolution)} (
+                    naptan_id TEXT NOT NULL,
+                    bucket TIMESTAMP NOT NULL,
+                    value_sum DOUBLE PRECISION NOT NULL,
+                    value_max NUMERIC(5,4),
+                    samples INTEGER NOT NULL,
+                    missing INTEGER NOT NULL,
+                    PRIMARY KEY (bucket, naptan_id)
+                );
+            """)
+
+    @staticmethod
+    def rows_to_arrays(rows):
+        """
+            Converts dumper rows to arrays.
+
+            Args:
+            - rows (list): Rows as (timestamp_str, {naptan_id: value or None}).
+
+            Returns:
+            - tuple: (timestamps, values, present, naptan_ids) where timestamps is datetime64[s], values float64
+              (rows, stations) with NaN for missing values and present tells which stations each row had.
+        """
+        naptan_ids = sorted({n_id for _, data in rows for n_id in data})
+        column = {n_id: index for index, n_id in enumerate(naptan_ids)}
+        values = np.full((len(rows), len(naptan_ids)), np.nan)
+        present = np.zeros((len(rows), len(naptan_ids)), dtype=bool)
+        for row_index, (_, data) in enumerate(rows):
+            for n_id, value in data.items():
+                present[row_index, column[n_id]] = True
+                if value is not None:
+                    values[row_index, column[n_id]] = value
+        timestamps = np.array([timestamp for timestamp, _ in rows], dtype='datetime64[s]')
+        return timestamps, values, present, naptan_ids
+
+    def aggregate(self, timestamps, values, naptan_ids, present=None):
+        """
+            Aggregates rows into the buckets of every resolution.
+
+            Args:
+            - timestamps (numpy.ndarray): datetime64[s] timestamps of the rows.
+            - values (numpy.ndarray): float64 values of shape (rows, stations) with NaN for missing values.
+            - naptan_ids (list): Station of each column of values.
+            - present (numpy.ndarray or None): Which stations each row had, all stations if None. Stations a row
+              did not have count neither as samples nor as missing.
+
+            Returns:
+            - dict: Per resolution a list of (naptan_id, bucket, value_sum, value_max, samples, missing) tuples of
+              the buckets the rows touch.
+        """
+        seconds = timestamps.astype('datetime64[s]').astype(np.int64)
+        valid = ~np.isnan(values)
+        if present is None:
+            present = np.ones(values.shape, dtype=bool)
+        valid &= present
+        missing = present & ~valid
+        filled = np.where(valid, values, 0.0)
+
+        aggregates = {}
+        for resolution, width in self.resolutions.items():
+            buckets, inverse = np.unique(seconds // width * width, return_inverse=True)
+            shape = (len(buckets), len(naptan_ids))
+            sums = np.zeros(shape)
+            maxes = np.full(shape, np.nan)
+            samples = np.zeros(shape, dtype=np.int64)
+            missing_counts = np.zeros(shape, dtype=np.int64)
+            np.add.at(sums, inverse, filled)
+            np.fmax.at(maxes, inverse, np.where(valid, values, np.nan))
+            np.add.at(samples, inverse, valid)
+            np.add.at(missing_counts, inverse, missing)
+
+            bucket_times = buckets.astype('datetime64[s]').astype(object)
+            touched = np.argwhere(samples + missing_counts > 0)
+            aggregates[resolution] = [(naptan_ids[station], bucket_times[bucket], float(sums[bucket, station]),
+                                       None if np.isnan(maxes[bucket, station]) else float(maxes[bucket, station]),
+                                       int(samples[bucket, station]), int(missing_counts[bucket, station]))
+                                      for bucket, station in touched]
+        return aggregates
+
+    def apply_arrays(self, cursor, timestamps, values, naptan_ids, present=None):
+        """
+            Adds rows given as arrays to the rollups, within the current transaction.
+
+            Args:
+            - cursor: psycopg2 cursor object.
+            - timestamps (numpy.ndarray): datetime64[s] timestamps of the rows.
+            - values (numpy.ndarray): float64 values of shape (rows, stations) with NaN for missing values.
+            - naptan_ids (list): Station of each column of values.
+            - present (numpy.ndarray or None): Which stations each row had, all stations if None.
+
+            Returns:
+            - int: Number of bucket rows upserted.
+        """
+        upserted = 0
+        for resolution, bucket_rows in self.aggregate(timestamps, values, naptan_ids, present).items():
+            if not bucket_rows:
+                continue
+            table = self.table_name(resolution)
+            psycopg2.extras.execute_values(cursor, f"""
+                INSERT INTO {table} AS rollup (naptan_id, bucket, value_sum, value_max, samples, missing)
+                VALUES %s
+                ON CONFLICT (bucket, naptan_id) DO UPDATE SET
+                    value_sum = rollup.value_sum + EXCLUDED.value_sum,
+                    value_max = GREATEST(rollup.value_max, EXCLUDED.value_max),
+                    samples = rollup.samples + EXCLUDED.samples,
+                    missing = rollup.missing + EXCLUDED.missing
+            """, bucket_rows, page_size=1000)
+            upserted += len(bucket_rows)
+        return upserted
+
+    def apply(self, cursor, rows):
+        """
+            Adds dumper rows to the rollups, within the current transaction.
+
+            Args:
+            - cursor: psycopg2 cursor object.
+            - rows (list): Rows as (timestamp_str, {naptan_id: value or None}).
+
+            Returns:
+            - int: Number of bucket rows upserted.
+        """
+        if not rows:
+            return 0
+        timestamps, values, present, naptan_ids = self.rows_to_arrays(rows)
+        return self.apply_arrays(cursor, timestamps, values, naptan_ids, present)
+
+    def backfill(self, connection, reader, start, end):
+        """
+            Adds rows already in the data tables to the rollups, one reader chunk per transaction.
+            Only meant for ranges written before the rollups were maintained, rows of other ranges would be
+            counted twice.
+
+            Args:
+            - connection: psycopg2 connection the rollups are written with.
+            - reader (CrowdingReader): Reader of the data tables.
+            - start (str): First timestamp of the range, 'YYYY-MM-DD HH:MM:SS'.
+            - end (str): Last timestamp of the range, 'YYYY-MM-DD HH:MM:SS'.
+
+            Returns:
+            - int: Number of rows added.
+
+            Raises:
+            - Exception: If reading or writing fails. Chunks committed before the failure stay added.
+        """
+        try:
+            rows_added = 0
+            for table, table_stations in reader.tables_in_range(start, end):
+                naptan_ids = list(table_stations)
+                for timestamps, values in reader.iter_table_arrays(table, table_stations, start, end, naptan_ids):
+                    with connection.cursor() as cursor:
+                        self.create_tables(cursor)
+                        self.apply_arrays(cursor, timestamps, values, naptan_ids)
+                    connection.commit()
+                    rows_added += len(timestamps)
+            return rows_added
+        except Exception as err:
+            connection.rollback()
+            raise Exception(f"[backfill] {err}")
+
+    def read(self, cursor, resolution, start, end, naptan_ids=None):
+        """
+            Reads the rollups of a resolution and time range.
+
+            Args:
+            - cursor: psycopg2 cursor object.
+            - resolution (str): Resolution name, a key of resolutions.
+            - start (str): First bucket of the range, 'YYYY-MM-DD HH:MM:SS'.
+            - end (str): Last bucket of the range, 'YYYY-MM-DD HH:MM:SS'.
+            - naptan_ids (list or None): Stations to read, all stations if None.
+
+            Returns:
+            - pandas.DataFrame: Columns naptan_id, bucket, mean, max, samples and missing, ordered by bucket.
+        """
+        station_filter = "" if naptan_ids is None else "AND naptan_id = ANY(%(naptan_ids)s)"
+        cursor.execute(f"""
+            SELECT naptan_id, bucket, value_sum / NULLIF(samples, 0), value_max::float8, samples, missing
+            FROM {self.table_name(resolution)}
+            WHERE bucket BETWEEN %(start)s AND %(end)s {station_filter}
+            ORDER BY bucket, naptan_id;
+        """, {'start': start, 'end': end, 'naptan_ids': list(naptan_ids or [])})
+        frame = pd.DataFrame(cursor.fetchall(), columns=['naptan_id', 'bucket', 'mean', 'max', 'samples', 'missing'])
+        return frame.astype({'mean': np.float64, 'max': np.float64})
@@ -0,0 +1,169 @@
+import re
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from tube_functions import get_crowding_data
+from Metrics import registry
+
+
+class CrowdingSweeper:
+    """
+        A class to fetch crowding data of many stations concurrently and fill a dumper row.
+
+        Failed stations are retried until the sweep deadline. Stations that still fail are recorded as missing
+        and counted by error reason. The sweep is only dropped when too large a fraction of stations fails.
+
+        Attributes:
+        - max_workers (int): Maximum number of crowding requests in flight at once.
+        - pause_between_stations_sec (float): Pause of each worker after a request in seconds.
+        - station_retries (int): Number of retries of a failed station within a sweep.
+        - sweep_deadline_sec (float or None): Time after which the stations still pending are given up, in seconds.
+        - max_failed_fraction (float): Largest fraction of failed stations for which the sweep is kept.
+        - error_reasons (collections.Counter): Number of failed stations per error reason since start.
+        - stations_failed (int): Number of failed stations since start.
+        - sweeps_dropped (int): Number of sweeps dropped because too many stations failed.
+        - _executor (ThreadPoolExecutor): Pool of worker threads. Note: Internal attribute, avoid direct access.
+    """
+    def __init__(self, max_workers=1, pause_between_stations_sec=0.0, station_retries=1, sweep_deadline_sec=None,
+                 max_failed_fraction=0.0):
+        """
+            Initializes the CrowdingSweeper instance.
+
+            Args:
+            - max_workers (int): Maximum number of crowding requests in flight at once.
+            - pause_between_stations_sec (float): Pause of each worker after a request in seconds.
+            - station_retries (int): Number of retries of a failed station within a sweep.
+            - sweep_deadline_sec (float or None): Time after which the stations still pending are given up, in seconds.
+            - max_failed_fraction (float): Largest fraction of failed stations for which the sweep is kept.
+        """
+        if max_workers < 1:
+            raise ValueError(f"max_workers must be at least 1, got {max_workers}.")
+        self.max_workers = max_workers
+        self.pause_between_stations_sec = pause_between_stations_sec
+        self.station_retries = station_retries
+        self.sweep_deadline_sec = sweep_deadline_sec
+        self.max_failed_fraction = max_failed_fraction
+        self.error_reasons = Counter()
+        self.stations_failed = 0
+        self.sweeps_dropped = 0
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="sweeper")
+
+    @staticmethod
+    def error_reason(err):
+        """
+            Classifies an error of get_crowding_data.
+
+            Args:
+            - err (Exception): The error.
+
+            Returns:
+            - str: Short reason such as 'HTTP 503', 'timeout', 'connection' or 'parse'.
+        """
+        message = str(err)
+        http_error = re.search(r"HTTP Error (\d+)", message)
+        if http_error:
+            return f"HTTP {http_error.group(1)}"
+        lowered = message.lower()
+        if 'timed out' in lowered or 'timeout' in lowered:
+            return 'timeout'
+        if 'connection' in lowered or 'errno' in lowered or 'name or service' in lowered:
+            return 'connection'
+        if 'dataavailable' in lowered or 'percentageofbaseline' in lowered or 'json' in lowered or 'expecting' in lowered:
+            return 'parse'
+        return 'other'
+
+    def _fetch_station(self, naptan_id, deadline):
+        """
+            Fetches crowding data of a single station, retrying until the retries or the deadline run out,
+            and pauses the worker after each request.
+
+            Args:
+            - naptan_id (str): The Naptan ID of the station.
+            - deadline (float or None): Monotonic time after which no retry is started.
+
+            Returns:
+            - tuple: (crowding, error) where crowding is a float or None and error is None on success.
+        """
+        attempt = 0
+        while True:
+            try:
+                with registry.timer('station_request'):
+                    return get_crowding_data(naptan_id), None
+            except Exception as err:
+                registry.record_error(err)
+                error = err
+            finally:
+                if self.pause_between_stations_sec > 0:
+                    time.sleep(self.pause_between_stations_sec)
+            attempt += 1
+            if attempt > self.station_retries or (deadline is not None and time.monotonic() >= deadline):
+                return None, error
+
+    def sweep(self, naptan_ids, dumper):
+        """
+            Fetches crowding data of all given stations and adds it to the latest row of the dumper.
+            Stations are added to the row in the order of naptan_ids regardless of completion order,
+            failed stations are added as missing.
+
+            Args:
+            - naptan_ids (tuple): Naptan IDs of the stations to sweep.
+            - dumper (DataDumper): Dumper whose latest row is filled.
+
+            Returns:
+            - collections.Counter: Number of failed stations per error reason in this sweep.
+
+            Raises:
+            - Exception: If the fraction of failed stations is larger than max_failed_fraction.
+        """
+        try:
+            with registry.timer('sweep'):
+                deadline = None
+                if self.sweep_deadline_sec is not None:
+                    deadline = time.monotonic() + self.sweep_deadline_sec
+
+                futures = [self._executor.submit(self._fetch_station, naptan_id, deadline)
+                           for naptan_id in naptan_ids]
+
+                results = []
+                reasons = Counter()
+                for future in futures:
+                    try:
+                        timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+                        crowding, error = future.result(timeout=timeout)
+                    except TimeoutError:
+                        future.cancel()
+                        crowding, error = None, 'deadline'
+                    if error is not None:
+                        reason = error if isinstance(error, str) else self.error_reason(error)
+                        reasons[reason] += 1
+                        registry.inc('station_failures_total', reason=reason)
+                    results.append(crowding)
+
+                failed = sum(reasons.values())
+                self.error_reasons.update(reasons)
+                self.stations_failed += failed
+
+                if naptan_ids and failed / len(naptan_ids) > self.max_failed_fraction:
+                    self.sweeps_dropped += 1
+                    details = ', '.join(f"{reason}: {count}" for reason, count in reasons.most_common())
+                    raise Exception(f"{failed}/{len(naptan_ids)} stations failed ({details}).")
+
+                for naptan_id, crowding in zip(naptan_ids, results):
+                    dumper.add_station_to_row(station_name=naptan_id, crowding_data=crowding)
+                return reasons
+        except Exception as err:
+            raise Exception(f"[sweep] {err}")
+
+    def get_stats(self):
+        """
+            Returns failure counters of the sweeps.
+
+            Returns:
+            - dict: Failed stations in total and per error reason and the number of dropped sweeps.
+        """
+        return {'stations_failed': self.stations_failed, 'sweeps_dropped': self.sweeps_dropped,
+                'error_reasons': dict(self.error_reasons)}
+
+    def close(self):
+        """Shuts down the worker threads."""
+        self._executor.shutdown(wait=True, cancel_futures=True)
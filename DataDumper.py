@@ -1,27 +1,56 @@
 from datetime import datetime, timedelta
-from utils import generate_timestamp
+import numpy as np
+from utils import generate_timestamp, generate_epoch, epoch_to_timestamp
 
 
 class DataDumper:
     """
         A class to manage data dumping operations.
 
+        In the default mode rows are kept as [timestamp_str, {naptan_id: float}] lists. In the columnar mode
+        rows are kept in blocks of NumPy arrays sharing one station index: int64 epoch timestamps and a float
+        matrix with NaN for missing values. A new block is started whenever the station set changes.
+
         Attributes:
         - last_save_time (datetime): Timestamp of the last data save operation.
         - save_interval (timedelta): Time interval between data saves.
+        - columnar (bool): Whether rows are kept in the columnar layout.
+        - monitor (StationMonitor or None): Monitor fed with the stations and values of every row, None for none.
         - _dumper (list): List to store data dumps. Note: Internal attribute, avoid direct access.
+        - _stations (tuple): Station sequence of the current columnar block. Note: Internal attribute.
+        - _station_index (dict): Column of each station in the current columnar block. Note: Internal attribute.
+        - _timestamps (numpy.ndarray): Epoch timestamps of the current columnar block. Note: Internal attribute.
+        - _values (numpy.ndarray): Crowding values of the current columnar block. Note: Internal attribute.
+        - _row_count (int): Number of used rows in the current columnar block. Note: Internal attribute.
+        - _blocks (list): Sealed columnar blocks as (stations, timestamps, values). Note: Internal attribute.
+        - _row_open (bool): Whether the latest row was created and not yet closed, so drop_last_row may drop it.
+          Note: Internal attribute, avoid direct access.
     """
-    def __init__(self, save_interval_min):
+    def __init__(self, save_interval_min, columnar=False, initial_capacity=32, monitor=None):
         """
             Initializes the DataDumper instance.
 
             Args:
             - save_interval_min (int): Interval in minutes between data saves.
+            - columnar (bool): Whether rows are kept in the columnar layout.
+            - initial_capacity (int): Number of rows preallocated for a columnar block.
+            - monitor (StationMonitor or None): Monitor fed with the stations and values of every row.
         """
         self.last_save_time = None
         self.save_interval = timedelta(minutes=save_interval_min)
+        self.columnar = columnar
+        self.monitor = monitor
         self._dumper = []
 
+        self._initial_capacity = max(1, initial_capacity)
+        self._stations = ()
+        self._station_index = {}
+        self._timestamps = np.empty(0, dtype=np.int64)
+        self._values = np.empty((0, 0), dtype=np.float64)
+        self._row_count = 0
+        self._blocks = []
+        self._row_open = False
+
     def set_save_time(self, last_save_time):
         """
             Sets the timestamp of the last data save operation.
@@ -31,18 +60,73 @@ class DataDumper:
         """
         self.last_save_time = last_save_time
 
-    def create_new_row(self):
-        """Creates a new row in the dumper list with a timestamp."""
-        timestamp_str = generate_timestamp()
-        self._dumper.append([timestamp_str, {}])
+    def set_stations(self, naptan_ids):
+        """
+            Sets the station sequence of the columnar layout and the monitor. A new block is started if the
+            stations changed. Only sets the stations of the monitor in the default mode.
+
+            Args:
+            - naptan_ids (tuple): Naptan IDs of the stations.
+        """
+        if self.monitor is not None:
+            self.monitor.set_stations(naptan_ids)
+        if not self.columnar or naptan_ids == self._stations:
+            return
+
+        self._seal_block()
+        self._stations = tuple(naptan_ids)
+        self._station_index = {naptan_id: index for index, naptan_id in enumerate(self._stations)}
+        self._timestamps = np.empty(self._initial_capacity, dtype=np.int64)
+        self._values = np.empty((self._initial_capacity, len(self._stations)), dtype=np.float64)
+
+    def _seal_block(self):
+        """Moves the used rows of the current columnar block to the sealed blocks."""
+        if self._row_count != 0:
+            self._blocks.append((self._stations, self._timestamps[:self._row_count].copy(),
+                                 self._values[:self._row_count].copy()))
+        self._row_count = 0
+
+    def create_new_row(self, epoch=None):
+        """
+            Creates a new row in the dumper list with a timestamp.
+
+            Args:
+            - epoch (int or None): Time of the row in seconds since the Unix epoch, the current time if None.
+
+            Raises:
+            - Exception: If no stations were set in the columnar mode.
+        """
+        if self.monitor is not None:
+            self.monitor.begin_sweep(generate_epoch() if epoch is None else epoch)
+        if not self.columnar:
+            timestamp_str = generate_timestamp() if epoch is None else epoch_to_timestamp(epoch)
+            self._dumper.append([timestamp_str, {}])
+            self._row_open = True
+            return
+
+        try:
+            if not self._stations:
+                raise ValueError("Stations of the columnar layout are not set.")
+            if self._row_count == len(self._timestamps):
+                capacity = 2 * len(self._timestamps)
+                self._timestamps = np.resize(self._timestamps, capacity)
+                self._values = np.resize(self._values, (capacity, len(self._stations)))
+            self._timestamps[self._row_count] = generate_epoch() if epoch is None else epoch
+            self._values[self._row_count].fill(np.nan)
+            self._row_count += 1
+            self._row_open = True
+        except Exception as err:
+            raise Exception(f"[create_new_row] {err}")
 
-    def add_station_to_row(self, station_name, crowding_data):
+    def add_station_to_row(self, station_name, crowding_data, sampled=True):
         """
             Adds station crowding data to the latest row in the dumper list.
 
             Args:
             - station_name (str): Name of the station.
             - crowding_data (float or None): Crowding data for the station.
+            - sampled (bool): Whether the data was fetched in this sweep, False for a value carried over from an
+              earlier sweep or a gap, which is not passed to the monitor.
 
             Raises:
             - IndexError: If there are no rows in the dumper list to add data to.
@@ -50,13 +134,55 @@ class DataDumper:
         try:
             if crowding_data is not None and not isinstance(crowding_data, float) and crowding_data != 0:
                 raise ValueError("Wrong crowding data.")
-            self._dumper[-1][1][station_name] = crowding_data
+            if sampled and self.monitor is not None:
+                self.monitor.observe(station_name, crowding_data)
+            if not self.columnar:
+                self._dumper[-1][1][station_name] = crowding_data
+                return
+            if self._row_count == 0:
+                raise IndexError("There are no rows to add data to.")
+            self._values[self._row_count - 1, self._station_index[station_name]] = \
+                np.nan if crowding_data is None else crowding_data
         except Exception as err:
             raise Exception(f"[add_station_to_row] {err}")
 
+    def close_row(self):
+        """Marks the latest row as complete, so drop_last_row no longer drops it."""
+        self._row_open = False
+
     def clear_data(self):
         """Clears all data in the dumper list."""
         self._dumper.clear()
+        self._blocks.clear()
+        self._row_count = 0
+        self._row_open = False
+
+    def drop_first_rows(self, count):
+        """
+            Drops the oldest rows, e.g. the rows a database handler committed from a copy of get_dumper.
+
+            Args:
+            - count (int): Number of rows to drop.
+        """
+        if count <= 0:
+            return
+        if not self.columnar:
+            del self._dumper[:count]
+            return
+        while count > 0 and self._blocks:
+            stations, timestamps, values = self._blocks[0]
+            if len(timestamps) <= count:
+                self._blocks.pop(0)
+                count -= len(timestamps)
+            else:
+                self._blocks[0] = (stations, timestamps[count:], values[count:])
+                count = 0
+        count = min(count, self._row_count)
+        if count > 0:
+            remaining = self._row_count - count
+            self._timestamps[:remaining] = self._timestamps[count:self._row_count]
+            self._values[:remaining] = self._values[count:self._row_count]
+            self._row_count = remaining
 
     def is_time_to_save(self):
         """
@@ -78,15 +204,30 @@ class DataDumper:
             raise Exception(f"[is_time_to_save] {err}")
 
     def drop_last_row(self):
-        """Drops the last row from the dumper list."""
-        if len(self._dumper) != 0:
-            self._dumper.pop()
+        """Drops the latest row if it is still open, i.e. created and not closed with close_row."""
+        if not self._row_open:
+            return
+        self._row_open = False
+        if not self.columnar:
+            if len(self._dumper) != 0:
+                self._dumper.pop()
+        elif self._row_count != 0:
+            self._row_count -= 1
 
     def get_dumper(self):
         """
-        Returns the dumper list.
+        Returns the dumper list. In the columnar mode the list is built from the blocks.
 
         Returns:
         - list: The dumper list.
         """
-        return self._dumper
+        if not self.columnar:
+            return self._dumper
+
+        rows = []
+        blocks = self._blocks + [(self._stations, self._timestamps[:self._row_count], self._values[:self._row_count])]
+        for stations, timestamps, values in blocks:
+            for epoch, row_values in zip(timestamps.tolist(), values.tolist()):
+                data = {naptan_id: (None if value != value else value) for naptan_id, value in zip(stations, row_values)}
+                rows.append([epoch_to_timestamp(epoch), data])
+        return rows
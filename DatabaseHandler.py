@@ -1,23 +1,61 @@
+import hashlib
+import io
+import time
 import psycopg2
+import psycopg2.extras
+import psycopg2.pool
 from utils import timestamp_format
+from Metrics import registry
+from StorageBackend import StorageBackend
 
 
-class DatabaseHandler:
+class DatabaseHandler(StorageBackend):
     """
-        A class to handle database operations for crowding data.
+        A class to handle database operations for crowding data, the PostgreSQL storage backend.
 
         Attributes:
         - max_rows_in_commit (int): Maximum number of rows to insert in a single commit.
         - current_crowding_data_table (str): Name of the current crowding data table.
         - max_rows (int): Maximum number of rows allowed in a table.
         - db_params (dict): Database connection parameters.
-        - connection: psycopg2 connection object.
+        - connection: psycopg2 connection object, borrowed from the pool while connected.
         - cursor: psycopg2 cursor object.
         - rows_left (int): Number of rows left in the current table.
         - stations_sequence (tuple): Sequence of station IDs.
         - planned_to_insert (list): List of rows planned for insertion.
+        - load_method (str): How planned rows are loaded, 'values' for INSERT ... VALUES, 'copy' for COPY FROM STDIN
+          or 'prepared' for a per-connection prepared INSERT statement.
+        - pool_size (int): Maximum number of pooled connections.
+        - health_check_after_sec (float): Idle time after which a pooled connection is checked before reuse.
+        - metrics (dict): Counters of connection reuse and flush latency.
+        - pool_class (type): Class of the connection pool, psycopg2.pool.ThreadedConnectionPool by default.
+        - catalog_table (str): Table recording the time range and station columns of each data table.
+        - catalog_definition (str): CREATE TABLE statement of the catalog, formatted with catalog_table.
+        - rollup (CrowdingRollup or None): Rollups updated in the transaction of each insert, None for no rollups.
+        - checkpoint (CollectorCheckpoint or None): Checkpoint the current table is resumed from and recorded in after
+          each flush, None to introspect the table on start.
+        - _pool (psycopg2.pool.ThreadedConnectionPool): Connection pool. Note: Internal attribute, avoid direct access.
+        - _released_at (dict): Monotonic time each pooled connection was returned. Note: Internal attribute.
+        - _prepared (dict): Names of statements prepared on each connection. Note: Internal attribute.
+        - _verify_planned (bool): Whether the next batch may hold rows already committed, i.e. after a start, a
+          failed batch or a batch of committed rows only, e.g. rows a spool replays after a crash.
+          Note: Internal attribute, avoid direct access.
     """
-    def __init__(self, max_rows_in_commit, current_crowding_data_table, max_rows, db_params):
+    load_methods = ('values', 'copy', 'prepared')
+    pool_class = psycopg2.pool.ThreadedConnectionPool
+    catalog_table = 'crowding_catalog'
+    catalog_definition = """
+        CREATE TABLE IF NOT EXISTS {catalog_table} (
+            table_name TEXT PRIMARY KEY,
+            naptan_ids TEXT[] NOT NULL,
+            first_timestamp TIMESTAMP,
+            last_timestamp TIMESTAMP,
+            row_count BIGINT NOT NULL DEFAULT 0
+        );
+    """
+
+    def __init__(self, max_rows_in_commit, current_crowding_data_table, max_rows, db_params, load_method='values',
+                 pool_size=2, health_check_after_sec=30, rollup=None, checkpoint=None):
         """
             Initializes the DatabaseHandler instance.
 
@@ -26,20 +64,42 @@ class DatabaseHandler:
             - current_crowding_data_table (str): Name of the current crowding data table.
             - max_rows (int): Maximum number of rows allowed in a table.
             - db_params (dict): Database connection parameters.
+            - load_method (str): How planned rows are loaded, 'values', 'copy' or 'prepared'.
+            - pool_size (int): Maximum number of pooled connections.
+            - health_check_after_sec (float): Idle time after which a pooled connection is checked before reuse.
+            - rollup (CrowdingRollup or None): Rollups updated in the transaction of each insert.
+            - checkpoint (CollectorCheckpoint or None): Checkpoint the current table is resumed from, without
+              querying its row count and columns, when it names the given table or no table is given.
         """
-        self.max_rows = max_rows
-        self.current_crowding_data_table = current_crowding_data_table
-        self.rows_left = 0
-        self.stations_sequence = ()
+        if load_method not in self.load_methods:
+            raise ValueError(f"Unknown load method {load_method}, expected one of {self.load_methods}.")
+        super().__init__(max_rows_in_commit, current_crowding_data_table, max_rows)
+        self.load_method = load_method
 
         self.db_params = db_params
         self.connection = None
         self.cursor = None
 
-        self.max_rows_in_commit = max_rows_in_commit
-        self.planned_to_insert = []
+        self.pool_size = pool_size
+        self.health_check_after_sec = health_check_after_sec
+        self.metrics.update({'connections_opened': 0, 'connections_reused': 0, 'reconnects': 0})
+        self._pool = None
+        self._pool_opened_at = 0.0
+        self._released_at = {}
+        self._prepared = {}
+        self._verify_planned = True
+
+        self.rollup = rollup
+        self._rollup_tables_created = False
 
-        if self.current_crowding_data_table:
+        self.checkpoint = checkpoint
+        state = self.checkpoint.get('database') if self.checkpoint is not None else None
+
+        if state and current_crowding_data_table in (None, state['table']):
+            self.current_crowding_data_table = state['table']
+            self.stations_sequence = tuple(state['stations_sequence'])
+            self.rows_left = self.max_rows - state['row_count']
+        elif self.current_crowding_data_table:
             self.connect()
 
             row_num_que = f"SELECT COUNT(*) FROM {self.current_crowding_data_table}"
@@ -55,32 +115,212 @@ class DatabaseHandler:
             existing_columns = tuple(sorted(existing_columns))
             self.stations_sequence = existing_columns
 
+            self.register_table(self.current_crowding_data_table, existing_columns, scan_existing=True)
+            self.connection.commit()
             self.disconnect()
 
+    def _discard_connection(self, connection):
+        """
+            Closes a pooled connection and forgets its state.
+
+            Args:
+            - connection: psycopg2 connection object.
+        """
+        self._released_at.pop(connection, None)
+        self._prepared.pop(connection, None)
+        self._pool.putconn(connection, close=True)
+
+    def _is_healthy(self, connection):
+        """
+            Checks if a pooled connection can be reused.
+
+            Args:
+            - connection: psycopg2 connection object.
+
+            Returns:
+            - bool: True if the connection is open and, after a long idle time, answers a query.
+        """
+        if connection.closed:
+            return False
+        released_at = self._released_at.get(connection, self._pool_opened_at)
+        if time.monotonic() - released_at < self.health_check_after_sec:
+            return True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            connection.rollback()
+            return True
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            return False
+
     def connect(self):
-        """Establishes a connection to the database."""
+        """Borrows a healthy connection from the pool, opening the pool or new connections if needed."""
         try:
             self.disconnect()
-            self.connection = psycopg2.connect(**self.db_params)
+            if self._pool is None:
+                self._pool = self.pool_class(self.pool_size, self.pool_size, **self.db_params)
+                self._pool_opened_at = time.monotonic()
+
+            connection = self._pool.getconn()
+            for _ in range(self.pool_size):
+                if self._is_healthy(connection):
+                    break
+                self._discard_connection(connection)
+                self.metrics['reconnects'] += 1
+                connection = self._pool.getconn()
+
+            if connection in self._released_at:
+                self.metrics['connections_reused'] += 1
+            else:
+                self.metrics['connections_opened'] += 1
+
+            self.connection = connection
             self.cursor = self.connection.cursor()
         except Exception as err:
             raise Exception(f"[connect] {err}")
 
     def disconnect(self):
-        """Closes the database connection."""
+        """Returns the database connection to the pool, closing it if it is broken."""
         try:
             if self.cursor is not None:
                 self.cursor.close()
             if self.connection is not None:
-                self.connection.close()
+                if self.connection.closed:
+                    self._discard_connection(self.connection)
+                else:
+                    try:
+                        self.connection.rollback()
+                        self._released_at[self.connection] = time.monotonic()
+                        self._pool.putconn(self.connection)
+                    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                        self._discard_connection(self.connection)
             self.cursor = None
             self.connection = None
         except Exception as err:
             raise Exception(f"[disconnect] {err}")
 
+    def close(self):
+        """Returns the current connection and closes all pooled connections."""
+        try:
+            self.disconnect()
+            if self._pool is not None:
+                self._pool.closeall()
+            self._pool = None
+            self._released_at.clear()
+            self._prepared.clear()
+        except Exception as err:
+            raise Exception(f"[close] {err}")
+
+    def save_checkpoint(self):
+        """
+            Records the current table, its row count and station sequence in the checkpoint. A failure is only
+            recorded as an error, the rows are already committed.
+        """
+        if self.checkpoint is None or not self.current_crowding_data_table:
+            return
+        try:
+            self.checkpoint.update('database', {'table': self.current_crowding_data_table,
+                                                'row_count': self.max_rows - self.rows_left,
+                                                'stations_sequence': list(self.stations_sequence)})
+        except Exception as err:
+            registry.record_error(f"[save_checkpoint] {err}")
+
+    def ensure_catalog(self):
+        """Creates the catalog table if it does not exist, within the current transaction."""
+        self.cursor.execute(self.catalog_definition.format(catalog_table=self.catalog_table))
+
+    def register_table(self, table_name, naptan_ids, scan_existing=False):
+        """
+            Records a data table and its station columns in the catalog within the current transaction.
+            Stations of an already registered table are merged with the given ones.
+
+            Args:
+            - table_name (str): Name of the data table.
+            - naptan_ids (tuple): Station columns of the table.
+            - scan_existing (bool): Whether to take the time range and row count from rows already in the table
+              if it is not registered yet.
+        """
+        self.ensure_catalog()
+        if scan_existing:
+            self.cursor.execute(f"SELECT 1 FROM {self.catalog_table} WHERE table_name = %s", (table_name,))
+            scan_existing = self.cursor.fetchone() is None
+        if scan_existing:
+            source = f"SELECT %s, %s, MIN(c_timestamp), MAX(c_timestamp), COUNT(*) FROM {table_name}"
+        else:
+            source = "VALUES (%s, %s, NULL::timestamp, NULL::timestamp, 0)"
+        self.cursor.execute(f"""
+            INSERT INTO {self.catalog_table} (table_name, naptan_ids, first_timestamp, last_timestamp, row_count)
+            {source}
+            ON CONFLICT (table_name) DO UPDATE SET naptan_ids = ARRAY(
+                SELECT DISTINCT unnest({self.catalog_table}.naptan_ids || EXCLUDED.naptan_ids) ORDER BY 1);
+        """, (table_name, list(naptan_ids)))
+
+    def update_catalog(self):
+        """Extends the catalog time range and row count of the current table by the planned rows."""
+        timestamps = [timestamp for timestamp, _ in self.planned_to_insert]
+        self.cursor.execute(f"""
+            UPDATE {self.catalog_table}
+            SET first_timestamp = LEAST(first_timestamp, %s::timestamp),
+                last_timestamp = GREATEST(last_timestamp, %s::timestamp),
+                row_count = row_count + %s
+            WHERE table_name = %s;
+        """, (min(timestamps), max(timestamps), len(timestamps), self.current_crowding_data_table))
+
+    def update_rollups(self):
+        """Adds the planned rows to the rollups within the current transaction, creating their tables first."""
+        if self.rollup is None:
+            return
+        if not self._rollup_tables_created:
+            self.rollup.create_tables(self.cursor)
+        self.rollup.apply(self.cursor, self.planned_to_insert)
+
+    def read_rollup(self, resolution, start, end, naptan_ids=None):
+        """
+            Reads the rollups of a resolution and time range.
+
+            Args:
+            - resolution (str): Resolution name, '5min', 'hour' or 'day'.
+            - start (str): First bucket of the range, 'YYYY-MM-DD HH:MM:SS'.
+            - end (str): Last bucket of the range, 'YYYY-MM-DD HH:MM:SS'.
+            - naptan_ids (list or None): Stations to read, all stations if None.
+
+            Returns:
+            - pandas.DataFrame: Columns naptan_id, bucket, mean, max, samples and missing, ordered by bucket.
+        """
+        try:
+            if self.rollup is None:
+                raise Exception("No rollups configured.")
+            self.connect()
+            return self.rollup.read(self.cursor, resolution, start, end, naptan_ids)
+        except Exception as err:
+            raise Exception(f"[read_rollup] {err}")
+        finally:
+            self.disconnect()
+
+    def drop_committed_rows(self, table=None):
+        """
+            Drops the planned rows whose timestamps are already in a table within the current transaction, so rows
+            replayed after a crash between a commit and its acknowledgement are not inserted twice.
+
+            Args:
+            - table (str or None): Table holding a row per timestamp, the current table if None.
+
+            Returns:
+            - int: Number of planned rows dropped.
+        """
+        self.cursor.execute(f"""
+            SELECT to_char(c_timestamp, 'YYYY-MM-DD HH24:MI:SS') FROM {table or self.current_crowding_data_table}
+            WHERE c_timestamp = ANY(%s::timestamp[]);
+        """, ([timestamp for timestamp, _ in self.planned_to_insert],))
+        committed = {row[0] for row in self.cursor.fetchall()}
+        if committed:
+            self.planned_to_insert = [row for row in self.planned_to_insert if row[0] not in committed]
+            registry.inc('rows_deduplicated_total', len(committed))
+        return len(committed)
+
     def create_table(self, naptan_ids, timestamp):
         """
-            Creates a new table for crowding data.
+            Creates a new table for crowding data, or continues it if a replayed first row already created it.
 
             Args:
             - naptan_ids (list): List of station IDs.
@@ -91,83 +331,132 @@ class DatabaseHandler:
             column_definitions = ', '.join([f'"{n_id}" NUMERIC(5,4)' for n_id in naptan_ids])
 
             create_table_query = f"""
-                                    CREATE TABLE {new_table_name} (
+                                    CREATE TABLE IF NOT EXISTS {new_table_name} (
                                         c_timestamp TIMESTAMP PRIMARY KEY,
                                         {column_definitions}
                                     );
                                   """
 
             self.cursor.execute(create_table_query)
+            self.register_table(new_table_name, naptan_ids)
+            self.cursor.execute(f"SELECT COUNT(*) FROM {new_table_name}")
+            row_count = self.cursor.fetchone()[0]
             self.connection.commit()
 
             self.stations_sequence = naptan_ids
-            self.rows_left = self.max_rows
+            self.rows_left = self.max_rows - row_count
             self.current_crowding_data_table = new_table_name
             return True
         except Exception as err:
             raise Exception(f"[create_table] {err}")
 
+    def build_values_query(self):
+        """
+            Builds the INSERT ... VALUES query of the planned rows.
+
+            Returns:
+            - tuple: (query, values) where values are the parameters of the query.
+        """
+        values_list = []
+        stations_to_insert = ', '.join([f'"{n_id}"' for n_id in self.stations_sequence])
+        begin_insert_expr = f"""
+                INSERT INTO {self.current_crowding_data_table} (c_timestamp, {stations_to_insert})
+                VALUES
+        """
+        for timestamp, data in self.planned_to_insert:
+            insert_row_values = ['%s' if data[n_id] is not None else 'NULL' for n_id in self.stations_sequence]
+            insert_row_expr = f"""\t(TO_TIMESTAMP('{timestamp}','{timestamp_format}'), {', '.join(insert_row_values)})"""
+            begin_insert_expr += insert_row_expr + ',\n'
+            values_list.extend([data[n_id] for n_id in self.stations_sequence if data[n_id] is not None])
+        return begin_insert_expr[:-2], values_list
+
+    def build_copy_buffer(self):
+        """
+            Builds a COPY text format buffer of the planned rows, with \\N for missing values.
+
+            Returns:
+            - io.StringIO: Buffer positioned at its start.
+        """
+        lines = []
+        for timestamp, data in self.planned_to_insert:
+            cells = [timestamp]
+            cells.extend('\\N' if data[n_id] is None else repr(float(data[n_id])) for n_id in self.stations_sequence)
+            lines.append('\t'.join(cells))
+        return io.StringIO('\n'.join(lines) + '\n')
+
+    def prepare_insert_statement(self):
+        """
+            Prepares a single row INSERT of the current table and stations on the current connection, once per
+            connection, so later flushes over the same pooled connection reuse it.
+
+            Returns:
+            - str: Name of the prepared statement.
+        """
+        stations_to_insert = ', '.join([f'"{n_id}"' for n_id in self.stations_sequence])
+        statement_key = f"{self.current_crowding_data_table}({stations_to_insert})"
+        statement_name = f"insert_{hashlib.md5(statement_key.encode()).hexdigest()}"
+
+        prepared = self._prepared.setdefault(self.connection, set())
+        if statement_name not in prepared:
+            parameter_types = ', '.join(['timestamp'] + ['numeric'] * len(self.stations_sequence))
+            parameters = ', '.join([f'${index + 1}' for index in range(len(self.stations_sequence) + 1)])
+            self.cursor.execute(f"""
+                PREPARE {statement_name} ({parameter_types}) AS
+                INSERT INTO {self.current_crowding_data_table} (c_timestamp, {stations_to_insert})
+                VALUES ({parameters})
+            """)
+            prepared.add(statement_name)
+        return statement_name
+
     def insert_planned_rows(self):
-        """Inserts planned rows into the current crowding data table."""
+        """
+            Inserts planned rows into the current crowding data table. After a start or a failed batch, rows whose
+            timestamps are already in the table are dropped first and count as written.
+        """
         try:
             if len(self.planned_to_insert) == 0:
                 return False
 
-            values_list = []
-            stations_to_insert = ', '.join([f'"{n_id}"' for n_id in self.stations_sequence])
-            begin_insert_expr = f"""
-                    INSERT INTO {self.current_crowding_data_table} (c_timestamp, {stations_to_insert})
-                    VALUES
-            """
-            for timestamp, data in self.planned_to_insert:
-                insert_row_values = ['%s' if data[n_id] is not None else 'NULL' for n_id in self.stations_sequence]
-                insert_row_expr = f"""\t(TO_TIMESTAMP('{timestamp}','{timestamp_format}'), {', '.join(insert_row_values)})"""
-                begin_insert_expr += insert_row_expr + ',\n'
-                values_list.extend([data[n_id] for n_id in self.stations_sequence if data[n_id] is not None])
-            insert_query = begin_insert_expr[:-2]
-
-            self.cursor.execute(insert_query, values_list)
+            if self._verify_planned:
+                self.drop_committed_rows()
+                if len(self.planned_to_insert) == 0:
+                    self.connection.commit()
+                    return True
+
+            if self.load_method == 'copy':
+                stations_to_insert = ', '.join([f'"{n_id}"' for n_id in self.stations_sequence])
+                copy_query = (f"COPY {self.current_crowding_data_table} (c_timestamp, {stations_to_insert}) "
+                              f"FROM STDIN WITH (FORMAT text)")
+                self.cursor.copy_expert(copy_query, self.build_copy_buffer())
+            elif self.load_method == 'prepared':
+                statement_name = self.prepare_insert_statement()
+                placeholders = ', '.join(['%s'] * (len(self.stations_sequence) + 1))
+                rows = [[timestamp] + [data[n_id] for n_id in self.stations_sequence]
+                        for timestamp, data in self.planned_to_insert]
+                psycopg2.extras.execute_batch(self.cursor, f"EXECUTE {statement_name} ({placeholders})", rows,
+                                              page_size=len(rows))
+            else:
+                insert_query, values_list = self.build_values_query()
+                self.cursor.execute(insert_query, values_list)
+            self.update_catalog()
+            self.update_rollups()
             self.connection.commit()
+            self._rollup_tables_created = self.rollup is not None
+            self._verify_planned = False
+            registry.inc('rows_written_total', len(self.planned_to_insert))
 
             self.rows_left -= len(self.planned_to_insert)
             self.planned_to_insert = []
             return True
         except Exception as err:
+            self._verify_planned = True
             raise Exception(f"[insert_multiple_rows] {err}")
 
-    def insert_dumper(self, dumper):
-        """
-            Inserts data from the dumper into the database.
-
-            Args:
-            - dumper (list): List of data tuples (timestamp, data).
-        """
-        try:
-            if len(dumper) == 0:
-                raise Exception("Empty dumper")
+    def open_flush(self):
+        """Borrows a connection for the flush."""
+        self.connect()
 
-            self.connect()
-
-            while True:
-                if len(dumper) == 0:
-                    self.insert_planned_rows()
-                    break
-
-                timestamp, data = dumper.pop(0)
-                naptan_ids = tuple(sorted(list(data.keys())))
-                if not self.current_crowding_data_table or self.rows_left == 0 or self.stations_sequence != naptan_ids:
-                    self.insert_planned_rows()
-                    self.create_table(naptan_ids, timestamp)
-
-                self.planned_to_insert.append((timestamp, data))
-
-                the_length = len(self.planned_to_insert)
-                if the_length >= self.max_rows_in_commit or self.rows_left == the_length:
-                    self.insert_planned_rows()
-
-            self.insert_planned_rows()
-            self.disconnect()
-        except Exception as err:
-            raise Exception(f"[insert dumper] {err}")
-        finally:
-            self.disconnect()
+    def close_flush(self):
+        """Returns the connection of the flush and records the current table in the checkpoint."""
+        self.disconnect()
+        self.save_checkpoint()
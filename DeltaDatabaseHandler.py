@@ -0,0 +1,209 @@
+from datetime import datetime
+import psycopg2.extras
+from DatabaseHandler import DatabaseHandler
+from Metrics import registry
+
+
+class DeltaDatabaseHandler(DatabaseHandler):
+    """
+        A class to store crowding data as per-station changes instead of full wide rows.
+
+        Every sweep timestamp is recorded in the sweeps table, but a station value is only written to the changes
+        table when it differs from the last value written for that station. A station missing from a row is
+        stored as a change to NULL. read_dense rebuilds the full rows by carrying values forward.
+
+        Attributes:
+        - sweeps_table (str): Name of the table of sweep timestamps.
+        - changes_table (str): Name of the table of station value changes.
+        - last_values (dict or None): Last value written per station, None until loaded. Note: values may be None.
+        - cells_seen (int): Number of station values received since start.
+        - changes_written (int): Number of station values written since start.
+    """
+    def __init__(self, max_rows_in_commit, db_params, table_prefix='crowding', pool_size=2, health_check_after_sec=30,
+                 rollup=None):
+        """
+            Initializes the DeltaDatabaseHandler instance.
+
+            Args:
+            - max_rows_in_commit (int): Maximum number of rows to insert in a single commit.
+            - db_params (dict): Database connection parameters.
+            - table_prefix (str): Prefix of the sweeps and changes table names.
+            - pool_size (int): Maximum number of pooled connections.
+            - health_check_after_sec (float): Idle time after which a pooled connection is checked before reuse.
+            - rollup (CrowdingRollup or None): Rollups updated in the transaction of each insert.
+        """
+        super().__init__(max_rows_in_commit, None, float('inf'), db_params, 'values', pool_size,
+                         health_check_after_sec, rollup)
+        self.sweeps_table = f"{table_prefix}_sweeps"
+        self.changes_table = f"{table_prefix}_changes"
+        self.last_values = None
+        self.cells_seen = 0
+        self.changes_written = 0
+
+    def create_table(self, naptan_ids=(), timestamp=None):
+        """
+            Creates the sweeps and changes tables if they do not exist and loads the last value of each station.
+            Once loaded, a change of stations only updates the station sequence, as the changes table holds any
+            station.
+
+            Args:
+            - naptan_ids (list): Station IDs of the rows that follow.
+            - timestamp (str): Unused, kept for the DatabaseHandler interface.
+        """
+        try:
+            self.stations_sequence = naptan_ids
+            self.rows_left = self.max_rows
+            if self.last_values is not None:
+                return True
+
+            self.cursor.execute(f"""
+                CREATE TABLE IF NOT EXISTS {self.sweeps_table} (
+                    c_timestamp TIMESTAMP PRIMARY KEY
+                );
+                CREATE TABLE IF NOT EXISTS {self.changes_table} (
+                    naptan_id TEXT NOT NULL,
+                    c_timestamp TIMESTAMP NOT NULL,
+                    value NUMERIC(5,4),
+                    PRIMARY KEY (naptan_id, c_timestamp)
+                );
+            """)
+            self.connection.commit()
+
+            self.cursor.execute(f"""
+                SELECT DISTINCT ON (naptan_id) naptan_id, value FROM {self.changes_table}
+                ORDER BY naptan_id, c_timestamp DESC;
+            """)
+            self.last_values = {naptan_id: None if value is None else float(value)
+                                for naptan_id, value in self.cursor.fetchall()}
+            self.current_crowding_data_table = self.changes_table
+            return True
+        except Exception as err:
+            raise Exception(f"[create_table] {err}")
+
+    def encode_changes(self, rows, last_values):
+        """
+            Encodes rows as changes against the last values. The last values are updated in place.
+
+            Args:
+            - rows (list): Rows as (timestamp_str, {naptan_id: float or None}).
+            - last_values (dict): Last value written per station.
+
+            Returns:
+            - list: Changes as (naptan_id, timestamp_str, value) tuples.
+        """
+        changes = []
+        for timestamp, data in rows:
+            for naptan_id, value in data.items():
+                if naptan_id not in last_values or last_values[naptan_id] != value:
+                    changes.append((naptan_id, timestamp, value))
+                    last_values[naptan_id] = value
+            disappeared = [naptan_id for naptan_id, value in last_values.items()
+                           if value is not None and naptan_id not in data]
+            for naptan_id in disappeared:
+                changes.append((naptan_id, timestamp, None))
+                last_values[naptan_id] = None
+        return changes
+
+    def insert_planned_rows(self):
+        """
+            Inserts the sweep timestamps and the station changes of the planned rows in one transaction. After a start
+            or a failed batch, rows whose sweeps are already recorded are dropped first and count as written.
+        """
+        try:
+            if len(self.planned_to_insert) == 0:
+                return False
+
+            if self._verify_planned:
+                self.drop_committed_rows(self.sweeps_table)
+                if len(self.planned_to_insert) == 0:
+                    self.connection.commit()
+                    return True
+
+            last_values = dict(self.last_values)
+            changes = self.encode_changes(self.planned_to_insert, last_values)
+
+            psycopg2.extras.execute_values(self.cursor,
+                                           f"INSERT INTO {self.sweeps_table} (c_timestamp) VALUES %s",
+                                           [(timestamp,) for timestamp, _ in self.planned_to_insert])
+            if changes:
+                psycopg2.extras.execute_values(self.cursor,
+                                               f"INSERT INTO {self.changes_table} (naptan_id, c_timestamp, value) "
+                                               f"VALUES %s", changes, page_size=1000)
+            self.update_rollups()
+            self.connection.commit()
+            self._rollup_tables_created = self.rollup is not None
+            self._verify_planned = False
+            registry.inc('rows_written_total', len(self.planned_to_insert))
+
+            self.last_values = last_values
+            self.cells_seen += sum(len(data) for _, data in self.planned_to_insert)
+            self.changes_written += len(changes)
+            self.planned_to_insert = []
+            return True
+        except Exception as err:
+            self._verify_planned = True
+            raise Exception(f"[insert_multiple_rows] {err}")
+
+    def read_dense(self, start, end, naptan_ids=None):
+        """
+            Rebuilds full rows of a time range from the stored changes.
+
+            Args:
+            - start (str): First timestamp of the range, 'YYYY-MM-DD HH:MM:SS'.
+            - end (str): Last timestamp of the range, 'YYYY-MM-DD HH:MM:SS'.
+            - naptan_ids (list or None): Stations to read, all stations if None.
+
+            Returns:
+            - list: Rows as [timestamp_str, {naptan_id: float or None}] for every sweep in the range.
+        """
+        try:
+            self.connect()
+            station_filter = "" if naptan_ids is None else "AND naptan_id = ANY(%(naptan_ids)s)"
+            params = {'start': start, 'end': end, 'naptan_ids': list(naptan_ids or [])}
+
+            self.cursor.execute(f"""
+                SELECT DISTINCT ON (naptan_id) naptan_id, value FROM {self.changes_table}
+                WHERE c_timestamp < %(start)s {station_filter}
+                ORDER BY naptan_id, c_timestamp DESC;
+            """, params)
+            state = {naptan_id: None if value is None else float(value) for naptan_id, value in self.cursor.fetchall()}
+
+            self.cursor.execute(f"""
+                SELECT c_timestamp, naptan_id, value FROM {self.changes_table}
+                WHERE c_timestamp BETWEEN %(start)s AND %(end)s {station_filter}
+                ORDER BY c_timestamp;
+            """, params)
+            changes = self.cursor.fetchall()
+
+            self.cursor.execute(f"""
+                SELECT c_timestamp FROM {self.sweeps_table}
+                WHERE c_timestamp BETWEEN %(start)s AND %(end)s
+                ORDER BY c_timestamp;
+            """, params)
+            sweeps = [row[0] for row in self.cursor.fetchall()]
+
+            rows = []
+            change_index = 0
+            for sweep_time in sweeps:
+                while change_index < len(changes) and changes[change_index][0] <= sweep_time:
+                    _, naptan_id, value = changes[change_index]
+                    state[naptan_id] = None if value is None else float(value)
+                    change_index += 1
+                rows.append([datetime.strftime(sweep_time, '%Y-%m-%d %H:%M:%S'), dict(state)])
+            return rows
+        except Exception as err:
+            raise Exception(f"[read_dense] {err}")
+        finally:
+            self.disconnect()
+
+    def get_metrics(self):
+        """
+            Returns connection, flush and encoding metrics.
+
+            Returns:
+            - dict: Metrics of DatabaseHandler with the number of cells seen and changes written added.
+        """
+        metrics = super().get_metrics()
+        metrics['cells_seen'] = self.cells_seen
+        metrics['changes_written'] = self.changes_written
+        return metrics
@@ -1,23 +1,52 @@
+import queue
 import smtplib
+import threading
+import time
+from collections import deque
+from datetime import datetime
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 
 
 class EmailInformant:
     """
-        A class to send emails using SMTP.
+        A class to send emails using SMTP from a background thread, so callers never wait for the mail server.
+
+        send_email only queues the alert. The sender thread collects the alerts of a coalescing window,
+        merges identical ones into a single digest line with their count and sends the digest over a
+        persistent SMTP session, at most max_emails_per_hour times an hour. Alerts arriving while the limit
+        is reached keep coalescing into the next digest, which keeps the max_pending_alerts most recently seen
+        distinct alerts and only counts the ones evicted.
 
         Attributes:
         - smtp_server_name (str): SMTP server hostname.
-        - smtp_server (smtplib.SMTP_SSL or None): SMTP server connection.
+        - smtp_server (smtplib.SMTP_SSL or None): SMTP server connection, kept open between emails.
         - smtp_port (int): SMTP server port number.
         - smtp_email (str): Sender's email address.
         - email_password (str): Sender's email password.
         - recipient_email (str): Recipient's email address.
+        - coalesce_window_sec (float): Time alerts are collected before a digest is sent in seconds.
+        - max_emails_per_hour (int): Maximum number of emails sent within an hour.
+        - max_pending_alerts (int): Maximum number of distinct alerts kept for the next digest.
+        - emails_sent (int): Number of emails sent.
+        - alerts_queued (int): Number of alerts passed to send_email.
+        - alerts_dropped (int): Number of alerts dropped because the queue was full.
+        - delivery_failures (int): Number of failed attempts to send an email.
+        - last_error (str or None): Error of the last failed attempt.
+        - _queue (queue.Queue): Alerts not yet taken by the sender thread. Note: Internal attribute, avoid direct access.
+        - _pending (dict): Count, first and last time per (subject, body) of the next digest, least recently seen
+          first. Note: Internal attribute, avoid direct access.
+        - _pending_evicted (int): Number of alerts of the next digest evicted from _pending. Note: Internal attribute.
+        - _pending_since (float or None): Monotonic time the next digest started collecting. Note: Internal attribute.
+        - _sent_times (collections.deque): Monotonic times of the emails sent within the last hour. Note: Internal.
+        - _lock (threading.Lock): Lock guarding the counters. Note: Internal attribute, avoid direct access.
+        - _stopping (threading.Event): Event that stops the sender thread. Note: Internal attribute.
+        - _thread (threading.Thread): The sender thread. Note: Internal attribute.
     """
-    def __init__(self, smtp_server_name, smtp_port, smtp_email, email_password, recipient_email):
+    def __init__(self, smtp_server_name, smtp_port, smtp_email, email_password, recipient_email,
+                 coalesce_window_sec=30, max_emails_per_hour=20, queue_size=1000, max_pending_alerts=100):
         """
-            Initializes the EmailInformant instance.
+            Initializes the EmailInformant instance and starts its sender thread.
 
             Args:
             - smtp_server_name (str): SMTP server hostname.
@@ -25,6 +54,10 @@ class EmailInformant:
             - smtp_email (str): Sender's email address.
             - email_password (str): Sender's email password.
             - recipient_email (str): Recipient's email address.
+            - coalesce_window_sec (float): Time alerts are collected before a digest is sent in seconds.
+            - max_emails_per_hour (int): Maximum number of emails sent within an hour.
+            - queue_size (int): Maximum number of alerts waiting for the sender thread.
+            - max_pending_alerts (int): Maximum number of distinct alerts kept for the next digest.
         """
         self.smtp_server_name = smtp_server_name
         self.smtp_server = None
@@ -32,6 +65,23 @@ class EmailInformant:
         self.smtp_email = smtp_email
         self.email_password = email_password
         self.recipient_email = recipient_email
+        self.coalesce_window_sec = coalesce_window_sec
+        self.max_emails_per_hour = max_emails_per_hour
+        self.max_pending_alerts = max(1, max_pending_alerts)
+        self.emails_sent = 0
+        self.alerts_queued = 0
+        self.alerts_dropped = 0
+        self.delivery_failures = 0
+        self.last_error = None
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._pending = {}
+        self._pending_evicted = 0
+        self._pending_since = None
+        self._sent_times = deque()
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="email-informant", daemon=True)
+        self._thread.start()
 
     def create_message(self, subject, body_text):
         """
@@ -57,9 +107,39 @@ class EmailInformant:
         except Exception as err:
             raise Exception(f"[create_message] {err}")
 
-    def send_email(self, subject, body_text):
+    def disconnect(self):
+        """Closes the SMTP session, ignoring errors of an already dropped connection."""
+        if self.smtp_server:
+            try:
+                self.smtp_server.quit()
+            except Exception:
+                self.smtp_server.close()
+            self.smtp_server = None
+
+    def connect(self):
+        """
+            Opens and logs in an SMTP session unless the current one still answers NOOP.
+
+            Raises:
+            - Exception: If the session cannot be opened or the login fails.
+        """
+        try:
+            if self.smtp_server:
+                try:
+                    if self.smtp_server.noop()[0] == 250:
+                        return
+                except smtplib.SMTPException:
+                    pass
+                self.disconnect()
+            self.smtp_server = smtplib.SMTP_SSL(self.smtp_server_name, self.smtp_port)
+            self.smtp_server.login(self.smtp_email, self.email_password)
+        except Exception as err:
+            self.smtp_server = None
+            raise Exception(f"[connect] {err}")
+
+    def deliver(self, subject, body_text):
         """
-            Sends an email.
+            Sends an email synchronously over the persistent SMTP session.
 
             Args:
             - subject (str): Email subject.
@@ -70,11 +150,150 @@ class EmailInformant:
         """
         try:
             message = self.create_message(subject, body_text)
-            self.smtp_server = smtplib.SMTP_SSL(self.smtp_server_name, self.smtp_port)
-            self.smtp_server.login(self.smtp_email, self.email_password)
+            self.connect()
             self.smtp_server.sendmail(self.smtp_email, self.recipient_email, message.as_string())
         except Exception as err:
-            raise Exception(f"[send_email] {err}")
-        finally:
-            if self.smtp_server:
-                self.smtp_server.quit()
+            self.disconnect()
+            raise Exception(f"[deliver] {err}")
+
+    def send_email(self, subject, body_text):
+        """
+            Queues an email for the sender thread without waiting. Never raises, a full queue drops the alert.
+
+            Args:
+            - subject (str): Email subject.
+            - body_text (str): Email body text.
+        """
+        try:
+            self._queue.put_nowait((subject, body_text, time.time()))
+            with self._lock:
+                self.alerts_queued += 1
+        except queue.Full:
+            with self._lock:
+                self.alerts_dropped += 1
+
+    def build_digest(self, pending, evicted=0):
+        """
+            Builds one email of the collected alerts. A single alert is sent as it is.
+
+            Args:
+            - pending (dict): [count, first epoch, last epoch] per (subject, body).
+            - evicted (int): Number of further alerts evicted from pending.
+
+            Returns:
+            - tuple: (subject, body_text) of the digest.
+        """
+        if len(pending) == 1 and not evicted:
+            (subject, body_text), (count, _, _) = next(iter(pending.items()))
+            if count == 1:
+                return subject, body_text
+
+        total = sum(count for count, _, _ in pending.values()) + evicted
+        subject = next(iter(pending))[0]
+        lines = []
+        for (_, body_text), (count, first, last) in sorted(pending.items(), key=lambda item: item[1][1]):
+            first_str = datetime.fromtimestamp(first).strftime('%Y-%m-%d %H:%M:%S')
+            if count == 1:
+                lines.append(f"[{first_str}] {body_text}")
+            else:
+                last_str = datetime.fromtimestamp(last).strftime('%H:%M:%S')
+                lines.append(f"[{first_str} - {last_str}] {count}x {body_text}")
+        if evicted:
+            lines.append(f"{evicted} earlier alerts not listed.")
+        return f"{subject}{total} alerts ({len(pending)} distinct)", '\n'.join(lines)
+
+    def _collect(self, subject, body_text, created_at):
+        """
+            Adds an alert to the next digest, evicting the least recently seen alert if max_pending_alerts
+            distinct alerts are collected already.
+
+            Args:
+            - subject (str): Email subject.
+            - body_text (str): Email body text.
+            - created_at (float): Epoch time the alert was queued.
+        """
+        record = self._pending.pop((subject, body_text), None)
+        if record is None:
+            if len(self._pending) >= self.max_pending_alerts:
+                self._pending_evicted += self._pending.pop(next(iter(self._pending)))[0]
+            record = [0, created_at, created_at]
+        record[0] += 1
+        record[2] = created_at
+        self._pending[(subject, body_text)] = record
+        if self._pending_since is None:
+            self._pending_since = time.monotonic()
+
+    def _next_send_time(self):
+        """
+            Returns the earliest monotonic time the next digest may be sent.
+
+            Returns:
+            - float: Time the coalescing window closes or the hourly limit allows another email, whichever is later.
+        """
+        while self._sent_times and time.monotonic() - self._sent_times[0] >= 3600:
+            self._sent_times.popleft()
+        send_time = self._pending_since + self.coalesce_window_sec
+        if len(self._sent_times) >= self.max_emails_per_hour:
+            send_time = max(send_time, self._sent_times[0] + 3600)
+        return send_time
+
+    def _send_pending(self):
+        """Sends the digest of the collected alerts, keeping them for a later attempt if sending fails."""
+        subject, body_text = self.build_digest(self._pending, self._pending_evicted)
+        try:
+            self.deliver(subject, body_text)
+        except Exception as err:
+            with self._lock:
+                self.delivery_failures += 1
+                self.last_error = str(err)
+            self._pending_since = time.monotonic()
+            return
+        with self._lock:
+            self.emails_sent += 1
+        self._sent_times.append(time.monotonic())
+        self._pending = {}
+        self._pending_evicted = 0
+        self._pending_since = None
+
+    def _run(self):
+        """Collects queued alerts and sends digests until close is called, then sends what is left."""
+        while True:
+            wait = 1.0
+            if self._pending:
+                wait = min(wait, max(0.0, self._next_send_time() - time.monotonic()))
+            try:
+                self._collect(*self._queue.get(timeout=wait))
+                while True:
+                    self._collect(*self._queue.get_nowait())
+            except queue.Empty:
+                pass
+
+            if self._stopping.is_set():
+                if self._pending:
+                    self._send_pending()
+                self.disconnect()
+                return
+            if self._pending and time.monotonic() >= self._next_send_time():
+                self._send_pending()
+
+    def close(self, timeout=60):
+        """
+            Stops the sender thread after it has sent the alerts still queued, ignoring the hourly limit.
+
+            Args:
+            - timeout (float): Maximum time to wait for the last email in seconds.
+        """
+        self._stopping.set()
+        self._thread.join(timeout)
+
+    def get_stats(self):
+        """
+            Returns delivery counters of the informant.
+
+            Returns:
+            - dict: Alerts queued, dropped and waiting, emails sent and failed attempts.
+        """
+        with self._lock:
+            return {'alerts_queued': self.alerts_queued, 'alerts_dropped': self.alerts_dropped,
+                    'alerts_waiting': self._queue.qsize(), 'emails_sent': self.emails_sent,
+                    'delivery_failures': self.delivery_failures}
@@ -0,0 +1,221 @@
+import gzip
+import http.client
+import threading
+from urllib.parse import urlsplit
+from Metrics import registry
+
+
+class SessionResponse:
+    """
+        A fully read HTTP response returned by HttpSession.
+
+        Attributes:
+        - url (str): The requested URL.
+        - status (int): HTTP status code.
+        - reason (str): HTTP reason phrase.
+        - headers (http.client.HTTPMessage): Response headers.
+        - body (bytes): Decoded response body.
+    """
+    def __init__(self, url, status, reason, headers, body):
+        """
+            Initializes the SessionResponse instance.
+
+            Args:
+            - url (str): The requested URL.
+            - status (int): HTTP status code.
+            - reason (str): HTTP reason phrase.
+            - headers (http.client.HTTPMessage): Response headers.
+            - body (bytes): Decoded response body.
+        """
+        self.url = url
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+
+    def getcode(self):
+        """
+            Returns the HTTP status code.
+
+            Returns:
+            - int: HTTP status code.
+        """
+        return self.status
+
+    def getheader(self, name, default=None):
+        """
+            Returns the value of a response header.
+
+            Args:
+            - name (str): Header name.
+            - default: Value returned if the header is missing.
+
+            Returns:
+            - str: The header value or default.
+        """
+        return self.headers.get(name, default)
+
+    def read(self, *args):
+        """
+            Returns the response body, so the response can be passed to json.load.
+
+            Returns:
+            - bytes: Decoded response body.
+        """
+        return self.body
+
+
+class HttpSession:
+    """
+        A thread-safe HTTP client that keeps connections alive and reuses them across requests.
+
+        Attributes:
+        - headers (dict): Headers sent with every request.
+        - timeout (float): Default request timeout in seconds.
+        - max_idle_per_host (int): Maximum number of idle connections kept per host.
+        - connections_opened (int): Number of connections opened so far.
+        - connections_reused (int): Number of requests sent over an already open connection.
+        - _idle (dict): Idle connections per (scheme, host, port). Note: Internal attribute, avoid direct access.
+        - _lock (threading.Lock): Lock guarding the idle connections and counters. Note: Internal attribute.
+    """
+    _stale_connection_errors = (http.client.RemoteDisconnected, http.client.CannotSendRequest,
+                                http.client.BadStatusLine, ConnectionResetError, BrokenPipeError)
+
+    def __init__(self, headers=None, timeout=30, max_idle_per_host=16):
+        """
+            Initializes the HttpSession instance.
+
+            Args:
+            - headers (dict or None): Headers sent with every request.
+            - timeout (float): Default request timeout in seconds.
+            - max_idle_per_host (int): Maximum number of idle connections kept per host.
+        """
+        self.headers = dict(headers or {})
+        self.timeout = timeout
+        self.max_idle_per_host = max_idle_per_host
+        self.connections_opened = 0
+        self.connections_reused = 0
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def _acquire_connection(self, key, timeout):
+        """
+            Takes an idle connection for the host or opens a new one.
+
+            Args:
+            - key (tuple): (scheme, host, port) of the target.
+            - timeout (float): Request timeout in seconds.
+
+            Returns:
+            - tuple: (http.client.HTTPConnection, bool) connection and whether it was reused.
+        """
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                self.connections_reused += 1
+                connection = idle.pop()
+                connection.timeout = timeout
+                if connection.sock is not None:
+                    connection.sock.settimeout(timeout)
+                return connection, True
+            self.connections_opened += 1
+
+        scheme, host, port = key
+        connection_class = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+        return connection_class(host, port, timeout=timeout), False
+
+    def _release_connection(self, key, connection):
+        """
+            Puts a connection back to the idle connections of the host or closes it if there are too many.
+
+            Args:
+            - key (tuple): (scheme, host, port) of the target.
+            - connection (http.client.HTTPConnection): Connection to release.
+        """
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle_per_host:
+                idle.append(connection)
+                return
+        connection.close()
+
+    def request(self, url, headers=None, timeout=None):
+        """
+            Sends a GET request over a kept-alive connection and reads the whole response.
+
+            Args:
+            - url (str): The URL to send the GET request to.
+            - headers (dict or None): Headers added to the session headers for this request.
+            - timeout (float or None): Request timeout in seconds, the session default if None.
+
+            Returns:
+            - SessionResponse: The fully read response.
+
+            Raises:
+            - Exception: If the request fails.
+        """
+        try:
+            parts = urlsplit(url)
+            scheme = parts.scheme or 'https'
+            port = parts.port or (443 if scheme == 'https' else 80)
+            key = (scheme, parts.hostname, port)
+            path = parts.path or '/'
+            if parts.query:
+                path += '?' + parts.query
+
+            request_headers = dict(self.headers)
+            request_headers['Accept-Encoding'] = 'gzip'
+            request_headers['Connection'] = 'keep-alive'
+            if headers:
+                request_headers.update(headers)
+
+            timeout = self.timeout if timeout is None else timeout
+
+            while True:
+                connection, reused = self._acquire_connection(key, timeout)
+                try:
+                    if not reused:
+                        # Connect separately so DNS and TLS handshakes show up apart from the server latency.
+                        with registry.timer('http_connect'):
+                            connection.connect()
+                    connection.request('GET', path, headers=request_headers)
+                    response = connection.getresponse()
+                    body = response.read()
+                    break
+                except self._stale_connection_errors:
+                    connection.close()
+                    if not reused:
+                        raise
+                except Exception:
+                    connection.close()
+                    raise
+
+            if response.will_close:
+                connection.close()
+            else:
+                self._release_connection(key, connection)
+
+            if response.getheader('Content-Encoding', '').lower() == 'gzip':
+                body = gzip.decompress(body)
+
+            return SessionResponse(url, response.status, response.reason, response.headers, body)
+        except Exception as err:
+            raise Exception(f"[request] {err}")
+
+    def get_stats(self):
+        """
+            Returns connection counters of the session.
+
+            Returns:
+            - dict: Number of connections opened and reused.
+        """
+        with self._lock:
+            return {'connections_opened': self.connections_opened, 'connections_reused': self.connections_reused}
+
+    def close(self):
+        """Closes all idle connections."""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
@@ -0,0 +1,373 @@
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+class Histogram:
+    """
+        A histogram of observed values with fixed cumulative buckets, as exposed by Prometheus.
+
+        Attributes:
+        - buckets (tuple): Upper bounds of the buckets in ascending order.
+        - counts (list): Number of observations per bucket, the last one counting values above all bounds.
+        - total (float): Sum of the observed values.
+        - count (int): Number of observations.
+        - max (float): Largest observed value.
+    """
+    def __init__(self, buckets):
+        """
+            Initializes the Histogram instance.
+
+            Args:
+            - buckets (tuple): Upper bounds of the buckets in ascending order.
+        """
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, value):
+        """
+            Adds an observation.
+
+            Args:
+            - value (float): Observed value.
+        """
+        index = 0
+        while index < len(self.buckets) and value > self.buckets[index]:
+            index += 1
+        self.counts[index] += 1
+        self.total += value
+        self.count += 1
+        self.max = max(self.max, value)
+
+    def cumulative_counts(self):
+        """
+            Returns the number of observations at or below each bucket bound.
+
+            Returns:
+            - list: (bound, count) pairs ending with ('+Inf', count).
+        """
+        pairs = []
+        running = 0
+        for bound, count in zip(self.buckets, self.counts):
+            running += count
+            pairs.append((bound, running))
+        pairs.append(('+Inf', running + self.counts[-1]))
+        return pairs
+
+    def as_dict(self):
+        """
+            Returns the histogram as a JSON serialisable dict.
+
+            Returns:
+            - dict: Count, sum, mean, max and cumulative bucket counts.
+        """
+        return {'count': self.count, 'sum': self.total, 'mean': self.total / self.count if self.count else 0.0,
+                'max': self.max, 'buckets': {str(bound): count for bound, count in self.cumulative_counts()}}
+
+
+def error_tag(err):
+    """
+    Returns the outermost [tag] of an error message, naming the function that raised it.
+
+    Parameters:
+    err (Exception or str): The error.
+
+    Returns:
+    str: The tag without brackets, 'untagged' if the message has none.
+    """
+    match = re.match(r"\s*\[([^\]]+)\]", str(err))
+    return match.group(1) if match else 'untagged'
+
+
+class MetricsRegistry:
+    """
+        A thread-safe registry of counters and histograms of the collector.
+
+        Metrics are identified by name and labels. Collectors registered with add_collector are called on
+        each snapshot and their numeric values are exposed as gauges, so components that already keep
+        statistics do not have to report them twice.
+
+        Attributes:
+        - prefix (str): Prefix of the metric names in the Prometheus text format.
+        - default_buckets (tuple): Bucket bounds of histograms, in seconds.
+        - started_at (float): Wall-clock time the registry was created.
+        - _counters (dict): Counter values per (name, labels). Note: Internal attribute, avoid direct access.
+        - _histograms (dict): Histograms per (name, labels). Note: Internal attribute.
+        - _collectors (dict): Functions returning dicts of gauges per name. Note: Internal attribute.
+        - _lock (threading.Lock): Lock guarding the metrics. Note: Internal attribute.
+    """
+    default_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+    def __init__(self, prefix='tube_crowding'):
+        """
+            Initializes the MetricsRegistry instance.
+
+            Args:
+            - prefix (str): Prefix of the metric names in the Prometheus text format.
+        """
+        self.prefix = prefix
+        self.started_at = time.time()
+        self._counters = {}
+        self._histograms = {}
+        self._collectors = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        """
+            Increases a counter.
+
+            Args:
+            - name (str): Name of the counter.
+            - value (float): Amount added.
+            - labels: Labels of the counter.
+        """
+        key = (name, tuple(sorted((label, str(value)) for label, value in labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        """
+            Adds an observation to a histogram.
+
+            Args:
+            - name (str): Name of the histogram.
+            - value (float): Observed value.
+            - labels: Labels of the histogram.
+        """
+        key = (name, tuple(sorted((label, str(value)) for label, value in labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(self.default_buckets)
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, stage):
+        """
+            Observes the duration of a block in the stage_seconds histogram, also if the block raises.
+
+            Args:
+            - stage (str): Name of the timed stage.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe('stage_seconds', time.perf_counter() - start, stage=stage)
+
+    def record_error(self, err):
+        """
+            Counts an error by its outermost tag.
+
+            Args:
+            - err (Exception or str): The error.
+        """
+        self.inc('errors_total', tag=error_tag(err))
+
+    def add_collector(self, name, collect):
+        """
+            Registers a function whose numeric results are exposed as gauges.
+
+            Args:
+            - name (str): Name prefixed to the gauges, e.g. 'database'.
+            - collect (callable): Function without arguments returning a dict.
+        """
+        with self._lock:
+            self._collectors[name] = collect
+
+    def _collect_gauges(self):
+        """
+            Calls the collectors and flattens their numeric results.
+
+            Returns:
+            - dict: Gauge values per name.
+        """
+        with self._lock:
+            collectors = list(self._collectors.items())
+        gauges = {}
+        for name, collect in collectors:
+            try:
+                values = collect()
+            except Exception as err:
+                self.record_error(f"[collect {name}] {err}")
+                continue
+            for key, value in values.items():
+                if isinstance(value, bool):
+                    value = int(value)
+                if isinstance(value, (int, float)):
+                    gauges[f"{name}_{key}"] = value
+        return gauges
+
+    def snapshot(self):
+        """
+            Returns all metrics as a JSON serialisable dict.
+
+            Returns:
+            - dict: Counters, histograms and gauges keyed by name with labels in braces.
+        """
+        gauges = self._collect_gauges()
+        with self._lock:
+            counters = {self._key_name(key): value for key, value in sorted(self._counters.items())}
+            histograms = {self._key_name(key): histogram.as_dict()
+                          for key, histogram in sorted(self._histograms.items())}
+        return {'timestamp': time.time(), 'uptime_sec': time.time() - self.started_at, 'counters': counters,
+                'histograms': histograms, 'gauges': gauges}
+
+    @staticmethod
+    def _format_labels(labels, extra=()):
+        """
+            Formats labels as {name="value",...}.
+
+            Args:
+            - labels (tuple): (name, value) pairs.
+            - extra (tuple): (name, value) pairs appended after the labels.
+
+            Returns:
+            - str: Labels in braces, empty if there are none.
+        """
+        pairs = tuple(labels) + tuple(extra)
+        if not pairs:
+            return ''
+        escaped = []
+        for name, value in pairs:
+            value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+            escaped.append(f'{name}="{value}"')
+        return '{' + ','.join(escaped) + '}'
+
+    def _key_name(self, key):
+        """
+            Returns the name of a metric with its labels, as used in the snapshot.
+
+            Args:
+            - key (tuple): (name, labels) of the metric.
+
+            Returns:
+            - str: Name followed by the labels in braces.
+        """
+        name, labels = key
+        return name + self._format_labels(labels)
+
+    def render_prometheus(self):
+        """
+            Renders all metrics in the Prometheus text exposition format.
+
+            Returns:
+            - str: The metrics page.
+        """
+        gauges = self._collect_gauges()
+        lines = []
+        with self._lock:
+            declared = set()
+            for (name, labels), value in sorted(self._counters.items()):
+                full_name = f"{self.prefix}_{name}"
+                if full_name not in declared:
+                    lines.append(f"# TYPE {full_name} counter")
+                    declared.add(full_name)
+                lines.append(f"{full_name}{self._format_labels(labels)} {value}")
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                full_name = f"{self.prefix}_{name}"
+                if full_name not in declared:
+                    lines.append(f"# TYPE {full_name} histogram")
+                    declared.add(full_name)
+                for bound, count in histogram.cumulative_counts():
+                    lines.append(f"{full_name}_bucket{self._format_labels(labels, (('le', bound),))} {count}")
+                lines.append(f"{full_name}_sum{self._format_labels(labels)} {histogram.total}")
+                lines.append(f"{full_name}_count{self._format_labels(labels)} {histogram.count}")
+        for name, value in sorted(gauges.items()):
+            full_name = f"{self.prefix}_{re.sub(r'[^a-zA-Z0-9_]', '_', name)}"
+            lines.append(f"# TYPE {full_name} gauge")
+            lines.append(f"{full_name} {value}")
+        return '\n'.join(lines) + '\n'
+
+    def dump_json(self, path):
+        """
+            Writes the snapshot to a JSON file, replacing it atomically.
+
+            Args:
+            - path (str): Path of the stats file.
+
+            Raises:
+            - Exception: If the file cannot be written.
+        """
+        try:
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, 'w') as stats_file:
+                json.dump(self.snapshot(), stats_file, indent=1)
+            os.replace(tmp_path, path)
+        except Exception as err:
+            raise Exception(f"[dump_json] {err}")
+
+
+class MetricsServer(threading.Thread):
+    """
+        A background thread serving the metrics of a registry in the Prometheus text format on /metrics
+        and as JSON on /stats.
+
+        Attributes:
+        - registry (MetricsRegistry): Registry served.
+        - _httpd (ThreadingHTTPServer): The HTTP server. Note: Internal attribute, avoid direct access.
+    """
+    def __init__(self, registry, port, host='127.0.0.1'):
+        """
+            Initializes the MetricsServer instance and binds its socket.
+
+            Args:
+            - registry (MetricsRegistry): Registry served.
+            - port (int): Port to listen on.
+            - host (str): Address to listen on, local only by default.
+        """
+        super().__init__(name="metrics-server", daemon=True)
+        self.registry = registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = self.path.split('?')[0]
+                if path == '/metrics':
+                    body = registry.render_prometheus().encode()
+                    content_type = 'text/plain; version=0.0.4; charset=utf-8'
+                elif path == '/stats':
+                    body = json.dumps(registry.snapshot()).encode()
+                    content_type = 'application/json'
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer((host, port), Handler)
+        self._httpd.daemon_threads = True
+
+    @property
+    def port(self):
+        """
+            Returns the port the server listens on.
+
+            Returns:
+            - int: The port.
+        """
+        return self._httpd.server_address[1]
+
+    def run(self):
+        """Serves requests until stop is called."""
+        self._httpd.serve_forever()
+
+    def stop(self):
+        """Stops serving and closes the socket."""
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+registry = MetricsRegistry()
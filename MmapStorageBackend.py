@@ -0,0 +1,272 @@
+import json
+import os
+import numpy as np
+from Metrics import registry
+from StorageBackend import StorageBackend
+
+
+class MmapStorageBackend(StorageBackend):
+    """
+        A storage backend writing crowding rows to memory-mapped, append-only column files, without a database server.
+
+        Each table is a segment directory holding an int64 timestamp file and a float32 values file with one
+        fixed-width column of max_rows values per station, each column a contiguous run of the file. Both files are
+        preallocated sparse when the segment is created and mapped once, so a batch is written by copying its values
+        into the mappings. The number of committed rows is kept in the segment's meta.json, which is replaced
+        atomically after the mappings are flushed, so rows of a batch interrupted by a crash are never read.
+
+        Timestamps are stored as naive datetime64[s] values of the 'YYYY-MM-DD HH:MM:SS' row timestamps, like the
+        TIMESTAMP column of the database tables, and missing values as NaN. As the row timestamps are London local
+        time, they repeat an hour when the clocks go back, so they are not assumed to be sorted. Reads return NumPy
+        views of the mappings without copying where the rows read are contiguous.
+
+        Segments are named segment_<sequence>_<first timestamp>, numbered in the order they are created, so
+        segments created within the same second or across the clock change get distinct names in write order.
+
+        Attributes:
+        - store_dir (str): Directory of the segments.
+        - rows_written (int): Number of rows written since start.
+        - _timestamps (numpy.memmap or None): Timestamps of the current segment. Note: Internal attribute.
+        - _values (numpy.memmap or None): Values of the current segment, shape (stations, max_rows).
+          Note: Internal attribute, avoid direct access.
+        - _row_count (int): Number of committed rows of the current segment. Note: Internal attribute.
+        - _next_sequence (int): Sequence number of the next segment. Note: Internal attribute.
+    """
+    timestamps_file = 'timestamps.i64'
+    values_file = 'values.f32'
+    meta_file = 'meta.json'
+
+    def __init__(self, max_rows_in_commit, store_dir, max_rows=100000):
+        """
+            Initializes the MmapStorageBackend instance and continues the last segment if there is one.
+
+            Args:
+            - max_rows_in_commit (int): Maximum number of rows written in a single batch.
+            - store_dir (str): Directory of the segments, created if it does not exist.
+            - max_rows (int): Number of rows of a segment.
+        """
+        super().__init__(max_rows_in_commit, None, max_rows)
+        self.store_dir = store_dir
+        self.rows_written = 0
+        self._timestamps = None
+        self._values = None
+        self._row_count = 0
+        self._next_sequence = 0
+        os.makedirs(self.store_dir, exist_ok=True)
+
+        segments = list_segments(self.store_dir)
+        if segments:
+            self._next_sequence = int(segments[-1].split('_')[1]) + 1
+            self._open_segment(segments[-1])
+
+    def _segment_path(self, segment, name):
+        """
+            Returns the path of a file of a segment.
+
+            Args:
+            - segment (str): Name of the segment.
+            - name (str): Name of the file.
+
+            Returns:
+            - str: Path of the file.
+        """
+        return os.path.join(self.store_dir, segment, name)
+
+    def _write_meta(self, segment, meta):
+        """
+            Replaces the meta.json of a segment atomically.
+
+            Args:
+            - segment (str): Name of the segment.
+            - meta (dict): Stations, capacity and committed row count of the segment.
+        """
+        path = self._segment_path(segment, self.meta_file)
+        with open(f"{path}.tmp", 'w') as meta_file:
+            json.dump(meta, meta_file)
+            meta_file.flush()
+            os.fsync(meta_file.fileno())
+        os.replace(f"{path}.tmp", path)
+
+    def _open_segment(self, segment):
+        """
+            Maps the files of a segment and makes it the current one.
+
+            Args:
+            - segment (str): Name of the segment.
+        """
+        meta = read_meta(self.store_dir, segment)
+        self.stations_sequence = tuple(meta['naptan_ids'])
+        self._row_count = meta['rows']
+        self.rows_left = meta['capacity'] - meta['rows']
+        self._timestamps = np.memmap(self._segment_path(segment, self.timestamps_file), dtype=np.int64, mode='r+',
+                                     shape=(meta['capacity'],))
+        self._values = np.memmap(self._segment_path(segment, self.values_file), dtype=np.float32, mode='r+',
+                                 shape=(len(self.stations_sequence), meta['capacity']))
+        self.current_crowding_data_table = segment
+
+    def _close_segment(self):
+        """Flushes the current segment and drops its mappings, which are unmapped once no view uses them."""
+        for mapping in (self._timestamps, self._values):
+            if mapping is not None:
+                mapping.flush()
+        self._timestamps = None
+        self._values = None
+
+    def create_table(self, naptan_ids, timestamp):
+        """
+            Creates a new segment with preallocated files and makes it the current one.
+
+            Args:
+            - naptan_ids (tuple): Station IDs of the segment.
+            - timestamp (str): Timestamp of its first row, 'YYYY-MM-DD HH:MM:SS'.
+        """
+        try:
+            first_timestamp = timestamp.replace('-', '').replace(':', '').replace(' ', 'T')
+            segment = f"segment_{self._next_sequence:06d}_{first_timestamp}"
+            os.makedirs(os.path.join(self.store_dir, segment))
+            self._next_sequence += 1
+            for name, size in ((self.timestamps_file, 8 * self.max_rows),
+                               (self.values_file, 4 * self.max_rows * len(naptan_ids))):
+                with open(self._segment_path(segment, name), 'wb') as segment_file:
+                    segment_file.truncate(size)
+            self._write_meta(segment, {'naptan_ids': list(naptan_ids), 'capacity': self.max_rows, 'rows': 0})
+            self._close_segment()
+            self._open_segment(segment)
+            return True
+        except Exception as err:
+            raise Exception(f"[create_table] {err}")
+
+    def insert_planned_rows(self):
+        """Appends the planned rows to the current segment and commits them in its meta.json."""
+        try:
+            if len(self.planned_to_insert) == 0:
+                return False
+
+            start = self._row_count
+            end = start + len(self.planned_to_insert)
+            timestamps = np.array([timestamp.replace(' ', 'T') for timestamp, _ in self.planned_to_insert],
+                                  dtype='datetime64[s]')
+            values = np.array([[data[n_id] for n_id in self.stations_sequence]
+                               for _, data in self.planned_to_insert], dtype=np.float32)
+            self._timestamps[start:end] = timestamps.astype(np.int64)
+            self._values[:, start:end] = values.T
+            self._timestamps.flush()
+            self._values.flush()
+            self._write_meta(self.current_crowding_data_table, {'naptan_ids': list(self.stations_sequence),
+                                                                'capacity': len(self._timestamps), 'rows': end})
+            self._row_count = end
+            registry.inc('rows_written_total', len(self.planned_to_insert))
+            self.rows_written += len(self.planned_to_insert)
+
+            self.rows_left -= len(self.planned_to_insert)
+            self.planned_to_insert = []
+            return True
+        except Exception as err:
+            raise Exception(f"[insert_multiple_rows] {err}")
+
+    def get_metrics(self):
+        """
+            Returns flush metrics.
+
+            Returns:
+            - dict: Metrics of StorageBackend with the number of rows written added.
+        """
+        metrics = super().get_metrics()
+        metrics['rows_written'] = self.rows_written
+        return metrics
+
+    def close(self):
+        """Flushes and unmaps the current segment."""
+        self._close_segment()
+
+
+def list_segments(store_dir):
+    """
+    Returns the segments of a store in the order they were created.
+
+    Parameters:
+    store_dir (str): Directory of the segments.
+
+    Returns:
+    list: Names of the segment directories with a meta.json.
+    """
+    if not os.path.isdir(store_dir):
+        return []
+    return sorted(name for name in os.listdir(store_dir)
+                  if name.startswith('segment_') and os.path.exists(os.path.join(store_dir, name,
+                                                                                 MmapStorageBackend.meta_file)))
+
+
+def read_meta(store_dir, segment):
+    """
+    Reads the meta.json of a segment.
+
+    Parameters:
+    store_dir (str): Directory of the segments.
+    segment (str): Name of the segment.
+
+    Returns:
+    dict: Stations, capacity and committed row count of the segment.
+    """
+    with open(os.path.join(store_dir, segment, MmapStorageBackend.meta_file)) as meta_file:
+        return json.load(meta_file)
+
+
+def read_segment(store_dir, segment):
+    """
+    Maps the committed rows of a segment read-only.
+
+    Parameters:
+    store_dir (str): Directory of the segments.
+    segment (str): Name of the segment.
+
+    Returns:
+    tuple: (timestamps, values, naptan_ids) where timestamps is a datetime64[s] view of the committed rows, values a
+    float32 view of shape (stations, rows) and naptan_ids the station of each row of values.
+    """
+    meta = read_meta(store_dir, segment)
+    rows = meta['rows']
+    naptan_ids = tuple(meta['naptan_ids'])
+    if rows == 0:
+        return np.empty(0, dtype='datetime64[s]'), np.empty((len(naptan_ids), 0), dtype=np.float32), naptan_ids
+    timestamps = np.memmap(os.path.join(store_dir, segment, MmapStorageBackend.timestamps_file), dtype=np.int64,
+                           mode='r', shape=(meta['capacity'],))[:rows].view('datetime64[s]')
+    values = np.memmap(os.path.join(store_dir, segment, MmapStorageBackend.values_file), dtype=np.float32, mode='r',
+                       shape=(len(naptan_ids), meta['capacity']))[:, :rows]
+    return timestamps, values, naptan_ids
+
+
+def read_range(store_dir, start, end):
+    """
+    Reads the rows of a time range. Rows are selected by a mask, as the local timestamps repeat an hour when the
+    clocks go back, and returned as read-only views of the segment mappings where they are contiguous, as copies
+    otherwise.
+
+    Parameters:
+    store_dir (str): Directory of the segments.
+    start (str): First timestamp of the range, 'YYYY-MM-DD HH:MM:SS'.
+    end (str): Last timestamp of the range, 'YYYY-MM-DD HH:MM:SS'.
+
+    Returns:
+    list: (timestamps, values, naptan_ids) per segment with rows in the range, as returned by read_segment. The
+    station values of a segment are its rows of values, e.g. values[naptan_ids.index('940GZZLUOXC')].
+
+    Raises:
+    Exception: If a segment cannot be read, with tag [read_range].
+    """
+    try:
+        start = np.datetime64(start.replace(' ', 'T'), 's')
+        end = np.datetime64(end.replace(' ', 'T'), 's')
+        chunks = []
+        for segment in list_segments(store_dir):
+            timestamps, values, naptan_ids = read_segment(store_dir, segment)
+            rows = np.flatnonzero((timestamps >= start) & (timestamps <= end))
+            if len(rows) == 0:
+                continue
+            if rows[-1] - rows[0] + 1 == len(rows):
+                chunks.append((timestamps[rows[0]:rows[-1] + 1], values[:, rows[0]:rows[-1] + 1], naptan_ids))
+            else:
+                chunks.append((timestamps[rows], values[:, rows], naptan_ids))
+        return chunks
+    except Exception as err:
+        raise Exception(f"[read_range] {err}")
@@ -0,0 +1,182 @@
+from datetime import datetime, date, timedelta
+from DatabaseHandler import DatabaseHandler
+
+
+class PartitionedDatabaseHandler(DatabaseHandler):
+    """
+        A class to store crowding data in a single table range partitioned on c_timestamp.
+
+        Partitions cover partition_days days each and are created ahead of time. A station set change adds the
+        missing station columns to the parent table instead of creating a new table, and partitions older than
+        the retention period are detached or dropped.
+
+        Attributes:
+        - parent_table (str): Name of the partitioned parent table.
+        - partition_days (int): Number of days covered by one partition.
+        - partitions_ahead (int): Number of partitions created ahead of the latest row.
+        - retention_days (int or None): Days after which partitions are expired, None to keep them forever.
+        - detach_expired (bool): Whether expired partitions are detached instead of dropped.
+        - _known_partitions (set): Start dates of partitions known to exist. Note: Internal attribute.
+        - _last_retention_date (date or None): Date retention was last applied. Note: Internal attribute.
+    """
+    def __init__(self, max_rows_in_commit, parent_table, db_params, load_method='values', partition_days=1,
+                 partitions_ahead=3, retention_days=None, detach_expired=False, pool_size=2, health_check_after_sec=30,
+                 rollup=None):
+        """
+            Initializes the PartitionedDatabaseHandler instance.
+
+            Args:
+            - max_rows_in_commit (int): Maximum number of rows to insert in a single commit.
+            - parent_table (str): Name of the partitioned parent table.
+            - db_params (dict): Database connection parameters.
+            - load_method (str): How planned rows are loaded, 'values', 'copy' or 'prepared'.
+            - partition_days (int): Number of days covered by one partition.
+            - partitions_ahead (int): Number of partitions created ahead of the latest row.
+            - retention_days (int or None): Days after which partitions are expired, None to keep them forever.
+            - detach_expired (bool): Whether expired partitions are detached instead of dropped.
+            - pool_size (int): Maximum number of pooled connections.
+            - health_check_after_sec (float): Idle time after which a pooled connection is checked before reuse.
+            - rollup (CrowdingRollup or None): Rollups updated in the transaction of each insert.
+        """
+        super().__init__(max_rows_in_commit, None, float('inf'), db_params, load_method, pool_size,
+                         health_check_after_sec, rollup)
+        self.parent_table = parent_table
+        self.partition_days = partition_days
+        self.partitions_ahead = partitions_ahead
+        self.retention_days = retention_days
+        self.detach_expired = detach_expired
+        self._known_partitions = set()
+        self._last_retention_date = None
+
+    def partition_start(self, day):
+        """
+            Returns the first day of the partition containing a day.
+
+            Args:
+            - day (date): A day.
+
+            Returns:
+            - date: The first day of the partition.
+        """
+        ordinal = day.toordinal()
+        return date.fromordinal(ordinal - ordinal % self.partition_days)
+
+    def partition_name(self, start):
+        """
+            Returns the name of the partition starting on a day.
+
+            Args:
+            - start (date): The first day of the partition.
+
+            Returns:
+            - str: The partition table name.
+        """
+        return f"{self.parent_table}_p{start.strftime('%Y_%m_%d')}"
+
+    def ensure_partitions(self, day):
+        """
+            Creates the partition containing a day and the partitions ahead of it if they do not exist.
+
+            Args:
+            - day (date): A day that must be covered by a partition.
+        """
+        try:
+            start = self.partition_start(day)
+            for _ in range(self.partitions_ahead + 1):
+                end = start + timedelta(days=self.partition_days)
+                if start not in self._known_partitions:
+                    self.cursor.execute(f"""
+                        CREATE TABLE IF NOT EXISTS {self.partition_name(start)}
+                        PARTITION OF {self.parent_table}
+                        FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}');
+                    """)
+                    self._known_partitions.add(start)
+                start = end
+        except Exception as err:
+            raise Exception(f"[ensure_partitions] {err}")
+
+    def apply_retention(self, today):
+        """
+            Detaches or drops the partitions that ended more than retention_days before a day.
+
+            Args:
+            - today (date): The current day.
+        """
+        try:
+            if self.retention_days is None or self._last_retention_date == today:
+                return
+
+            self.cursor.execute("""
+                SELECT child.relname FROM pg_inherits
+                JOIN pg_class parent ON pg_inherits.inhparent = parent.oid
+                JOIN pg_class child ON pg_inherits.inhrelid = child.oid
+                WHERE parent.relname = %s;
+            """, (self.parent_table,))
+            partitions = [row[0] for row in self.cursor.fetchall()]
+
+            oldest_kept = today - timedelta(days=self.retention_days)
+            prefix = f"{self.parent_table}_p"
+            expired = False
+            for partition in partitions:
+                if not partition.startswith(prefix):
+                    continue
+                start = datetime.strptime(partition[len(prefix):], '%Y_%m_%d').date()
+                if start + timedelta(days=self.partition_days) > oldest_kept:
+                    continue
+                if self.detach_expired:
+                    self.cursor.execute(f"ALTER TABLE {self.parent_table} DETACH PARTITION {partition};")
+                else:
+                    self.cursor.execute(f"DROP TABLE {partition};")
+                self._known_partitions.discard(start)
+                expired = True
+
+            if expired:
+                self.ensure_catalog()
+                self.cursor.execute(f"""
+                    UPDATE {self.catalog_table} SET first_timestamp = (SELECT MIN(c_timestamp) FROM {self.parent_table})
+                    WHERE table_name = %s;
+                """, (self.parent_table,))
+
+            self._last_retention_date = today
+        except Exception as err:
+            raise Exception(f"[apply_retention] {err}")
+
+    def create_table(self, naptan_ids, timestamp):
+        """
+            Creates the partitioned parent table if needed and adds the missing station columns.
+
+            Args:
+            - naptan_ids (list): List of station IDs.
+            - timestamp (str): Timestamp of the first row to be inserted.
+        """
+        try:
+            self.cursor.execute(f"""
+                CREATE TABLE IF NOT EXISTS {self.parent_table} (
+                    c_timestamp TIMESTAMP PRIMARY KEY
+                ) PARTITION BY RANGE (c_timestamp);
+            """)
+            if naptan_ids:
+                add_columns = ', '.join([f'ADD COLUMN IF NOT EXISTS "{n_id}" NUMERIC(5,4)' for n_id in naptan_ids])
+                self.cursor.execute(f"ALTER TABLE {self.parent_table} {add_columns};")
+            self.ensure_partitions(datetime.strptime(timestamp, '%Y-%m-%d %H:%M:%S').date())
+            self.register_table(self.parent_table, naptan_ids, scan_existing=True)
+            self.connection.commit()
+
+            self.stations_sequence = naptan_ids
+            self.rows_left = self.max_rows
+            self.current_crowding_data_table = self.parent_table
+            return True
+        except Exception as err:
+            raise Exception(f"[create_table] {err}")
+
+    def insert_planned_rows(self):
+        """Applies retention, makes sure the planned rows have partitions and inserts the rows."""
+        try:
+            self.apply_retention(date.today())
+            days = {datetime.strptime(timestamp, '%Y-%m-%d %H:%M:%S').date() for timestamp, _ in self.planned_to_insert}
+            for day in sorted(days):
+                self.ensure_partitions(day)
+            self.connection.commit()
+        except Exception as err:
+            raise Exception(f"[insert_multiple_rows] {err}")
+        return super().insert_planned_rows()
@@ -0,0 +1,134 @@
+import threading
+import time
+
+
+class RateLimiter:
+    """
+        A thread-safe token bucket shared by all requests, adapting its rate to throttling by the server.
+
+        The bucket refills at the current rate up to burst tokens. A throttled response halves the current rate
+        and, with a Retry-After, holds all requests until it passes. Each successful request then raises the
+        current rate a little until it is back at the configured rate.
+
+        Attributes:
+        - max_rate (float or None): Configured requests per second, None for no limit.
+        - rate (float or None): Current requests per second.
+        - burst (float): Capacity of the bucket in requests.
+        - min_rate (float): Lowest rate the limiter backs off to.
+        - decrease_factor (float): Factor the rate is multiplied by when throttled.
+        - recovery_step (float): Fraction of max_rate added back after each successful request.
+        - throttled_count (int): Number of throttled responses reported.
+        - _tokens (float): Tokens in the bucket. Note: Internal attribute, avoid direct access.
+        - _updated_at (float): Monotonic time of the last refill. Note: Internal attribute.
+        - _blocked_until (float): Monotonic time before which no request may start. Note: Internal attribute.
+        - _lock (threading.Lock): Lock guarding the bucket. Note: Internal attribute.
+    """
+    def __init__(self, requests_per_sec=None, burst=1, min_rate=0.5, decrease_factor=0.5, recovery_step=0.02):
+        """
+            Initializes the RateLimiter instance.
+
+            Args:
+            - requests_per_sec (float or None): Maximum number of requests per second, None for no limit.
+            - burst (float): Capacity of the bucket in requests.
+            - min_rate (float): Lowest rate the limiter backs off to.
+            - decrease_factor (float): Factor the rate is multiplied by when throttled.
+            - recovery_step (float): Fraction of the maximum rate added back after each successful request.
+        """
+        self.min_rate = min_rate
+        self.decrease_factor = decrease_factor
+        self.recovery_step = recovery_step
+        self.throttled_count = 0
+        self.max_rate = None
+        self.rate = None
+        self.burst = 1.0
+        self._tokens = 1.0
+        self._updated_at = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+        self.set_rate(requests_per_sec, burst)
+
+    def set_rate(self, requests_per_sec, burst=None):
+        """
+            Sets the maximum request rate.
+
+            Args:
+            - requests_per_sec (float or None): Maximum number of requests per second, None for no limit.
+            - burst (float or None): Capacity of the bucket in requests, unchanged if None.
+
+            Raises:
+            - Exception: If the rate or the burst is not positive.
+        """
+        try:
+            if requests_per_sec is not None and requests_per_sec <= 0:
+                raise ValueError(f"Request rate must be positive, got {requests_per_sec}.")
+            if burst is not None and burst < 1:
+                raise ValueError(f"Burst must be at least 1, got {burst}.")
+            with self._lock:
+                self.max_rate = requests_per_sec
+                self.rate = requests_per_sec
+                if burst is not None:
+                    self.burst = float(burst)
+                self._tokens = self.burst
+                self._updated_at = time.monotonic()
+        except Exception as err:
+            raise Exception(f"[set_rate] {err}")
+
+    def _refill(self, now):
+        """
+            Adds the tokens earned since the last refill.
+
+            Args:
+            - now (float): Current monotonic time.
+        """
+        if self.rate is not None:
+            self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def acquire(self):
+        """Blocks until the calling thread is allowed to send the next request."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self._blocked_until:
+                    delay = self._blocked_until - now
+                elif self.rate is None:
+                    return
+                else:
+                    self._refill(now)
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+
+    def on_success(self):
+        """Raises the current rate back towards the maximum rate after a successful request."""
+        with self._lock:
+            if self.max_rate is not None and self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + self.max_rate * self.recovery_step)
+
+    def on_throttled(self, retry_after_sec=None):
+        """
+            Backs off after a throttled response.
+
+            Args:
+            - retry_after_sec (float or None): Time the server asked to wait before retrying, in seconds.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.throttled_count += 1
+            if self.rate is not None:
+                self._refill(now)
+                self.rate = max(min(self.min_rate, self.max_rate), self.rate * self.decrease_factor)
+            if retry_after_sec:
+                self._blocked_until = max(self._blocked_until, now + retry_after_sec)
+
+    def get_stats(self):
+        """
+            Returns the state of the limiter.
+
+            Returns:
+            - dict: Configured and current rate and the number of throttled responses.
+        """
+        with self._lock:
+            return {'max_rate': self.max_rate, 'rate': self.rate, 'throttled_count': self.throttled_count}
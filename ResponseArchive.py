@@ -0,0 +1,349 @@
+import argparse
+import base64
+import gzip
+import json
+import os
+import threading
+import time
+import zlib
+from HttpSession import SessionResponse
+from Metrics import registry
+
+
+class ResponseArchive:
+    """
+        An append-only archive of raw TfL API responses, kept as gzip compressed JSON lines segments.
+
+        Every final response of get_response is recorded with its URL, time, status and body. After each kept
+        sweep the collector adds a sweep marker with the epoch and stations of its row, so a replay can rebuild
+        the row from the responses recorded before the marker. The segment is flushed at each marker, so a crash
+        loses at most the responses of the running sweep. Each process writes its own segments and a segment is
+        closed once it grows past segment_max_bytes.
+
+        Attributes:
+        - archive_dir (str): Directory of the segments.
+        - segment_max_bytes (int): Compressed size after which a new segment is started.
+        - compresslevel (int): gzip compression level.
+        - responses_recorded (int): Number of responses recorded.
+        - sweeps_recorded (int): Number of sweep markers recorded.
+        - write_errors (int): Number of records lost because the segment could not be written.
+        - _segment (gzip.GzipFile or None): The open segment. Note: Internal attribute, avoid direct access.
+        - _segment_file (file or None): File object under the open segment. Note: Internal attribute.
+        - _segment_index (int): Number of segments opened by this process. Note: Internal attribute.
+        - _lock (threading.Lock): Lock serialising records of the request threads. Note: Internal attribute.
+    """
+    segment_prefix = 'responses-'
+    segment_suffix = '.jsonl.gz'
+
+    def __init__(self, archive_dir, segment_max_mb=64, compresslevel=6):
+        """
+            Initializes the ResponseArchive instance.
+
+            Args:
+            - archive_dir (str): Directory of the segments, created if it does not exist.
+            - segment_max_mb (float): Compressed size after which a new segment is started in megabytes.
+            - compresslevel (int): gzip compression level.
+        """
+        self.archive_dir = archive_dir
+        self.segment_max_bytes = int(segment_max_mb * 1024 * 1024)
+        self.compresslevel = compresslevel
+        self.responses_recorded = 0
+        self.sweeps_recorded = 0
+        self.write_errors = 0
+        self._segment = None
+        self._segment_file = None
+        self._segment_index = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.archive_dir, exist_ok=True)
+
+    def _open_segment(self):
+        """Opens a new segment named after the current time, the process and the segment count."""
+        self._segment_index += 1
+        name = (f"{self.segment_prefix}{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}-{self._segment_index:04d}"
+                f"{self.segment_suffix}")
+        self._segment_file = open(os.path.join(self.archive_dir, name), 'ab')
+        self._segment = gzip.GzipFile(fileobj=self._segment_file, mode='ab', compresslevel=self.compresslevel)
+
+    def _close_segment(self):
+        """Closes the open segment, completing its gzip trailer."""
+        if self._segment is not None:
+            self._segment.close()
+            self._segment_file.close()
+        self._segment = None
+        self._segment_file = None
+
+    def _write(self, record):
+        """
+            Appends a record to the open segment. Never raises, a failed write only counts as a write error.
+
+            Args:
+            - record (dict): JSON serialisable record.
+
+            Returns:
+            - bool: True if the record was written, False otherwise.
+        """
+        line = (json.dumps(record, separators=(',', ':')) + '\n').encode()
+        with self._lock:
+            try:
+                if self._segment is None:
+                    self._open_segment()
+                self._segment.write(line)
+                return True
+            except Exception as err:
+                self.write_errors += 1
+                registry.record_error(f"[record] {err}")
+                self._close_segment()
+                return False
+
+    def record(self, url, status, reason, body=b''):
+        """
+            Records a response.
+
+            Args:
+            - url (str): The requested URL.
+            - status (int): HTTP status code, 0 if the request failed without a response.
+            - reason (str): HTTP reason phrase or the error of a failed request.
+            - body (bytes): Decoded response body.
+        """
+        record = {'kind': 'response', 'time': time.time(), 'url': url, 'status': status, 'reason': reason}
+        try:
+            record['body'] = body.decode('utf-8')
+        except UnicodeDecodeError:
+            record['body_b64'] = base64.b64encode(body).decode('ascii')
+        if self._write(record):
+            self.responses_recorded += 1
+
+    def mark_sweep(self, epoch, naptan_ids):
+        """
+            Records the end of a kept sweep and flushes the segment, starting a new one if it grew too large.
+
+            Args:
+            - epoch (int): Time of the sweep's row in seconds since the Unix epoch.
+            - naptan_ids (tuple): Naptan IDs of the stations of the row, in row order.
+        """
+        if not self._write({'kind': 'sweep', 'time': time.time(), 'epoch': int(epoch), 'naptan_ids': list(naptan_ids)}):
+            return
+        self.sweeps_recorded += 1
+        with self._lock:
+            try:
+                self._segment.flush(zlib.Z_SYNC_FLUSH)
+                if self._segment_file.tell() >= self.segment_max_bytes:
+                    self._close_segment()
+            except Exception as err:
+                self.write_errors += 1
+                registry.record_error(f"[mark_sweep] {err}")
+                self._close_segment()
+
+    def close(self):
+        """Closes the open segment."""
+        with self._lock:
+            self._close_segment()
+
+    def get_stats(self):
+        """
+            Returns recording counters of the archive.
+
+            Returns:
+            - dict: Responses and sweeps recorded and write errors.
+        """
+        return {'responses_recorded': self.responses_recorded, 'sweeps_recorded': self.sweeps_recorded,
+                'write_errors': self.write_errors}
+
+
+def url_path(url):
+    """
+    Returns the path and query of a URL, cheaper than urllib.parse for the millions of URLs of a replay.
+
+    Parameters:
+    url (str): An absolute URL such as 'https://api.tfl.gov.uk/crowding/940GZZLUOXC/Live'.
+
+    Returns:
+    str: The URL without scheme and host, e.g. '/crowding/940GZZLUOXC/Live'.
+    """
+    path_start = url.find('/', url.find('//') + 2)
+    return url[path_start:] if path_start != -1 else '/'
+
+
+def iter_records(archive_dir):
+    """
+    Reads the records of all segments in recording order. A segment cut short by a crash is read up to its last
+    complete record.
+
+    Parameters:
+    archive_dir (str): Directory of the segments.
+
+    Returns:
+    generator: Records as dicts.
+    """
+    names = sorted(name for name in os.listdir(archive_dir)
+                   if name.startswith(ResponseArchive.segment_prefix) and name.endswith(ResponseArchive.segment_suffix))
+    for name in names:
+        with gzip.open(os.path.join(archive_dir, name), 'rb') as segment:
+            try:
+                for line in segment:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        break
+            except (EOFError, gzip.BadGzipFile, zlib.error):
+                pass
+
+
+def iter_sweeps(archive_dir, start_epoch=None, end_epoch=None):
+    """
+    Groups the recorded responses into the sweeps whose markers follow them, keyed by URL path so archives
+    replay whatever API base they were recorded from. A path recorded more than once before a marker, e.g. the
+    late response of a sweep given up at its deadline, keeps its latest response.
+
+    Parameters:
+    archive_dir (str): Directory of the segments.
+    start_epoch (int or None): First row time to replay, from the start of the archive if None.
+    end_epoch (int or None): Last row time to replay, up to the end of the archive if None.
+
+    Returns:
+    generator: (epoch, naptan_ids, responses) per sweep, responses being the latest record per URL path.
+    """
+    responses = {}
+    for record in iter_records(archive_dir):
+        if record.get('kind') == 'response':
+            responses[url_path(record['url'])] = record
+        elif record.get('kind') == 'sweep':
+            epoch = record['epoch']
+            if (start_epoch is None or epoch >= start_epoch) and (end_epoch is None or epoch <= end_epoch):
+                yield epoch, tuple(record['naptan_ids']), responses
+            responses = {}
+
+
+def record_to_response(record):
+    """
+    Rebuilds the response of a recorded request.
+
+    Parameters:
+    record (dict): A response record.
+
+    Returns:
+    SessionResponse: The recorded response.
+
+    Raises:
+    Exception: If the request had failed without a response.
+    """
+    if record['status'] == 0:
+        raise Exception(record['reason'])
+    body = record['body'].encode('utf-8') if 'body' in record else base64.b64decode(record['body_b64'])
+    return SessionResponse(record['url'], record['status'], record['reason'], {}, body)
+
+
+def replay_archive(archive_dir, database_handler, columnar=True, rows_per_flush=5000, start_epoch=None,
+                   end_epoch=None):
+    """
+    Feeds recorded sweeps through get_crowding_data, a DataDumper and a database handler as fast as the database
+    takes them: responses come from the archive, without rate limiting, retries or pauses, and rows are
+    inserted rows_per_flush at a time.
+
+    Parameters:
+    archive_dir (str): Directory of the segments.
+    database_handler (DatabaseHandler): Handler the rows are inserted with.
+    columnar (bool): Whether the rows are kept in the columnar layout of the DataDumper.
+    rows_per_flush (int): Number of rows passed to the database handler at once.
+    start_epoch (int or None): First row time to replay, from the start of the archive if None.
+    end_epoch (int or None): Last row time to replay, up to the end of the archive if None.
+
+    Returns:
+    dict: Number of sweeps, rows, stations and failed stations replayed, the time taken and rows per second.
+
+    Raises:
+    Exception: If reading the archive or inserting rows fails, with tag [replay_archive].
+    """
+    from DataDumper import DataDumper
+    from tube_functions import get_crowding_data, set_response_source
+
+    sweep_responses = {}
+
+    def source(url):
+        record = sweep_responses.get(url_path(url))
+        if record is None:
+            raise Exception(f"No recorded response of {url}")
+        return record_to_response(record)
+
+    stats = {'sweeps': 0, 'rows': 0, 'stations': 0, 'stations_failed': 0}
+    started_at = time.monotonic()
+    set_response_source(source)
+    try:
+        dumper = DataDumper(0, columnar)
+        pending_rows = 0
+        for epoch, naptan_ids, responses in iter_sweeps(archive_dir, start_epoch, end_epoch):
+            sweep_responses = responses
+            dumper.set_stations(naptan_ids)
+            dumper.create_new_row(epoch)
+            for naptan_id in naptan_ids:
+                try:
+                    crowding_data = get_crowding_data(naptan_id)
+                except Exception:
+                    crowding_data = None
+                    stats['stations_failed'] += 1
+                dumper.add_station_to_row(station_name=naptan_id, crowding_data=crowding_data)
+            stats['sweeps'] += 1
+            stats['stations'] += len(naptan_ids)
+            pending_rows += 1
+
+            if pending_rows >= rows_per_flush:
+                database_handler.insert_dumper(dumper.get_dumper())
+                dumper.clear_data()
+                stats['rows'] += pending_rows
+                pending_rows = 0
+        if pending_rows:
+            database_handler.insert_dumper(dumper.get_dumper())
+            dumper.clear_data()
+            stats['rows'] += pending_rows
+
+        stats['seconds'] = time.monotonic() - started_at
+        stats['rows_per_sec'] = stats['rows'] / stats['seconds'] if stats['seconds'] else 0.0
+        return stats
+    except Exception as err:
+        raise Exception(f"[replay_archive] {err}")
+    finally:
+        set_response_source(None)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay responses recorded with --record_dir into the database, "
+                                                 "as fast as the database takes them.")
+
+    parser.add_argument("-a", "--archive_dir", type=str, required=True,
+                        help="Directory of the recorded segments")
+    parser.add_argument("-ct", "--crowding_table", type=str, default=None,
+                        help="Table to continue, new tables are created if omitted")
+    parser.add_argument("-mt", "--max_table", type=int, default=4000,
+                        help="Maximum number of rows in a table")
+    parser.add_argument("-mc", "--max_commit", type=int, default=1000,
+                        help="Maximum number of rows inserted in a single commit")
+    parser.add_argument("-lm", "--load_method", type=str, default='copy', choices=('values', 'copy', 'prepared'),
+                        help="How rows are loaded, COPY is the fastest")
+    parser.add_argument("-rf", "--rows_per_flush", type=int, default=5000,
+                        help="Number of rows passed to the database at once")
+    parser.add_argument("-ru", "--rollups", action="store_true",
+                        help="Maintain the per-station rollups of the replayed rows")
+    parser.add_argument("-s", "--start", type=int, default=None,
+                        help="First row time to replay in seconds since the Unix epoch")
+    parser.add_argument("-e", "--end", type=int, default=None,
+                        help="Last row time to replay in seconds since the Unix epoch")
+
+    args = parser.parse_args()
+
+    from config import db_params
+    from DatabaseHandler import DatabaseHandler
+
+    rollup = None
+    if args.rollups:
+        from CrowdingRollup import CrowdingRollup
+        rollup = CrowdingRollup()
+
+    handler = DatabaseHandler(args.max_commit, args.crowding_table, args.max_table, db_params, args.load_method,
+                              rollup=rollup)
+    try:
+        result = replay_archive(args.archive_dir, handler, rows_per_flush=args.rows_per_flush,
+                                start_epoch=args.start, end_epoch=args.end)
+    finally:
+        handler.close()
+    print(f"Replayed {result['sweeps']} sweeps, {result['rows']} rows ({result['stations_failed']} failed stations) "
+          f"in {result['seconds']:.2f} s, {result['rows_per_sec']:.0f} rows/s.")
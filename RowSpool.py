@@ -0,0 +1,190 @@
+import json
+import os
+import threading
+
+
+class RowSpool:
+    """
+        A class to keep sampled rows in a local append-only file until they are written to the database.
+
+        Rows are appended as JSON lines to rows.log and the byte offset of the first row not yet in the database
+        is kept in the offset file, so rows survive database outages and process restarts. Appends are flushed
+        at once and fsynced in batches. Consumed rows are compacted away when the file grows past its limit.
+
+        Pending rows are read with their sizes and committed by the number of bytes consumed, relative to the
+        committed offset, so a compaction by append between read_pending and commit does not invalidate them.
+        A single consumer is assumed.
+
+        Attributes:
+        - spool_dir (str): Directory of the spool files.
+        - max_bytes (int): Maximum size of the rows file in bytes.
+        - fsync_every (int): Number of appended rows after which the rows file is fsynced.
+        - rows_appended (int): Number of rows appended since start.
+        - rows_committed (int): Number of rows marked as written since start.
+        - _committed_offset (int): Byte offset of the first row not yet written. Note: Internal attribute.
+        - _unsynced (int): Number of rows appended since the last fsync. Note: Internal attribute.
+        - _file: Rows file opened for appending. Note: Internal attribute, avoid direct access.
+        - _lock (threading.Lock): Lock guarding the spool files. Note: Internal attribute.
+    """
+    def __init__(self, spool_dir, max_bytes=256 * 1024 * 1024, fsync_every=10):
+        """
+            Initializes the RowSpool instance and opens or creates the spool files.
+
+            Args:
+            - spool_dir (str): Directory of the spool files.
+            - max_bytes (int): Maximum size of the rows file in bytes.
+            - fsync_every (int): Number of appended rows after which the rows file is fsynced.
+        """
+        self.spool_dir = spool_dir
+        self.max_bytes = max_bytes
+        self.fsync_every = max(1, fsync_every)
+        self.rows_appended = 0
+        self.rows_committed = 0
+        self._unsynced = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(self.spool_dir, exist_ok=True)
+        self._rows_path = os.path.join(self.spool_dir, 'rows.log')
+        self._offset_path = os.path.join(self.spool_dir, 'offset')
+
+        self._committed_offset = 0
+        if os.path.exists(self._offset_path):
+            with open(self._offset_path, 'r') as offset_file:
+                self._committed_offset = int(offset_file.read().strip() or 0)
+        self._file = open(self._rows_path, 'ab')
+        self._truncate_partial_row()
+
+    def _truncate_partial_row(self):
+        """Cuts off a row left half written by a crash, so the next append starts on a new line."""
+        size = self._file.seek(0, os.SEEK_END)
+        if size == 0:
+            return
+        with open(self._rows_path, 'rb') as rows_file:
+            data = rows_file.read()
+        last_newline = data.rfind(b'\n')
+        if last_newline != size - 1:
+            self._file.truncate(last_newline + 1)
+            self._file.seek(0, os.SEEK_END)
+
+    def _write_offset(self, offset):
+        """
+            Atomically writes the committed offset.
+
+            Args:
+            - offset (int): Byte offset of the first row not yet written.
+        """
+        tmp_path = f"{self._offset_path}.tmp"
+        with open(tmp_path, 'w') as offset_file:
+            offset_file.write(str(offset))
+            offset_file.flush()
+            os.fsync(offset_file.fileno())
+        os.replace(tmp_path, self._offset_path)
+        self._committed_offset = offset
+
+    def _compact(self):
+        """
+            Removes the rows already written from the start of the rows file. The offset is reset before the file
+            is replaced, so a crash in between replays written rows instead of skipping pending ones.
+        """
+        if self._committed_offset == 0:
+            return
+        self._file.flush()
+        tmp_path = f"{self._rows_path}.tmp"
+        with open(self._rows_path, 'rb') as rows_file, open(tmp_path, 'wb') as tmp_file:
+            rows_file.seek(self._committed_offset)
+            tmp_file.write(rows_file.read())
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+        self._file.close()
+        self._write_offset(0)
+        os.replace(tmp_path, self._rows_path)
+        self._file = open(self._rows_path, 'ab')
+
+    def append(self, row):
+        """
+            Appends a row to the spool.
+
+            Args:
+            - row (list): Row as [timestamp_str, {naptan_id: float or None}].
+
+            Raises:
+            - Exception: If the spool is full even after compaction.
+        """
+        try:
+            line = (json.dumps(row, separators=(',', ':')) + '\n').encode()
+            with self._lock:
+                if self._file.tell() + len(line) > self.max_bytes:
+                    self._compact()
+                if self._file.tell() + len(line) > self.max_bytes:
+                    raise Exception(f"Spool is full, {self._file.tell() - self._committed_offset} bytes pending.")
+                self._file.write(line)
+                self._file.flush()
+                self.rows_appended += 1
+                self._unsynced += 1
+                if self._unsynced >= self.fsync_every:
+                    os.fsync(self._file.fileno())
+                    self._unsynced = 0
+        except Exception as err:
+            raise Exception(f"[append] {err}")
+
+    def read_pending(self, max_rows):
+        """
+            Reads rows not yet written to the database.
+
+            Args:
+            - max_rows (int): Maximum number of rows to read.
+
+            Returns:
+            - tuple: (rows, consumed_bytes) where consumed_bytes[i] is the number of bytes from the first pending row
+              to just after rows[i].
+        """
+        try:
+            with self._lock:
+                self._file.flush()
+                rows = []
+                consumed_bytes = []
+                with open(self._rows_path, 'rb') as rows_file:
+                    rows_file.seek(self._committed_offset)
+                    consumed = 0
+                    while len(rows) < max_rows:
+                        line = rows_file.readline()
+                        if not line.endswith(b'\n'):
+                            break
+                        consumed += len(line)
+                        rows.append(json.loads(line))
+                        consumed_bytes.append(consumed)
+                return rows, consumed_bytes
+        except Exception as err:
+            raise Exception(f"[read_pending] {err}")
+
+    def commit(self, consumed_bytes, row_count):
+        """
+            Marks the first pending rows as written to the database.
+
+            Args:
+            - consumed_bytes (int): Number of bytes of the written rows, as returned by read_pending.
+            - row_count (int): Number of rows written.
+        """
+        try:
+            with self._lock:
+                self._write_offset(self._committed_offset + consumed_bytes)
+                self.rows_committed += row_count
+        except Exception as err:
+            raise Exception(f"[commit] {err}")
+
+    def pending_bytes(self):
+        """
+            Returns the size of the rows not yet written to the database.
+
+            Returns:
+            - int: Number of pending bytes.
+        """
+        with self._lock:
+            return self._file.tell() - self._committed_offset
+
+    def close(self):
+        """Fsyncs and closes the rows file."""
+        with self._lock:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
@@ -0,0 +1,481 @@
+import argparse
+import hashlib
+import os
+import socket
+import threading
+import time
+from collections import Counter
+from multiprocessing.connection import Listener, Client
+from CrowdingSweeper import CrowdingSweeper
+from Metrics import registry
+
+LOCAL_WORKER_ID = 'coordinator'
+
+
+def parse_address(address):
+    """
+    Parses a 'host:port' address.
+
+    Parameters:
+    address (str): Address such as '0.0.0.0:6000'.
+
+    Returns:
+    tuple: (host, port).
+    """
+    host, _, port = address.rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+
+def station_weight(worker_id, naptan_id):
+    """
+    Returns the rendezvous hashing weight of a station on a worker, the same in every process and on every host.
+
+    Parameters:
+    worker_id (str): ID of the worker.
+    naptan_id (str): The Naptan ID of the station.
+
+    Returns:
+    int: Weight of the pair.
+    """
+    digest = hashlib.blake2b(f"{worker_id}\0{naptan_id}".encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'big')
+
+
+def assign_shards(naptan_ids, worker_ids):
+    """
+    Partitions stations across workers with rendezvous hashing, so a worker joining or leaving only moves
+    the stations it gains or owned.
+
+    Parameters:
+    naptan_ids (tuple): Naptan IDs of the stations.
+    worker_ids (list): IDs of the workers.
+
+    Returns:
+    dict: Stations of each worker in the order of naptan_ids.
+    """
+    shards = {worker_id: [] for worker_id in worker_ids}
+    if not shards:
+        return shards
+    for naptan_id in naptan_ids:
+        owner = max(worker_ids, key=lambda worker_id: station_weight(worker_id, naptan_id))
+        shards[owner].append(naptan_id)
+    return shards
+
+
+class ShardRow:
+    """
+        A row of a single shard, filled by CrowdingSweeper.sweep in place of a DataDumper.
+
+        Attributes:
+        - values (dict): Crowding value or None per Naptan ID.
+    """
+    def __init__(self):
+        """Initializes the ShardRow instance."""
+        self.values = {}
+
+    def add_station_to_row(self, station_name, crowding_data):
+        """
+            Records the crowding value of a station.
+
+            Args:
+            - station_name (str): The Naptan ID of the station.
+            - crowding_data (float or None): Crowding value, None if missing.
+        """
+        self.values[station_name] = crowding_data
+
+
+class ShardCoordinator:
+    """
+        A drop-in replacement of CrowdingSweeper that spreads each sweep over worker processes or hosts.
+
+        Workers connect to the coordinator's listener and are sent their shard of the stations on every sweep.
+        Shards are assigned with rendezvous hashing over the workers connected at the start of the sweep, so
+        joining and leaving workers rebalance on the next tick and only their stations move. The coordinator
+        merges the shard rows in station order into the dumper. Stations of workers that did not answer in time
+        are recorded as missing, and workers missing too many ticks in a row are dropped.
+
+        Messages are pickled over authenticated multiprocessing connections, so the same authkey must be
+        given to the coordinator and the workers.
+
+        Attributes:
+        - address (tuple): (host, port) the coordinator listens on.
+        - local_sweeper (CrowdingSweeper or None): Sweeper sampling a shard in the coordinator itself, None for
+          remote workers only.
+        - result_timeout_sec (float): Time to wait for the shard rows of a sweep in seconds.
+        - max_failed_fraction (float): Largest fraction of failed stations for which the sweep is kept.
+        - max_missed_ticks (int): Number of ticks in a row a worker may miss before it is dropped.
+        - error_reasons (collections.Counter): Number of failed stations per error reason since start.
+        - stations_failed (int): Number of failed stations since start.
+        - sweeps_dropped (int): Number of sweeps dropped because too many stations failed.
+        - rebalances (int): Number of sweeps whose workers differed from the previous sweep.
+        - _workers (dict): Connection, send lock and missed ticks per worker ID. Note: Internal attribute.
+        - _results (dict): Shard results per (tick, worker ID). Note: Internal attribute, avoid direct access.
+        - _condition (threading.Condition): Condition guarding workers and results. Note: Internal attribute.
+        - _listener (multiprocessing.connection.Listener): Listener of the workers. Note: Internal attribute.
+    """
+    def __init__(self, address, authkey, local_sweeper=None, result_timeout_sec=30, max_failed_fraction=0.0,
+                 max_missed_ticks=3):
+        """
+            Initializes the ShardCoordinator instance and starts accepting workers.
+
+            Args:
+            - address (tuple): (host, port) to listen on.
+            - authkey (bytes): Key the workers authenticate with.
+            - local_sweeper (CrowdingSweeper or None): Sweeper sampling a shard in the coordinator itself.
+            - result_timeout_sec (float): Time to wait for the shard rows of a sweep in seconds.
+            - max_failed_fraction (float): Largest fraction of failed stations for which the sweep is kept.
+            - max_missed_ticks (int): Number of ticks in a row a worker may miss before it is dropped.
+        """
+        self.address = address
+        self.local_sweeper = local_sweeper
+        self.result_timeout_sec = result_timeout_sec
+        self.max_failed_fraction = max_failed_fraction
+        self.max_missed_ticks = max_missed_ticks
+        self.error_reasons = Counter()
+        self.stations_failed = 0
+        self.sweeps_dropped = 0
+        self.rebalances = 0
+        self._tick = 0
+        self._last_workers = ()
+        self._workers = {}
+        self._results = {}
+        self._condition = threading.Condition()
+        self._closed = False
+        self._listener = Listener(address, authkey=authkey)
+        threading.Thread(target=self._accept_workers, name="shard-accept", daemon=True).start()
+
+    def _accept_workers(self):
+        """Accepts worker connections until the coordinator is closed."""
+        while not self._closed:
+            try:
+                connection = self._listener.accept()
+            except OSError:
+                if self._closed:
+                    return
+                continue
+            except Exception:
+                continue
+            threading.Thread(target=self._serve_worker, args=(connection,), name="shard-worker",
+                             daemon=True).start()
+
+    def _serve_worker(self, connection):
+        """
+            Registers a worker from its join message and collects its shard results until it disconnects.
+
+            Args:
+            - connection (multiprocessing.connection.Connection): Connection of the worker.
+        """
+        worker_id = None
+        try:
+            message = connection.recv()
+            if message.get('type') != 'join':
+                connection.close()
+                return
+            worker_id = str(message['worker_id'])
+            with self._condition:
+                previous = self._workers.pop(worker_id, None)
+                self._workers[worker_id] = {'connection': connection, 'lock': threading.Lock(), 'missed': 0}
+            if previous is not None:
+                previous['connection'].close()
+            registry.inc('shard_joins_total')
+
+            while True:
+                message = connection.recv()
+                if message.get('type') == 'result':
+                    with self._condition:
+                        self._results[(message['tick'], worker_id)] = message
+                        self._condition.notify_all()
+        except (EOFError, OSError):
+            pass
+        except Exception as err:
+            registry.record_error(f"[serve_worker] {err}")
+        finally:
+            self._drop_worker(worker_id, connection)
+
+    def _drop_worker(self, worker_id, connection):
+        """
+            Forgets a worker unless it already reconnected over another connection, and closes the connection.
+
+            Args:
+            - worker_id (str or None): ID of the worker.
+            - connection (multiprocessing.connection.Connection): Connection of the worker.
+        """
+        with self._condition:
+            worker = self._workers.get(worker_id)
+            if worker is not None and worker['connection'] is connection:
+                del self._workers[worker_id]
+                registry.inc('shard_leaves_total')
+            self._condition.notify_all()
+        try:
+            connection.close()
+        except OSError:
+            pass
+
+    def worker_ids(self):
+        """
+            Returns the IDs of the workers taking part in the next sweep.
+
+            Returns:
+            - list: Sorted worker IDs, with LOCAL_WORKER_ID if the coordinator samples a shard itself.
+        """
+        with self._condition:
+            worker_ids = list(self._workers)
+        if self.local_sweeper is not None:
+            worker_ids.append(LOCAL_WORKER_ID)
+        return sorted(worker_ids)
+
+    def _send_shard(self, worker_id, message):
+        """
+            Sends a sweep request to a worker, dropping the worker if its connection is broken.
+
+            Args:
+            - worker_id (str): ID of the worker.
+            - message (dict): The sweep request.
+
+            Returns:
+            - bool: True if the request was sent, False otherwise.
+        """
+        with self._condition:
+            worker = self._workers.get(worker_id)
+        if worker is None:
+            return False
+        try:
+            with worker['lock']:
+                worker['connection'].send(message)
+            return True
+        except (OSError, ValueError):
+            self._drop_worker(worker_id, worker['connection'])
+            return False
+
+    def sweep(self, naptan_ids, dumper):
+        """
+            Fetches crowding data of all given stations across the workers and adds it to the latest row of the
+            dumper in the order of naptan_ids, failed stations as missing.
+
+            Args:
+            - naptan_ids (tuple): Naptan IDs of the stations to sweep.
+            - dumper (DataDumper): Dumper whose latest row is filled.
+
+            Returns:
+            - collections.Counter: Number of failed stations per error reason in this sweep.
+
+            Raises:
+            - Exception: If no worker is available or the fraction of failed stations is larger than
+              max_failed_fraction.
+        """
+        try:
+            with registry.timer('sweep'):
+                worker_ids = self.worker_ids()
+                if not worker_ids:
+                    raise Exception("No shard workers connected.")
+                if tuple(worker_ids) != self._last_workers:
+                    if self._last_workers:
+                        self.rebalances += 1
+                        registry.inc('shard_rebalances_total')
+                    self._last_workers = tuple(worker_ids)
+
+                self._tick += 1
+                tick = self._tick
+                deadline = time.monotonic() + self.result_timeout_sec
+                shards = assign_shards(naptan_ids, worker_ids)
+
+                pending = set()
+                reasons = Counter()
+                values = {}
+                for worker_id, shard in shards.items():
+                    if worker_id == LOCAL_WORKER_ID or not shard:
+                        continue
+                    message = {'type': 'sweep', 'tick': tick, 'naptan_ids': shard,
+                               'deadline_sec': self.result_timeout_sec * 0.9}
+                    if self._send_shard(worker_id, message):
+                        pending.add(worker_id)
+                    else:
+                        reasons['worker lost'] += len(shard)
+
+                if shards.get(LOCAL_WORKER_ID):
+                    shard_row = ShardRow()
+                    self.local_sweeper.sweep_deadline_sec = self.result_timeout_sec * 0.9
+                    reasons.update(self.local_sweeper.sweep(tuple(shards[LOCAL_WORKER_ID]), shard_row))
+                    values.update(shard_row.values)
+
+                with self._condition:
+                    while pending:
+                        for worker_id in list(pending):
+                            result = self._results.pop((tick, worker_id), None)
+                            if result is not None:
+                                values.update(result['values'])
+                                reasons.update(result['reasons'])
+                                pending.discard(worker_id)
+                                self._workers.get(worker_id, {})['missed'] = 0
+                            elif worker_id not in self._workers:
+                                reasons['worker lost'] += len(shards[worker_id])
+                                pending.discard(worker_id)
+                        remaining = deadline - time.monotonic()
+                        if not pending or remaining <= 0:
+                            break
+                        self._condition.wait(remaining)
+                    stale = [(worker_id, self._workers.get(worker_id)) for worker_id in pending]
+                    self._results = {key: result for key, result in self._results.items() if key[0] > tick}
+
+                for worker_id, worker in stale:
+                    reasons['worker timeout'] += len(shards[worker_id])
+                    if worker is not None:
+                        worker['missed'] += 1
+                        if worker['missed'] >= self.max_missed_ticks:
+                            self._drop_worker(worker_id, worker['connection'])
+
+                failed = sum(reasons.values())
+                self.error_reasons.update(reasons)
+                self.stations_failed += failed
+                for reason, count in reasons.items():
+                    registry.inc('station_failures_total', count, reason=reason)
+
+                if naptan_ids and failed / len(naptan_ids) > self.max_failed_fraction:
+                    self.sweeps_dropped += 1
+                    details = ', '.join(f"{reason}: {count}" for reason, count in reasons.most_common())
+                    raise Exception(f"{failed}/{len(naptan_ids)} stations failed ({details}).")
+
+                for naptan_id in naptan_ids:
+                    dumper.add_station_to_row(station_name=naptan_id, crowding_data=values.get(naptan_id))
+                return reasons
+        except Exception as err:
+            raise Exception(f"[sweep] {err}")
+
+    def get_stats(self):
+        """
+            Returns worker and failure counters of the sweeps.
+
+            Returns:
+            - dict: Connected workers, rebalances, failed stations in total and per error reason and dropped sweeps.
+        """
+        with self._condition:
+            workers = len(self._workers)
+        return {'workers': workers, 'rebalances': self.rebalances, 'stations_failed': self.stations_failed,
+                'sweeps_dropped': self.sweeps_dropped, 'error_reasons': dict(self.error_reasons)}
+
+    def close(self):
+        """Stops accepting workers, disconnects them and shuts down the local sweeper."""
+        self._closed = True
+        self._listener.close()
+        with self._condition:
+            workers = list(self._workers.items())
+        for worker_id, worker in workers:
+            self._drop_worker(worker_id, worker['connection'])
+        if self.local_sweeper is not None:
+            self.local_sweeper.close()
+
+
+class ShardWorker:
+    """
+        A worker process sampling the shards a ShardCoordinator sends it, reconnecting whenever the
+        coordinator is unreachable.
+
+        Attributes:
+        - address (tuple): (host, port) of the coordinator.
+        - worker_id (str): ID of the worker, stable across restarts so it gets the same shard back.
+        - sweeper (CrowdingSweeper): Sweeper sampling the shards. It never drops a shard, the coordinator decides.
+        - reconnect_sec (float): Time to wait before reconnecting in seconds.
+        - sweeps (int): Number of shards sampled.
+        - _authkey (bytes): Key to authenticate with. Note: Internal attribute, avoid direct access.
+        - _stopping (threading.Event): Event that stops the worker. Note: Internal attribute.
+    """
+    def __init__(self, address, authkey, worker_id=None, max_workers=1, pause_between_stations_sec=0.0,
+                 station_retries=1, reconnect_sec=5):
+        """
+            Initializes the ShardWorker instance.
+
+            Args:
+            - address (tuple): (host, port) of the coordinator.
+            - authkey (bytes): Key to authenticate with.
+            - worker_id (str or None): ID of the worker, '<hostname>-<pid>' if None.
+            - max_workers (int): Maximum number of crowding requests in flight at once.
+            - pause_between_stations_sec (float): Pause of each request thread after a request in seconds.
+            - station_retries (int): Number of retries of a failed station within a shard.
+            - reconnect_sec (float): Time to wait before reconnecting in seconds.
+        """
+        self.address = address
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.sweeper = CrowdingSweeper(max_workers, pause_between_stations_sec, station_retries,
+                                       max_failed_fraction=1.0)
+        self.reconnect_sec = reconnect_sec
+        self.sweeps = 0
+        self._authkey = authkey
+        self._stopping = threading.Event()
+
+    def sample(self, message):
+        """
+            Samples the shard of a sweep request.
+
+            Args:
+            - message (dict): The sweep request with tick, naptan_ids and deadline_sec.
+
+            Returns:
+            - dict: The result message with the values and failure reasons of the shard.
+        """
+        shard_row = ShardRow()
+        self.sweeper.sweep_deadline_sec = message.get('deadline_sec')
+        reasons = self.sweeper.sweep(tuple(message['naptan_ids']), shard_row)
+        self.sweeps += 1
+        return {'type': 'result', 'tick': message['tick'], 'values': shard_row.values, 'reasons': dict(reasons)}
+
+    def run(self):
+        """Serves sweep requests of the coordinator until stop is called."""
+        while not self._stopping.is_set():
+            try:
+                connection = Client(self.address, authkey=self._authkey)
+            except (OSError, EOFError):
+                self._stopping.wait(self.reconnect_sec)
+                continue
+            try:
+                connection.send({'type': 'join', 'worker_id': self.worker_id})
+                while not self._stopping.is_set():
+                    if not connection.poll(1.0):
+                        continue
+                    message = connection.recv()
+                    if message.get('type') == 'sweep':
+                        connection.send(self.sample(message))
+            except (OSError, EOFError):
+                pass
+            finally:
+                connection.close()
+            self._stopping.wait(self.reconnect_sec)
+        self.sweeper.close()
+
+    def stop(self):
+        """Makes run return after the current shard."""
+        self._stopping.set()
+
+
+if __name__ == "__main__":
+    from tube_functions import set_request_rate, configure_session, configure_retries
+
+    parser = argparse.ArgumentParser(description="Run a shard worker sampling the stations a coordinator "
+                                                 "started with --shard_listen assigns to it.")
+
+    parser.add_argument("-c", "--coordinator", type=str, required=True,
+                        help="Address of the coordinator, host:port")
+    parser.add_argument("-k", "--shard_key", type=str, default=os.environ.get('TUBE_CROWDING_SHARD_KEY'),
+                        help="Key shared by the coordinator and its workers, TUBE_CROWDING_SHARD_KEY by default")
+    parser.add_argument("-w", "--worker_id", type=str, default=None,
+                        help="ID of the worker, keep it stable across restarts to get the same shard back")
+    parser.add_argument("-cr", "--concurrent_requests", type=int, default=1,
+                        help="Maximum number of crowding requests in flight at once")
+    parser.add_argument("-rr", "--request_rate", type=float, default=None,
+                        help="Maximum number of requests per second sent to the TfL API by this worker")
+    parser.add_argument("-rt", "--request_timeout", type=float, default=30,
+                        help="Timeout of each request sent to the TfL API in seconds")
+    parser.add_argument("-rm", "--max_request_retries", type=int, default=3,
+                        help="Number of retries of a throttled, failed or server error request")
+    parser.add_argument("-sr", "--station_retries", type=int, default=1,
+                        help="Number of retries of a failed station within a shard")
+
+    args = parser.parse_args()
+    if not args.shard_key:
+        parser.error("a shard key is required, pass --shard_key or set TUBE_CROWDING_SHARD_KEY")
+
+    set_request_rate(args.request_rate)
+    configure_retries(max_retries=args.max_request_retries)
+    configure_session(timeout_sec=args.request_timeout, max_idle_per_host=args.concurrent_requests)
+
+    ShardWorker(parse_address(args.coordinator), args.shard_key.encode(), args.worker_id,
+                args.concurrent_requests, station_retries=args.station_retries).run()
@@ -0,0 +1,118 @@
+import threading
+
+
+class SpoolWriter(threading.Thread):
+    """
+        A background thread draining a RowSpool into the database, so sampling never waits for the database.
+
+        Rows are read from the spool in batches and passed to the database handler. Only rows the handler
+        committed are marked as written, so a failing database leaves the rest in the spool for the next try.
+
+        Attributes:
+        - spool (RowSpool): Spool to drain.
+        - database_handler (DatabaseHandler): Handler the rows are written with. Only this thread uses it.
+        - flush_interval_sec (float): Time between drains in seconds.
+        - batch_rows (int): Maximum number of rows passed to the handler at once.
+        - retry_sec (float): Time to wait after a failed drain in seconds.
+        - rows_written (int): Number of rows written to the database.
+        - _errors (list): Errors not yet collected by pop_errors. Note: Internal attribute, avoid direct access.
+        - _wake (threading.Event): Event that starts a drain early. Note: Internal attribute.
+        - _stopping (threading.Event): Event that stops the thread. Note: Internal attribute.
+        - _lock (threading.Lock): Lock guarding the errors. Note: Internal attribute.
+    """
+    min_flush_interval_sec = 1.0
+
+    def __init__(self, spool, database_handler, flush_interval_sec=900, batch_rows=200, retry_sec=65):
+        """
+            Initializes the SpoolWriter instance.
+
+            Args:
+            - spool (RowSpool): Spool to drain.
+            - database_handler (DatabaseHandler): Handler the rows are written with.
+            - flush_interval_sec (float): Time between drains in seconds, at least min_flush_interval_sec so a zero
+              interval does not re-read the spool in a busy loop.
+            - batch_rows (int): Maximum number of rows passed to the handler at once.
+            - retry_sec (float): Time to wait after a failed drain in seconds.
+        """
+        super().__init__(name="spool-writer", daemon=True)
+        self.spool = spool
+        self.database_handler = database_handler
+        self.flush_interval_sec = max(self.min_flush_interval_sec, flush_interval_sec)
+        self.batch_rows = batch_rows
+        self.retry_sec = retry_sec
+        self.rows_written = 0
+        self._errors = []
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+
+    def drain(self):
+        """
+            Writes all pending rows of the spool to the database.
+
+            Raises:
+            - Exception: If the database handler fails. Rows committed before the failure, as counted by the
+              handler's rows_inserted, are marked as written.
+        """
+        try:
+            while True:
+                rows, consumed_bytes = self.spool.read_pending(self.batch_rows)
+                if not rows:
+                    return
+
+                inserted_before = self.database_handler.rows_inserted
+                try:
+                    self.database_handler.insert_dumper(list(rows))
+                except Exception:
+                    self.database_handler.planned_to_insert = []
+                    raise
+                finally:
+                    committed = self.database_handler.rows_inserted - inserted_before
+                    if committed > 0:
+                        self.spool.commit(consumed_bytes[committed - 1], committed)
+                        self.rows_written += committed
+        except Exception as err:
+            raise Exception(f"[drain] {err}")
+
+    def run(self):
+        """Drains the spool every flush interval until stopped, then drains it one last time."""
+        while not self._stopping.is_set():
+            self._wake.wait(self.flush_interval_sec)
+            self._wake.clear()
+            try:
+                self.drain()
+            except Exception as err:
+                with self._lock:
+                    self._errors.append(err)
+                self._stopping.wait(self.retry_sec)
+        try:
+            self.drain()
+        except Exception as err:
+            with self._lock:
+                self._errors.append(err)
+
+    def flush_now(self):
+        """Starts a drain without waiting for the flush interval."""
+        self._wake.set()
+
+    def pop_errors(self):
+        """
+            Returns and forgets the errors of failed drains.
+
+            Returns:
+            - list: Exceptions raised by failed drains.
+        """
+        with self._lock:
+            errors, self._errors = self._errors, []
+        return errors
+
+    def stop(self, timeout=None):
+        """
+            Stops the thread after a last drain.
+
+            Args:
+            - timeout (float or None): Maximum time to wait for the thread in seconds.
+        """
+        self._stopping.set()
+        self._wake.set()
+        self.join(timeout)
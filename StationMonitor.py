@@ -0,0 +1,266 @@
+import numpy as np
+
+
+class StationMonitor:
+    """
+        A class to keep streaming per-station statistics of the sweeps and detect sensor dropouts and stuck values.
+
+        Values reach the monitor through DataDumper.add_station_to_row and are buffered in a row of the sweep.
+        end_sweep then updates all stations at once with vectorised NumPy operations, so the cost per sweep is
+        linear in the number of stations and independent of the window. Each station keeps a ring buffer of its
+        last window values with running sums for the rolling mean and variance, the length of its current run of
+        missing values, the time of its last value and the length of its current run of identical values.
+
+        A station whose run of missing values reaches dropout_sweeps is reported once as a dropout, and once more
+        when it delivers a value again. A station repeating the same value for stuck_sweeps sweeps is reported as
+        stuck, and again when its value changes. Runs of zeros are not reported unless ignore_zero_runs is False,
+        as stations report a flat zero while they are closed.
+
+        Attributes:
+        - window (int): Number of sweeps in the rolling statistics.
+        - dropout_sweeps (int): Length of a run of missing values reported as a dropout.
+        - stuck_sweeps (int): Length of a run of identical values reported as stuck.
+        - ignore_zero_runs (bool): Whether runs of zeros are never reported as stuck.
+        - naptan_ids (tuple): Naptan IDs of the monitored stations.
+        - sweeps (int): Number of sweeps added.
+        - events_total (dict): Number of reported events per kind.
+        - _index (dict): Row of each station in the arrays. Note: Internal attribute, avoid direct access.
+        - _pending (list): Values of the current sweep, NaN if missing, a list as Python lists take single items
+          faster than NumPy arrays. Note: Internal attribute, avoid direct access.
+        - _observed (list): Stations sampled in the current sweep. Note: Internal attribute, avoid direct access.
+        - _ring (numpy.ndarray): Last window sweeps, one row each, NaN if missing. Note: Internal attribute.
+        - _position (int): Row of the ring buffer the next sweep is written to. Note: Internal attribute.
+        - _sum, _sum_sq, _count (numpy.ndarray): Running sums of the ring buffer. Note: Internal attributes.
+        - _null_run, _same_run (numpy.ndarray): Current runs of missing and identical values. Note: Internal.
+        - _last_value, _last_seen (numpy.ndarray): Last value and its epoch per station. Note: Internal attributes.
+        - _dropout, _stuck (numpy.ndarray): Stations currently reported as dropped out or stuck. Note: Internal.
+    """
+    array_names = ('_ring', '_sum', '_sum_sq', '_count', '_null_run', '_same_run', '_last_value', '_last_seen',
+                   '_dropout', '_stuck')
+
+    def __init__(self, window=120, dropout_sweeps=40, stuck_sweeps=80, ignore_zero_runs=True):
+        """
+            Initializes the StationMonitor instance.
+
+            Args:
+            - window (int): Number of sweeps in the rolling statistics.
+            - dropout_sweeps (int): Length of a run of missing values reported as a dropout.
+            - stuck_sweeps (int): Length of a run of identical values reported as stuck.
+            - ignore_zero_runs (bool): Whether runs of zeros are never reported as stuck.
+        """
+        self.window = max(1, window)
+        self.dropout_sweeps = dropout_sweeps
+        self.stuck_sweeps = stuck_sweeps
+        self.ignore_zero_runs = ignore_zero_runs
+        self.naptan_ids = ()
+        self.sweeps = 0
+        self.events_total = {'dropout': 0, 'recovered': 0, 'stuck': 0, 'unstuck': 0}
+        self._index = {}
+        self._position = 0
+        self._epoch = None
+        self._allocate(0)
+
+    def _allocate(self, stations):
+        """
+            Allocates empty arrays for a number of stations.
+
+            Args:
+            - stations (int): Number of stations.
+        """
+        self._pending = [np.nan] * stations
+        self._observed = [False] * stations
+        self._ring = np.full((self.window, stations), np.nan)
+        self._sum = np.zeros(stations)
+        self._sum_sq = np.zeros(stations)
+        self._count = np.zeros(stations, dtype=np.int64)
+        self._null_run = np.zeros(stations, dtype=np.int64)
+        self._same_run = np.zeros(stations, dtype=np.int64)
+        self._last_value = np.full(stations, np.nan)
+        self._last_seen = np.full(stations, np.nan)
+        self._dropout = np.zeros(stations, dtype=bool)
+        self._stuck = np.zeros(stations, dtype=bool)
+
+    def set_stations(self, naptan_ids):
+        """
+            Sets the monitored stations, keeping the statistics of the stations monitored before.
+
+            Args:
+            - naptan_ids (tuple): Naptan IDs of the stations.
+        """
+        naptan_ids = tuple(naptan_ids)
+        if naptan_ids == self.naptan_ids:
+            return
+        kept = [(new_row, self._index[n_id]) for new_row, n_id in enumerate(naptan_ids) if n_id in self._index]
+        previous = {name: getattr(self, name) for name in self.array_names}
+        self._allocate(len(naptan_ids))
+        if kept:
+            new_rows, old_rows = map(list, zip(*kept))
+            for name, array in previous.items():
+                if name == '_ring':
+                    self._ring[:, new_rows] = array[:, old_rows]
+                else:
+                    getattr(self, name)[new_rows] = array[old_rows]
+        self.naptan_ids = naptan_ids
+        self._index = {n_id: row for row, n_id in enumerate(naptan_ids)}
+
+    def begin_sweep(self, epoch):
+        """
+            Starts buffering the values of a sweep, discarding those of a sweep that was not ended.
+
+            Args:
+            - epoch (int): Time of the sweep in seconds since the Unix epoch.
+        """
+        self._epoch = epoch
+        self._pending = [np.nan] * len(self.naptan_ids)
+        self._observed = [False] * len(self.naptan_ids)
+
+    def observe(self, naptan_id, crowding_data):
+        """
+            Buffers the value of a station in the current sweep.
+
+            Args:
+            - naptan_id (str): The Naptan ID of the station.
+            - crowding_data (float or None): Crowding value, None if missing.
+        """
+        row = self._index.get(naptan_id)
+        if row is None:
+            return
+        self._observed[row] = True
+        if crowding_data is not None:
+            self._pending[row] = crowding_data
+
+    def end_sweep(self):
+        """
+            Adds the buffered sweep to the statistics of all stations. Stations not sampled in the sweep keep their
+            runs and add a gap to their ring buffer.
+
+            Returns:
+            - list: Events of the sweep as (kind, naptan_id, run length) tuples, kind being 'dropout', 'recovered',
+              'stuck' or 'unstuck'.
+        """
+        if self._epoch is None:
+            return []
+        values = np.array(self._pending, dtype=np.float64)
+        observed = np.array(self._observed, dtype=bool)
+        valid = observed & ~np.isnan(values)
+        missing = observed & ~valid
+
+        outgoing = self._ring[self._position]
+        outgoing_valid = ~np.isnan(outgoing)
+        outgoing = np.where(outgoing_valid, outgoing, 0.0)
+        incoming = np.where(valid, values, 0.0)
+        self._sum += incoming - outgoing
+        self._sum_sq += incoming * incoming - outgoing * outgoing
+        self._count += valid.astype(np.int64) - outgoing_valid
+        self._ring[self._position] = np.where(valid, values, np.nan)
+        self._position = (self._position + 1) % self.window
+
+        previous_runs = {'recovered': self._null_run, 'unstuck': self._same_run}
+        self._null_run = np.where(valid, 0, self._null_run + missing)
+        repeated = valid & (values == self._last_value)
+        self._same_run = np.where(repeated, self._same_run + 1, np.where(valid, 1, self._same_run))
+        self._last_value = np.where(valid, values, self._last_value)
+        self._last_seen = np.where(valid, self._epoch, self._last_seen)
+        self._epoch = None
+        self.sweeps += 1
+
+        if self.sweeps % self.window == 0:
+            self._resync()
+        return self._detect_events(valid, previous_runs)
+
+    def _resync(self):
+        """Recomputes the running sums from the ring buffer, dropping accumulated rounding errors."""
+        self._sum = np.nansum(self._ring, axis=0)
+        self._sum_sq = np.nansum(self._ring * self._ring, axis=0)
+        self._count = np.count_nonzero(~np.isnan(self._ring), axis=0)
+
+    def _detect_events(self, valid, previous_runs):
+        """
+            Updates the dropout and stuck states and returns their changes.
+
+            Args:
+            - valid (numpy.ndarray): Stations with a value in the sweep.
+            - previous_runs (dict): Runs before the sweep, reported with the recovered and unstuck events.
+
+            Returns:
+            - list: Events as (kind, naptan_id, run length) tuples.
+        """
+        stuck_run = self._same_run >= self.stuck_sweeps
+        if self.ignore_zero_runs:
+            stuck_run &= self._last_value != 0
+        changes = {'dropout': (self._null_run >= self.dropout_sweeps) & ~self._dropout,
+                   'recovered': self._dropout & valid,
+                   'stuck': stuck_run & valid & ~self._stuck,
+                   'unstuck': self._stuck & valid & ~stuck_run}
+        self._dropout = (self._dropout | changes['dropout']) & ~changes['recovered']
+        self._stuck = (self._stuck | changes['stuck']) & ~changes['unstuck']
+
+        runs_by_kind = dict(previous_runs, dropout=self._null_run, stuck=self._same_run)
+        events = []
+        for kind, rows in changes.items():
+            runs = runs_by_kind[kind]
+            for row in np.flatnonzero(rows):
+                events.append((kind, self.naptan_ids[row], int(runs[row])))
+            self.events_total[kind] += int(np.count_nonzero(rows))
+        return events
+
+    def station_stats(self, naptan_id, now=None):
+        """
+            Returns the statistics of a station.
+
+            Args:
+            - naptan_id (str): The Naptan ID of the station.
+            - now (float or None): Epoch time the staleness is measured at, the last sweep's time if None.
+
+            Returns:
+            - dict: Rolling mean, standard deviation and number of values, current runs of missing and identical
+              values, staleness in seconds (None if the station never had a value) and its dropout and stuck states.
+        """
+        row = self._index[naptan_id]
+        count = int(self._count[row])
+        mean = float(self._sum[row] / count) if count else None
+        std = float(np.sqrt(max(0.0, self._sum_sq[row] / count - mean * mean))) if count else None
+        last_seen = self._last_seen[row]
+        if now is None:
+            now = np.nanmax(self._last_seen) if not np.all(np.isnan(self._last_seen)) else last_seen
+        return {'mean': mean, 'std': std, 'values': count, 'null_run': int(self._null_run[row]),
+                'same_run': int(self._same_run[row]),
+                'staleness_sec': None if np.isnan(last_seen) else float(now - last_seen),
+                'dropout': bool(self._dropout[row]), 'stuck': bool(self._stuck[row])}
+
+    def get_stats(self):
+        """
+            Returns aggregate counters of the monitor.
+
+            Returns:
+            - dict: Stations monitored, dropped out and stuck, sweeps added and events reported per kind.
+        """
+        return {'stations': len(self.naptan_ids), 'dropped_out': int(np.count_nonzero(self._dropout)),
+                'stuck': int(np.count_nonzero(self._stuck)), 'sweeps': self.sweeps,
+                'events_total': dict(self.events_total)}
+
+
+def format_events(events, max_stations=20):
+    """
+    Builds an alert text of station events, one line per kind of event.
+
+    Parameters:
+    events (list): Events as (kind, naptan_id, run length) tuples returned by StationMonitor.end_sweep.
+    max_stations (int): Maximum number of stations listed per line.
+
+    Returns:
+    str: The alert text.
+    """
+    descriptions = {'dropout': "no data for {run} sweeps", 'recovered': "data again after {run} sweeps",
+                    'stuck': "same value for {run} sweeps", 'unstuck': "value changing after {run} sweeps"}
+    labels = {'dropout': "Station dropout", 'recovered': "Station recovered", 'stuck': "Stuck value",
+              'unstuck': "Value no longer stuck"}
+    lines = []
+    for kind in descriptions:
+        stations = [f"{naptan_id} ({descriptions[kind].format(run=run)})"
+                    for event_kind, naptan_id, run in events if event_kind == kind]
+        if not stations:
+            continue
+        more = f" and {len(stations) - max_stations} more" if len(stations) > max_stations else ""
+        lines.append(f"{labels[kind]}: {len(stations)} station(s): {', '.join(stations[:max_stations])}{more}.")
+    return '\n'.join(lines)
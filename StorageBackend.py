@@ -0,0 +1,146 @@
+import time
+from Metrics import registry
+
+
+class StorageBackend:
+    """
+        A base class of the stores crowding rows are flushed to.
+
+        insert_dumper splits the rows of a dumper into tables. A new table is started with create_table whenever
+        there is none yet, the current one is full or the stations change. Rows are written with insert_planned_rows
+        in batches of at most max_rows_in_commit. Backends implement create_table and insert_planned_rows and may
+        wrap each flush in open_flush and close_flush, e.g. to borrow a database connection.
+
+        Attributes:
+        - max_rows_in_commit (int): Maximum number of rows written in a single batch.
+        - current_crowding_data_table (str or None): Name of the current table, None before the first one.
+        - max_rows (int): Maximum number of rows in a table.
+        - rows_left (int): Number of rows left in the current table.
+        - stations_sequence (tuple): Station IDs of the current table, in column order.
+        - planned_to_insert (list): Rows planned for the next batch.
+        - rows_inserted (int): Number of rows written by successful batches since start.
+        - metrics (dict): Counters of flush latency.
+    """
+    def __init__(self, max_rows_in_commit, current_crowding_data_table, max_rows):
+        """
+            Initializes the StorageBackend instance.
+
+            Args:
+            - max_rows_in_commit (int): Maximum number of rows written in a single batch.
+            - current_crowding_data_table (str or None): Name of the table to continue, None to start a new one.
+            - max_rows (int): Maximum number of rows in a table.
+        """
+        self.max_rows_in_commit = max_rows_in_commit
+        self.current_crowding_data_table = current_crowding_data_table
+        self.max_rows = max_rows
+        self.rows_left = 0
+        self.stations_sequence = ()
+        self.planned_to_insert = []
+        self.rows_inserted = 0
+        self.metrics = {'flushes': 0, 'flush_time_total_sec': 0.0, 'flush_time_last_sec': 0.0,
+                        'flush_time_max_sec': 0.0}
+
+    def open_flush(self):
+        """Prepares a flush. Does nothing by default."""
+
+    def close_flush(self):
+        """Ends a flush, whether it succeeded or failed. Does nothing by default."""
+
+    def create_table(self, naptan_ids, timestamp):
+        """
+            Starts a new table for the given stations and makes it the current one.
+
+            Args:
+            - naptan_ids (tuple): Station IDs of the table.
+            - timestamp (str): Timestamp of its first row, 'YYYY-MM-DD HH:MM:SS'.
+        """
+        raise NotImplementedError
+
+    def insert_planned_rows(self):
+        """
+            Writes the planned rows to the current table, decreases rows_left and clears the planned rows.
+
+            Returns:
+            - bool: True if rows were written, False if there were none.
+        """
+        raise NotImplementedError
+
+    def flush_planned_rows(self):
+        """
+            Writes the planned rows with insert_planned_rows and counts them in rows_inserted once written.
+
+            Returns:
+            - bool: True if rows were written, False if there were none.
+        """
+        planned_rows = len(self.planned_to_insert)
+        if not self.insert_planned_rows():
+            return False
+        self.rows_inserted += planned_rows
+        return True
+
+    def insert_dumper(self, dumper):
+        """
+            Writes the rows of a dumper, starting new tables as needed.
+
+            Args:
+            - dumper (list): List of data tuples (timestamp, data), emptied as rows are planned.
+
+            Raises:
+            - Exception: If the dumper is empty or writing fails. Batches written before the failure are kept.
+        """
+        flush_start = time.monotonic()
+        try:
+            if len(dumper) == 0:
+                raise Exception("Empty dumper")
+
+            self.open_flush()
+            try:
+                while len(dumper) != 0:
+                    timestamp, data = dumper.pop(0)
+                    naptan_ids = tuple(sorted(data.keys()))
+                    if not self.current_crowding_data_table or self.rows_left == 0 or \
+                            self.stations_sequence != naptan_ids:
+                        self.flush_planned_rows()
+                        self.create_table(naptan_ids, timestamp)
+
+                    self.planned_to_insert.append((timestamp, data))
+
+                    the_length = len(self.planned_to_insert)
+                    if the_length >= self.max_rows_in_commit or self.rows_left == the_length:
+                        self.flush_planned_rows()
+
+                self.flush_planned_rows()
+            finally:
+                self.close_flush()
+
+            self.record_flush(time.monotonic() - flush_start)
+        except Exception as err:
+            raise Exception(f"[insert dumper] {err}")
+
+    def record_flush(self, flush_time):
+        """
+            Records the latency of a successful flush.
+
+            Args:
+            - flush_time (float): Duration of the flush in seconds.
+        """
+        registry.observe('stage_seconds', flush_time, stage='flush')
+        self.metrics['flushes'] += 1
+        self.metrics['flush_time_total_sec'] += flush_time
+        self.metrics['flush_time_last_sec'] = flush_time
+        self.metrics['flush_time_max_sec'] = max(self.metrics['flush_time_max_sec'], flush_time)
+
+    def get_metrics(self):
+        """
+            Returns flush latency metrics.
+
+            Returns:
+            - dict: Copy of the metrics with the mean flush time added.
+        """
+        metrics = dict(self.metrics)
+        metrics['flush_time_mean_sec'] = (metrics['flush_time_total_sec'] / metrics['flushes']
+                                          if metrics['flushes'] else 0.0)
+        return metrics
+
+    def close(self):
+        """Releases the resources of the backend. Does nothing by default."""
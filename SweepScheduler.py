@@ -0,0 +1,100 @@
+import math
+import time
+
+
+class SweepScheduler:
+    """
+        A class to start sweeps on wall-clock aligned ticks using monotonic deadlines, so the sampling cadence
+        does not drift with sweep duration. A sweep that runs past its slot makes the following ticks be skipped
+        instead of starting late sweeps back to back.
+
+        Attributes:
+        - period (float): Target time between sweep starts in seconds.
+        - ticks (int): Number of ticks started.
+        - overruns (int): Number of sweeps that ran past the start of the next tick.
+        - skipped_ticks (int): Number of ticks skipped because of overruns.
+        - total_lateness (float): Sum of the delays between tick deadlines and actual starts in seconds.
+        - _next_deadline (float or None): Monotonic time of the next tick. Note: Internal attribute.
+        - _last_start (float or None): Monotonic time of the latest tick start, None after a reset.
+          Note: Internal attribute.
+        - _measured_sec (float): Time between consecutive tick starts since start. Note: Internal attribute.
+        - _measured_intervals (int): Number of intervals in _measured_sec. Note: Internal attribute.
+    """
+    def __init__(self, period_sec):
+        """
+            Initializes the SweepScheduler instance.
+
+            Args:
+            - period_sec (float): Target time between sweep starts in seconds.
+        """
+        if period_sec <= 0:
+            raise ValueError(f"Period must be positive, got {period_sec}.")
+        self.period = period_sec
+        self.ticks = 0
+        self.overruns = 0
+        self.skipped_ticks = 0
+        self.total_lateness = 0.0
+        self._next_deadline = None
+        self._last_start = None
+        self._measured_sec = 0.0
+        self._measured_intervals = 0
+
+    def wait_for_next_tick(self):
+        """
+            Sleeps until the next tick. The first tick is the next multiple of the period in wall-clock time.
+
+            Returns:
+            - int: Number of ticks skipped because the previous sweep ran past them.
+        """
+        now = time.monotonic()
+        skipped = 0
+
+        if self._next_deadline is None:
+            wall_now = time.time()
+            self._next_deadline = now + (math.ceil(wall_now / self.period) * self.period - wall_now)
+        elif now > self._next_deadline:
+            skipped = math.floor((now - self._next_deadline) / self.period) + 1
+            self._next_deadline += skipped * self.period
+            self.overruns += 1
+            self.skipped_ticks += skipped
+
+        delay = self._next_deadline - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+        start = time.monotonic()
+        self.total_lateness += max(0.0, start - self._next_deadline)
+        if self._last_start is not None:
+            self._measured_sec += start - self._last_start
+            self._measured_intervals += 1
+        self._last_start = start
+        self.ticks += 1
+        self._next_deadline += self.period
+        return skipped
+
+    def reset(self):
+        """
+            Re-anchors the next tick to the next multiple of the period, e.g. after an error back-off, so the
+            ticks missed meanwhile are not counted as overruns or skipped ticks, and the time until the next tick
+            is not counted in the achieved period.
+        """
+        self._next_deadline = None
+        self._last_start = None
+
+    def get_stats(self):
+        """
+            Returns the achieved and target cadence. The achieved period is measured between consecutive ticks,
+            leaving out the gaps across resets.
+
+            Returns:
+            - dict: Target and achieved period, ticks, overruns, skipped ticks and mean start lateness.
+        """
+        achieved_period = None
+        if self._measured_intervals:
+            achieved_period = self._measured_sec / self._measured_intervals
+        return {'target_period_sec': self.period,
+                'achieved_period_sec': achieved_period,
+                'ticks': self.ticks,
+                'overruns': self.overruns,
+                'skipped_ticks': self.skipped_ticks,
+                'mean_lateness_sec': self.total_lateness / self.ticks if self.ticks else 0.0}
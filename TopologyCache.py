@@ -0,0 +1,226 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from tube_functions import (get_response, lines_url, line_stations_url, parse_lines, parse_line_stations,
+                            select_wifi_stations)
+from Metrics import registry
+
+
+class TopologyCache:
+    """
+        A class to keep the station topology in memory and on disk and to refresh it only when it expires.
+        Refreshes revalidate cached responses with ETag/If-Modified-Since, so unchanged lines are not re-downloaded.
+
+        Attributes:
+        - cache_path (str or None): Path of the JSON cache file, None to keep the cache in memory only.
+        - ttl (float): Time to live of the topology in seconds.
+        - max_workers (int or None): Maximum number of stop points requests in flight at once during a refresh, None
+          for one per line up to default_max_workers.
+        - modes (tuple): TfL mode names of the lines whose stations are collected.
+        - fetched_at (float or None): Epoch time of the last successful refresh.
+        - naptan_ids (tuple): Naptan IDs of the stations with Wi-Fi.
+        - checkpoint (CollectorCheckpoint or None): Checkpoint the stations are seeded from when there is no cache
+          file and recorded in after each refresh.
+        - background_refresh (bool): Whether an expired topology keeps being served while a background thread
+          refreshes it, instead of refreshing it before returning.
+        - retry_sec (float): Time before a failed background refresh is retried in seconds.
+        - _responses (dict): Cached decoded bodies and validators per URL. Note: Internal attribute, avoid direct access.
+        - _refresh_thread (threading.Thread or None): The running background refresh. Note: Internal attribute.
+        - _retry_at (float): Monotonic time a failed background refresh may be retried. Note: Internal attribute.
+    """
+    default_max_workers = 8
+
+    def __init__(self, cache_path=None, ttl_hours=24, max_workers=None, modes=('tube',), checkpoint=None,
+                 background_refresh=False, retry_sec=60):
+        """
+            Initializes the TopologyCache instance and loads the cache file if it exists. An unreadable or corrupt
+            cache file is recorded as an error and treated as empty, so the topology is fetched again.
+
+            Args:
+            - cache_path (str or None): Path of the JSON cache file, None to keep the cache in memory only.
+            - ttl_hours (float): Time to live of the topology in hours.
+            - max_workers (int or None): Maximum number of stop points requests in flight at once during a refresh,
+              None for one per line up to default_max_workers.
+            - modes (tuple): TfL mode names of the lines whose stations are collected.
+            - checkpoint (CollectorCheckpoint or None): Checkpoint the stations are seeded from.
+            - background_refresh (bool): Whether an expired topology is refreshed in the background.
+            - retry_sec (float): Time before a failed background refresh is retried in seconds.
+        """
+        self.cache_path = cache_path
+        self.ttl = ttl_hours * 3600
+        self.max_workers = None if max_workers is None else max(1, max_workers)
+        self.modes = tuple(modes)
+        self.fetched_at = None
+        self.naptan_ids = ()
+        self.checkpoint = checkpoint
+        self.background_refresh = background_refresh
+        self.retry_sec = retry_sec
+        self._responses = {}
+        self._refresh_thread = None
+        self._retry_at = 0.0
+
+        if self.cache_path and os.path.exists(self.cache_path):
+            try:
+                self.load()
+            except Exception as err:
+                registry.record_error(err)
+        if not self.naptan_ids and self.checkpoint is not None:
+            state = self.checkpoint.get('topology')
+            if state and tuple(state['modes']) == self.modes:
+                self.naptan_ids = tuple(state['naptan_ids'])
+                self.fetched_at = state['fetched_at']
+
+    def load(self):
+        """
+            Loads the topology from the cache file. A topology cached for other modes is ignored, so its stations are
+            not swept and the first call of get_stations refreshes the topology before returning.
+
+            Raises:
+            - Exception: If the cache file cannot be read.
+        """
+        try:
+            with open(self.cache_path, 'r') as cache_file:
+                cache = json.load(cache_file)
+            if tuple(cache.get('modes', ('tube',))) != self.modes:
+                return
+            fetched_at = cache['fetched_at']
+            naptan_ids = tuple(cache['naptan_ids'])
+            responses = dict(cache['responses'])
+            self.fetched_at, self.naptan_ids, self._responses = fetched_at, naptan_ids, responses
+        except Exception as err:
+            raise Exception(f"[load] {err}")
+
+    def save(self):
+        """
+            Atomically writes the topology to the cache file.
+
+            Raises:
+            - Exception: If the cache file cannot be written.
+        """
+        try:
+            if not self.cache_path:
+                return
+            cache = {'fetched_at': self.fetched_at, 'modes': list(self.modes), 'naptan_ids': list(self.naptan_ids),
+                     'responses': self._responses}
+            tmp_path = f"{self.cache_path}.tmp"
+            with open(tmp_path, 'w') as cache_file:
+                json.dump(cache, cache_file)
+            os.replace(tmp_path, self.cache_path)
+        except Exception as err:
+            raise Exception(f"[save] {err}")
+
+    def save_checkpoint(self):
+        """Records the stations in the checkpoint. A failure is only recorded as an error."""
+        if self.checkpoint is None:
+            return
+        try:
+            self.checkpoint.update('topology', {'modes': list(self.modes), 'naptan_ids': list(self.naptan_ids),
+                                                'fetched_at': self.fetched_at})
+        except Exception as err:
+            registry.record_error(f"[save_checkpoint] {err}")
+
+    def is_expired(self):
+        """
+            Checks if the topology has to be refreshed.
+
+            Returns:
+            - bool: True if there is no topology yet or it is older than the time to live, False otherwise.
+        """
+        return self.fetched_at is None or not self.naptan_ids or time.time() - self.fetched_at >= self.ttl
+
+    def _fetch(self, url):
+        """
+            Fetches a decoded JSON body, revalidating the cached one if there is any.
+
+            Args:
+            - url (str): The URL to fetch.
+
+            Returns:
+            - tuple: (url, entry) where entry holds the decoded body and its validators.
+        """
+        cached = self._responses.get(url)
+        headers = {}
+        if cached is not None:
+            if cached.get('etag'):
+                headers['If-None-Match'] = cached['etag']
+            if cached.get('last_modified'):
+                headers['If-Modified-Since'] = cached['last_modified']
+
+        response = get_response(url, headers=headers)
+
+        if response.getcode() == 304 and cached is not None:
+            return url, cached
+        if response.getcode() != 200:
+            raise Exception(f"Failed to retrieve {url}. Status code: {response.getcode()}")
+
+        return url, {'body': json.load(response),
+                     'etag': response.getheader('ETag'),
+                     'last_modified': response.getheader('Last-Modified')}
+
+    def refresh(self):
+        """
+            Revalidates the lines and fetches the stop points of all lines in parallel.
+
+            Returns:
+            - bool: True if the station set changed, False otherwise.
+
+            Raises:
+            - Exception: If an error occurs while fetching or parsing the topology.
+        """
+        try:
+            with registry.timer('topology_fetch'):
+                responses = dict([self._fetch(lines_url(self.modes))])
+                lines_df = parse_lines(responses[lines_url(self.modes)]['body'], self.modes)
+
+                urls = [line_stations_url(line_id) for line_id in lines_df['id']]
+                max_workers = self.default_max_workers if self.max_workers is None else self.max_workers
+                with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(urls)))) as executor:
+                    responses.update(executor.map(self._fetch, urls))
+
+                with registry.timer('topology_parse'):
+                    naptan_ids = select_wifi_stations(parse_line_stations(responses[url]['body']) for url in urls)
+
+            changed = naptan_ids != self.naptan_ids
+            self.naptan_ids = naptan_ids
+            self._responses = responses
+            self.fetched_at = time.time()
+            self.save()
+            self.save_checkpoint()
+            registry.inc('topology_refreshes_total', changed=changed)
+            return changed
+        except Exception as err:
+            raise Exception(f"[refresh] {err}")
+
+    def _refresh_in_background(self):
+        """Refreshes the topology, recording a failure and postponing the next attempt by retry_sec."""
+        try:
+            self.refresh()
+        except Exception as err:
+            registry.record_error(f"[refresh_in_background] {err}")
+            self._retry_at = time.monotonic() + self.retry_sec
+
+    def get_stations(self):
+        """
+            Returns Naptan IDs of the stations with Wi-Fi, refreshing the topology if it expired. With
+            background_refresh, expired stations are returned while a background thread refreshes them.
+
+            Returns:
+            - tuple: A tuple containing unique 'naptanId' values of stations with Wi-Fi across all lines.
+
+            Raises:
+            - Exception: If the topology has to be refreshed and the refresh fails.
+        """
+        try:
+            if self.is_expired():
+                if not (self.background_refresh and self.naptan_ids):
+                    self.refresh()
+                elif (self._refresh_thread is None or not self._refresh_thread.is_alive()) \
+                        and time.monotonic() >= self._retry_at:
+                    self._refresh_thread = threading.Thread(target=self._refresh_in_background,
+                                                            name="topology-refresh", daemon=True)
+                    self._refresh_thread.start()
+            return self.naptan_ids
+        except Exception as err:
+            raise Exception(f"[get_stations] {err}")
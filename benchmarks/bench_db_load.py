@@ -0,0 +1,114 @@
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import db_params
+from DatabaseHandler import DatabaseHandler
+
+
+def make_dumper(stations, rows, missing_fraction, start):
+    """
+    Builds synthetic dumper rows.
+
+    Parameters:
+    stations (int): Number of stations in each row.
+    rows (int): Number of rows.
+    missing_fraction (float): Fraction of stations without data in each row.
+    start (datetime): Timestamp of the first row, rows are 45 seconds apart.
+
+    Returns:
+    list: Rows as [timestamp_str, {naptan_id: float or None}].
+    """
+    generator = random.Random(0)
+    naptan_ids = [f"940GZZLU{index:06d}" for index in range(stations)]
+    dumper = []
+    for row in range(rows):
+        timestamp = (start + timedelta(seconds=45 * row)).strftime('%Y-%m-%d %H:%M:%S')
+        data = {naptan_id: None if generator.random() < missing_fraction else round(generator.random(), 4)
+                for naptan_id in naptan_ids}
+        dumper.append([timestamp, data])
+    return dumper
+
+
+def drop_created_tables(handler, tables):
+    """
+    Drops the tables created by a benchmark run.
+
+    Parameters:
+    handler (DatabaseHandler): Handler used for the run.
+    tables (set): Names of the created tables.
+    """
+    handler.connect()
+    for table in tables:
+        handler.cursor.execute(f"DROP TABLE IF EXISTS {table}")
+    handler.connection.commit()
+    handler.disconnect()
+
+
+def run(load_method, dumper, max_rows_in_commit, max_rows_in_table):
+    """
+    Loads the rows with one load method and measures the throughput.
+
+    Parameters:
+    load_method (str): Load method of the DatabaseHandler.
+    dumper (list): Rows to load.
+    max_rows_in_commit (int): Maximum rows in one commit.
+    max_rows_in_table (int): Maximum rows in one table.
+
+    Returns:
+    float: Loaded rows per second.
+    """
+    handler = DatabaseHandler(max_rows_in_commit, None, max_rows_in_table, db_params, load_method)
+    created_tables = set()
+    original_create_table = handler.create_table
+
+    def create_table(naptan_ids, timestamp):
+        result = original_create_table(naptan_ids, timestamp)
+        created_tables.add(handler.current_crowding_data_table)
+        return result
+
+    handler.create_table = create_table
+
+    rows = len(dumper)
+    start = time.perf_counter()
+    try:
+        handler.insert_dumper([[timestamp, dict(data)] for timestamp, data in dumper])
+        return rows / (time.perf_counter() - start)
+    finally:
+        drop_created_tables(handler, created_tables)
+
+
+def main(stations=300, rows=2000, max_rows_in_commit=10, max_rows_in_table=4000, missing_fraction=0.1):
+    print(f"{stations} stations, {rows} rows, {max_rows_in_commit} rows per commit")
+    print(f"{'method':>8} {'rows/s':>10}")
+    results = {}
+    for load_method in DatabaseHandler.load_methods:
+        # Each method gets its own time range, so table names made from the first timestamp never collide.
+        dumper = make_dumper(stations, rows, missing_fraction, datetime(2000, 1, 1) + timedelta(days=len(results)))
+        results[load_method] = run(load_method, dumper, max_rows_in_commit, max_rows_in_table)
+        print(f"{load_method:>8} {results[load_method]:>10.1f}")
+    print(f"copy vs values: {results['copy'] / results['values']:.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark DatabaseHandler load methods against config.db_params.")
+
+    parser.add_argument("-st", "--stations", type=int, default=300,
+                        help="Number of stations in each row")
+    parser.add_argument("-r", "--rows", type=int, default=2000,
+                        help="Number of rows to load with each method")
+    parser.add_argument("-mc", "--max_commit", type=int, default=10,
+                        help="Maximum rows in commit")
+    parser.add_argument("-mt", "--max_table", type=int, default=4000,
+                        help="Maximum rows in table")
+    parser.add_argument("-mf", "--missing_fraction", type=float, default=0.1,
+                        help="Fraction of stations without data in each row")
+
+    args = parser.parse_args()
+
+    main(args.stations, args.rows, args.max_commit, args.max_table, args.missing_fraction)
@@ -0,0 +1,77 @@
+import argparse
+import os
+import random
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from DataDumper import DataDumper
+
+
+def fill_dumper(dumper, naptan_ids, sweeps, missing_fraction):
+    """
+    Fills a dumper with synthetic sweeps.
+
+    Parameters:
+    dumper (DataDumper): Dumper to fill.
+    naptan_ids (tuple): Naptan IDs of the stations.
+    sweeps (int): Number of rows to create.
+    missing_fraction (float): Fraction of stations without data in each sweep.
+    """
+    generator = random.Random(0)
+    dumper.set_stations(naptan_ids)
+    for _ in range(sweeps):
+        dumper.create_new_row()
+        for naptan_id in naptan_ids:
+            crowding = None if generator.random() < missing_fraction else round(generator.random(), 4)
+            dumper.add_station_to_row(station_name=naptan_id, crowding_data=crowding)
+
+
+def measure(columnar, naptan_ids, sweeps, missing_fraction):
+    """
+    Measures the memory retained by a filled dumper.
+
+    Parameters:
+    columnar (bool): Whether the dumper uses the columnar layout.
+    naptan_ids (tuple): Naptan IDs of the stations.
+    sweeps (int): Number of rows to create.
+    missing_fraction (float): Fraction of stations without data in each sweep.
+
+    Returns:
+    tuple: (retained bytes, peak bytes) while filling the dumper.
+    """
+    tracemalloc.start()
+    dumper = DataDumper(15, columnar)
+    fill_dumper(dumper, naptan_ids, sweeps, missing_fraction)
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return retained, peak
+
+
+def main(stations=300, sweeps=20, missing_fraction=0.1):
+    naptan_ids = tuple(f"940GZZLU{index:06d}" for index in range(stations))
+
+    print(f"{stations} stations, {sweeps} sweeps")
+    print(f"{'layout':>10} {'retained [KiB]':>15} {'peak [KiB]':>12}")
+    results = {}
+    for layout, columnar in (('rows', False), ('columnar', True)):
+        retained, peak = measure(columnar, naptan_ids, sweeps, missing_fraction)
+        results[layout] = retained
+        print(f"{layout:>10} {retained / 1024:>15.1f} {peak / 1024:>12.1f}")
+    print(f"reduction: {results['rows'] / results['columnar']:.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark memory of the DataDumper layouts.")
+
+    parser.add_argument("-st", "--stations", type=int, default=300,
+                        help="Number of stations in each sweep")
+    parser.add_argument("-sw", "--sweeps", type=int, default=20,
+                        help="Number of sweeps kept in the dumper")
+    parser.add_argument("-mf", "--missing_fraction", type=float, default=0.1,
+                        help="Fraction of stations without data in each sweep")
+
+    args = parser.parse_args()
+
+    main(args.stations, args.sweeps, args.missing_fraction)
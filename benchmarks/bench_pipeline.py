@@ -0,0 +1,174 @@
+import argparse
+import os
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tube_functions
+from tube_functions import get_lines, get_all_stations, configure_session, get_session_stats
+from CrowdingSweeper import CrowdingSweeper
+from DataDumper import DataDumper
+from DatabaseHandler import DatabaseHandler
+from mock_tfl_server import MockTflServer
+from standin_db import StandInDatabase, make_pool_class
+
+
+def peak_rss_mb():
+    """
+    Returns the peak resident set size of the process so far.
+
+    Returns:
+    float: Peak RSS in megabytes.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def make_database_handler(db, max_rows_in_commit, load_method):
+    """
+    Builds the database handler of a run.
+
+    Parameters:
+    db (str): 'standin' for the in-process stand-in database, 'postgres' for config.db_params.
+    max_rows_in_commit (int): Maximum rows in commit.
+    load_method (str): Load method of the DatabaseHandler.
+
+    Returns:
+    tuple: (DatabaseHandler, StandInDatabase or None).
+    """
+    if db == 'postgres':
+        from config import db_params
+        return DatabaseHandler(max_rows_in_commit, None, 4000, db_params, load_method), None
+
+    database = StandInDatabase()
+
+    class StandInDatabaseHandler(DatabaseHandler):
+        pool_class = make_pool_class(database)
+
+    return StandInDatabaseHandler(max_rows_in_commit, None, 4000, {}, load_method), database
+
+
+def drop_tables(handler, tables):
+    """
+    Drops the tables created in PostgreSQL by a run.
+
+    Parameters:
+    handler (DatabaseHandler): Handler of the run.
+    tables (set): Names of the created tables.
+    """
+    handler.connect()
+    for table in tables:
+        handler.cursor.execute(f"DROP TABLE IF EXISTS {table}")
+    handler.connection.commit()
+    handler.close()
+
+
+def run(stations_per_line, lines, sweeps, workers, latency_sec, error_rate, db, max_rows_in_commit, load_method):
+    """
+    Runs the full collection path against the mock server and measures each stage.
+
+    Parameters:
+    stations_per_line (int): Stop points per mock line.
+    lines (int): Number of mock lines.
+    sweeps (int): Number of sweeps.
+    workers (int): Concurrent crowding requests.
+    latency_sec (float): Mock response latency in seconds.
+    error_rate (float): Mock error rate.
+    db (str): 'standin' or 'postgres'.
+    max_rows_in_commit (int): Maximum rows in commit.
+    load_method (str): Load method of the DatabaseHandler.
+
+    Returns:
+    dict: Measurements of the run.
+    """
+    mock = MockTflServer(lines, stations_per_line, latency_sec, 0.0, error_rate)
+    mock.start()
+    tube_functions.TFL_API_BASE = mock.base_url
+    configure_session(max_idle_per_host=workers)
+    sweeper = CrowdingSweeper(workers, 0.0, station_retries=1, max_failed_fraction=1.0)
+    handler, database = make_database_handler(db, max_rows_in_commit, load_method)
+    created_tables = set()
+
+    try:
+        start = time.perf_counter()
+        naptan_ids = get_all_stations(get_lines())
+        topology_time = time.perf_counter() - start
+
+        dumper = DataDumper(15)
+        requests_before = mock.requests_served
+        sweep_times = []
+        for _ in range(sweeps):
+            start = time.perf_counter()
+            dumper.create_new_row()
+            sweeper.sweep(naptan_ids, dumper)
+            sweep_times.append(time.perf_counter() - start)
+        crowding_requests = mock.requests_served - requests_before
+
+        rows = dumper.get_dumper()
+        # Sweeps run within a second of each other, so spread the rows to keep c_timestamp unique.
+        for index, row in enumerate(rows):
+            row[0] = f"2000-01-01 {index // 3600:02d}:{index // 60 % 60:02d}:{index % 60:02d}"
+        row_count = len(rows)
+        start = time.perf_counter()
+        handler.insert_dumper(rows)
+        insert_time = time.perf_counter() - start
+        created_tables.add(handler.current_crowding_data_table)
+
+        return {'stations': len(naptan_ids),
+                'topology_sec': topology_time,
+                'sweep_sec': sum(sweep_times) / len(sweep_times),
+                'requests_per_sec': crowding_requests / sum(sweep_times),
+                'rows_per_sec': row_count / insert_time,
+                'peak_rss_mb': peak_rss_mb(),
+                'errors': mock.errors_served,
+                'connections': get_session_stats(),
+                'db_statements': database.statements if database else None}
+    finally:
+        sweeper.close()
+        mock.stop()
+        if db == 'postgres':
+            drop_tables(handler, created_tables)
+
+
+def main(stations_per_line=(30, 300, 3000), lines=11, sweeps=5, workers=16, latency_ms=20.0, error_rate=0.0,
+         db='standin', max_rows_in_commit=10, load_method='copy'):
+    print(f"{lines} lines, {sweeps} sweeps, {workers} workers, {latency_ms} ms latency, "
+          f"{error_rate:.0%} errors, {db} database, {load_method} load")
+    print(f"{'stations':>9} {'topology [s]':>13} {'sweep [s]':>10} {'requests/s':>11} {'rows/s':>10} "
+          f"{'peak RSS [MB]':>14} {'errors':>7}")
+    for per_line in stations_per_line:
+        result = run(per_line, lines, sweeps, workers, latency_ms / 1000, error_rate, db, max_rows_in_commit,
+                     load_method)
+        print(f"{result['stations']:>9} {result['topology_sec']:>13.3f} {result['sweep_sec']:>10.3f} "
+              f"{result['requests_per_sec']:>11.1f} {result['rows_per_sec']:>10.1f} "
+              f"{result['peak_rss_mb']:>14.1f} {result['errors']:>7}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the full collection path against a local mock TfL API.")
+
+    parser.add_argument("-s", "--stations_per_line", type=int, nargs="+", default=[30, 300, 3000],
+                        help="Stop points per mock line, one run per value")
+    parser.add_argument("-l", "--lines", type=int, default=11,
+                        help="Number of mock lines")
+    parser.add_argument("-sw", "--sweeps", type=int, default=5,
+                        help="Number of sweeps of each run")
+    parser.add_argument("-w", "--workers", type=int, default=16,
+                        help="Concurrent crowding requests")
+    parser.add_argument("-la", "--latency_ms", type=float, default=20,
+                        help="Mock response latency in milliseconds")
+    parser.add_argument("-e", "--error_rate", type=float, default=0,
+                        help="Fraction of mock requests answered with an error status")
+    parser.add_argument("-db", "--db", type=str, default='standin', choices=('standin', 'postgres'),
+                        help="Write to the in-process stand-in database or to PostgreSQL from config.db_params")
+    parser.add_argument("-mc", "--max_commit", type=int, default=10,
+                        help="Maximum rows in commit")
+    parser.add_argument("-lm", "--load_method", type=str, default='copy', choices=DatabaseHandler.load_methods,
+                        help="Load method of the DatabaseHandler")
+
+    args = parser.parse_args()
+
+    main(args.stations_per_line, args.lines, args.sweeps, args.workers, args.latency_ms, args.error_rate, args.db,
+         args.max_commit, args.load_method)
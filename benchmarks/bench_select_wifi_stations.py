@@ -0,0 +1,104 @@
+import argparse
+import os
+import sys
+import time
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tube_functions import select_wifi_stations
+
+
+def legacy_select_wifi_stations(line_stations_dfs):
+    """
+    The row-by-row merge that get_all_stations used before, kept as the baseline of the benchmark.
+
+    Parameters:
+    line_stations_dfs (iterable): DataFrames of line stations as returned by get_line_stations.
+
+    Returns:
+    tuple: A tuple containing unique 'naptanId' values of stations with Wi-Fi across all lines.
+    """
+    all_lines_df = pd.DataFrame(columns=['naptanId', 'commonName', 'status', 'WiFi'])
+
+    for line_stations in line_stations_dfs:
+        for index, station_row in line_stations.iterrows():
+            if station_row['WiFi'] == 'yes' and station_row['naptanId'] not in all_lines_df['naptanId'].tolist():
+                all_lines_df = pd.concat([all_lines_df, station_row.to_frame().T], ignore_index=True)
+
+    return tuple(all_lines_df['naptanId'])
+
+
+def make_line_stations(stop_points, lines=11, shared_fraction=0.2):
+    """
+    Builds synthetic line station DataFrames where a part of the stations is served by several lines.
+
+    Parameters:
+    stop_points (int): Total number of stop points across all lines.
+    lines (int): Number of lines.
+    shared_fraction (float): Fraction of stop points repeating a station of another line.
+
+    Returns:
+    list: DataFrames of line stations.
+    """
+    unique_count = max(1, int(stop_points * (1 - shared_fraction)))
+    rows = []
+    for index in range(stop_points):
+        station = index if index < unique_count else (index * 7) % unique_count
+        rows.append([f"940GZZLU{station:06d}", f"Station {station}", True, "yes" if station % 10 else "no"])
+
+    per_line = -(-stop_points // lines)
+    return [pd.DataFrame(rows[start:start + per_line], columns=['naptanId', 'commonName', 'status', 'WiFi'])
+            for start in range(0, stop_points, per_line)]
+
+
+def time_call(function, argument, repeat):
+    """
+    Returns the best wall time of several calls.
+
+    Parameters:
+    function (callable): Function to time.
+    argument: Argument of the function.
+    repeat (int): Number of calls.
+
+    Returns:
+    tuple: (best time in seconds, result of the last call).
+    """
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(argument)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main(sizes=(300, 3000, 30000), legacy_max=3000, repeat=3):
+    print(f"{'stop points':>12} {'legacy [s]':>12} {'current [s]':>12} {'speedup':>9}")
+    for size in sizes:
+        line_stations = make_line_stations(size)
+        current_time, current_ids = time_call(select_wifi_stations, line_stations, repeat)
+
+        if size <= legacy_max:
+            legacy_time, legacy_ids = time_call(legacy_select_wifi_stations, line_stations, 1)
+            if legacy_ids != current_ids:
+                raise Exception(f"[bench_select_wifi_stations] Results differ for {size} stop points.")
+            print(f"{size:>12} {legacy_time:>12.4f} {current_time:>12.6f} {legacy_time / current_time:>8.0f}x")
+        else:
+            print(f"{size:>12} {'skipped':>12} {current_time:>12.6f} {'-':>9}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the merge of line stations in get_all_stations.")
+
+    parser.add_argument("-s", "--sizes", type=int, nargs="+", default=[300, 3000, 30000],
+                        help="Numbers of stop points to benchmark")
+    parser.add_argument("-lm", "--legacy_max", type=int, default=3000,
+                        help="Largest number of stop points the quadratic legacy merge is run for")
+    parser.add_argument("-r", "--repeat", type=int, default=3,
+                        help="Number of runs of the current merge, the best one is reported")
+
+    args = parser.parse_args()
+
+    main(args.sizes, args.legacy_max, args.repeat)
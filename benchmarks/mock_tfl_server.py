@@ -0,0 +1,205 @@
+import argparse
+import json
+import os
+import random
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+class MockTflServer:
+    """
+        A local HTTP server answering the TfL API endpoints used by the collector.
+
+        Payloads come from a directory of recorded responses if given, otherwise they are synthetic. Responses
+        are delayed by a configurable latency and a configurable fraction of requests fails with an error status.
+
+        Attributes:
+        - lines (int): Number of synthetic tube lines.
+        - stations_per_line (int): Number of synthetic stop points per line.
+        - latency_sec (float): Delay of each response in seconds.
+        - jitter_sec (float): Maximum random delay added to each response in seconds.
+        - error_rate (float): Fraction of requests answered with error_status.
+        - error_status (int): HTTP status of the failed requests.
+        - payload_dir (str or None): Directory of recorded payloads named after the request path.
+        - requests_served (int): Number of requests answered.
+        - errors_served (int): Number of requests answered with an error.
+    """
+    def __init__(self, lines=11, stations_per_line=30, latency_sec=0.0, jitter_sec=0.0, error_rate=0.0,
+                 error_status=503, payload_dir=None, host='127.0.0.1', port=0, seed=0):
+        """
+            Initializes the MockTflServer instance and binds its socket.
+
+            Args:
+            - lines (int): Number of synthetic tube lines.
+            - stations_per_line (int): Number of synthetic stop points per line.
+            - latency_sec (float): Delay of each response in seconds.
+            - jitter_sec (float): Maximum random delay added to each response in seconds.
+            - error_rate (float): Fraction of requests answered with error_status.
+            - error_status (int): HTTP status of the failed requests.
+            - payload_dir (str or None): Directory of recorded payloads named after the request path.
+            - host (str): Address to listen on.
+            - port (int): Port to listen on, 0 for any free port.
+            - seed (int): Seed of the random generator.
+        """
+        self.lines = lines
+        self.stations_per_line = stations_per_line
+        self.latency_sec = latency_sec
+        self.jitter_sec = jitter_sec
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.payload_dir = payload_dir
+        self.requests_served = 0
+        self.errors_served = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._thread = None
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                status, body = server.respond(self.path)
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer((host, port), Handler)
+        self._httpd.daemon_threads = True
+
+    @property
+    def base_url(self):
+        """
+            Returns the base URL to use instead of https://api.tfl.gov.uk.
+
+            Returns:
+            - str: Base URL of the server.
+        """
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def line_ids(self):
+        """
+            Returns IDs of the synthetic lines.
+
+            Returns:
+            - list: Line IDs.
+        """
+        return [f"line{index}" for index in range(self.lines)]
+
+    def stop_points(self, line_index):
+        """
+            Returns synthetic stop points of a line. Neighbouring lines share a fifth of their stations.
+
+            Args:
+            - line_index (int): Index of the line.
+
+            Returns:
+            - list: Stop points as returned by /Line/{id}/StopPoints.
+        """
+        shared = self.stations_per_line // 5
+        first = line_index * (self.stations_per_line - shared)
+        return [{'naptanId': f"940GZZMK{station:05d}",
+                 'commonName': f"Mock Station {station}",
+                 'status': True,
+                 'additionalProperties': [{'key': 'WiFi', 'value': 'yes' if station % 9 else 'no'}]}
+                for station in range(first, first + self.stations_per_line)]
+
+    def synthetic_payload(self, path):
+        """
+            Builds a synthetic payload of a request path.
+
+            Args:
+            - path (str): Request path.
+
+            Returns:
+            - tuple: (status, payload) where payload is JSON serialisable.
+        """
+        parts = path.strip('/').split('/')
+        if parts[:2] == ['Line', 'Mode'] and parts[-1] == 'Status':
+            return 200, [{'id': line_id, 'name': line_id.title(), 'modeName': 'tube'} for line_id in self.line_ids()]
+        if parts[0] == 'Line' and parts[-1] == 'StopPoints' and parts[1] in self.line_ids():
+            return 200, self.stop_points(self.line_ids().index(parts[1]))
+        if parts[0] == 'crowding' and parts[-1] == 'Live':
+            with self._lock:
+                available = self._random.random() > 0.05
+                percentage = self._random.random()
+            return 200, {'dataAvailable': available, 'percentageOfBaseline': percentage}
+        return 404, {'message': f"No mock for {path}"}
+
+    def respond(self, path):
+        """
+            Builds the response of a request path, applying latency and errors.
+
+            Args:
+            - path (str): Request path.
+
+            Returns:
+            - tuple: (status, body bytes).
+        """
+        with self._lock:
+            self.requests_served += 1
+            delay = self.latency_sec + self._random.uniform(0, self.jitter_sec)
+            fail = self._random.random() < self.error_rate
+            if fail:
+                self.errors_served += 1
+        if delay > 0:
+            time.sleep(delay)
+        if fail:
+            return self.error_status, b'{"message": "Mock error"}'
+
+        if self.payload_dir:
+            payload_path = os.path.join(self.payload_dir, path.strip('/').replace('/', '_') + '.json')
+            if os.path.exists(payload_path):
+                with open(payload_path, 'rb') as payload_file:
+                    return 200, payload_file.read()
+
+        status, payload = self.synthetic_payload(path)
+        return status, json.dumps(payload).encode()
+
+    def start(self):
+        """Serves requests on a background thread."""
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="mock-tfl", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops serving and closes the socket."""
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a local mock of the TfL API endpoints used by the collector.")
+
+    parser.add_argument("-p", "--port", type=int, default=8080,
+                        help="Port to listen on")
+    parser.add_argument("-l", "--lines", type=int, default=11,
+                        help="Number of synthetic tube lines")
+    parser.add_argument("-s", "--stations_per_line", type=int, default=30,
+                        help="Number of synthetic stop points per line")
+    parser.add_argument("-la", "--latency_ms", type=float, default=0,
+                        help="Delay of each response in milliseconds")
+    parser.add_argument("-j", "--jitter_ms", type=float, default=0,
+                        help="Maximum random delay added to each response in milliseconds")
+    parser.add_argument("-e", "--error_rate", type=float, default=0,
+                        help="Fraction of requests answered with an error status")
+    parser.add_argument("-es", "--error_status", type=int, default=503,
+                        help="HTTP status of the failed requests")
+    parser.add_argument("-pd", "--payload_dir", type=str, default=None,
+                        help="Directory of recorded payloads named after the request path, e.g. "
+                             "Line_Mode_tube_Status.json")
+
+    args = parser.parse_args()
+
+    mock = MockTflServer(args.lines, args.stations_per_line, args.latency_ms / 1000, args.jitter_ms / 1000,
+                         args.error_rate, args.error_status, args.payload_dir, port=args.port)
+    print(f"Serving mock TfL API on {mock.base_url}")
+    mock._httpd.serve_forever()
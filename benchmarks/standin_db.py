@@ -0,0 +1,231 @@
+import threading
+
+
+class StandInCursor:
+    """
+        A cursor accepting the statements DatabaseHandler sends and counting their size instead of running them.
+
+        Attributes:
+        - connection (StandInConnection): Connection of the cursor.
+        - closed (bool): Whether the cursor is closed.
+    """
+    def __init__(self, connection):
+        """
+            Initializes the StandInCursor instance.
+
+            Args:
+            - connection (StandInConnection): Connection of the cursor.
+        """
+        self.connection = connection
+        self.closed = False
+
+    def execute(self, query, params=None):
+        """
+            Counts a statement and its parameters.
+
+            Args:
+            - query (str): The statement.
+            - params (list or None): Parameters of the statement.
+        """
+        self.connection.database.record(len(query), 0 if params is None else len(params))
+
+    def mogrify(self, query, params=None):
+        """
+            Renders a statement with its parameters, like psycopg2's cursor.mogrify.
+
+            Args:
+            - query (str): The statement.
+            - params (list or None): Parameters of the statement.
+
+            Returns:
+            - bytes: The rendered statement.
+        """
+        if params is None:
+            return query.encode()
+        return (query % tuple('NULL' if value is None else repr(value) for value in params)).encode()
+
+    def copy_expert(self, query, buffer):
+        """
+            Counts a COPY statement and the size of its data.
+
+            Args:
+            - query (str): The COPY statement.
+            - buffer (io.StringIO): Data of the COPY.
+        """
+        self.connection.database.record(len(query), 0, len(buffer.read()))
+
+    def fetchone(self):
+        """
+            Returns a row of a single zero, e.g. an empty table's row count.
+
+            Returns:
+            - tuple: (0,).
+        """
+        return (0,)
+
+    def fetchall(self):
+        """
+            Returns no rows.
+
+            Returns:
+            - list: An empty list.
+        """
+        return []
+
+    def close(self):
+        """Closes the cursor."""
+        self.closed = True
+
+    def __enter__(self):
+        """
+            Enters a with block.
+
+            Returns:
+            - StandInCursor: The cursor.
+        """
+        return self
+
+    def __exit__(self, *args):
+        """Closes the cursor at the end of a with block."""
+        self.close()
+
+
+class StandInConnection:
+    """
+        A connection of the stand-in database.
+
+        Attributes:
+        - database (StandInDatabase): Counters shared by all connections.
+        - closed (int): 0 while open, like psycopg2 connections.
+    """
+    def __init__(self, database):
+        """
+            Initializes the StandInConnection instance.
+
+            Args:
+            - database (StandInDatabase): Counters shared by all connections.
+        """
+        self.database = database
+        self.closed = 0
+
+    def cursor(self):
+        """
+            Opens a cursor.
+
+            Returns:
+            - StandInCursor: A new cursor of the connection.
+        """
+        return StandInCursor(self)
+
+    def commit(self):
+        """Counts a commit."""
+        self.database.record_commit()
+
+    def rollback(self):
+        """Does nothing, there is nothing to roll back."""
+        pass
+
+    def close(self):
+        """Closes the connection."""
+        self.closed = 1
+
+
+class StandInDatabase:
+    """
+        Counters of the statements, parameters, COPY bytes and commits received by the stand-in connections.
+
+        Attributes:
+        - statements (int): Number of statements executed.
+        - parameters (int): Number of statement parameters.
+        - query_bytes (int): Total length of the statements.
+        - copy_bytes (int): Total length of the COPY data.
+        - commits (int): Number of commits.
+        - _lock (threading.Lock): Lock guarding the counters. Note: Internal attribute, avoid direct access.
+    """
+    def __init__(self):
+        """Initializes the StandInDatabase instance with zero counters."""
+        self.statements = 0
+        self.parameters = 0
+        self.query_bytes = 0
+        self.copy_bytes = 0
+        self.commits = 0
+        self._lock = threading.Lock()
+
+    def record(self, query_bytes, parameters, copy_bytes=0):
+        """
+            Counts a statement.
+
+            Args:
+            - query_bytes (int): Length of the statement.
+            - parameters (int): Number of its parameters.
+            - copy_bytes (int): Length of its COPY data.
+        """
+        with self._lock:
+            self.statements += 1
+            self.parameters += parameters
+            self.query_bytes += query_bytes
+            self.copy_bytes += copy_bytes
+
+    def record_commit(self):
+        """Counts a commit."""
+        with self._lock:
+            self.commits += 1
+
+
+def make_pool_class(database):
+    """
+    Builds a connection pool class handing out stand-in connections, to be set as DatabaseHandler.pool_class.
+
+    Parameters:
+    database (StandInDatabase): Counters shared by the connections.
+
+    Returns:
+    type: Pool class with the interface of psycopg2.pool.ThreadedConnectionPool used by DatabaseHandler.
+    """
+    class StandInPool:
+        """
+            A pool of stand-in connections.
+
+            Attributes:
+            - _idle (list): Connections returned to the pool. Note: Internal attribute, avoid direct access.
+        """
+        def __init__(self, minconn, maxconn, **db_params):
+            """
+                Initializes the StandInPool instance with minconn idle connections.
+
+                Args:
+                - minconn (int): Number of connections opened at once.
+                - maxconn (int): Unused, connections are not limited.
+                - db_params (dict): Unused database connection parameters.
+            """
+            self._idle = [StandInConnection(database) for _ in range(minconn)]
+
+        def getconn(self):
+            """
+                Borrows a connection, opening a new one if none is idle.
+
+                Returns:
+                - StandInConnection: The connection.
+            """
+            return self._idle.pop() if self._idle else StandInConnection(database)
+
+        def putconn(self, connection, close=False):
+            """
+                Returns a connection to the pool.
+
+                Args:
+                - connection (StandInConnection): The connection.
+                - close (bool): Whether to close the connection instead of keeping it idle.
+            """
+            if close:
+                connection.close()
+            else:
+                self._idle.append(connection)
+
+        def closeall(self):
+            """Closes all idle connections."""
+            for connection in self._idle:
+                connection.close()
+            self._idle = []
+
+    return StandInPool
@@ -2,45 +2,177 @@ from datetime import datetime, timedelta
 import time
 from config import email_password, smtp_server, smtp_port, smtp_email, recipient_email, db_params
 from EmailInformant import EmailInformant
-from tube_functions import get_lines, get_all_stations, get_crowding_data
-from DatabaseHandler import DatabaseHandler
+from tube_functions import (set_request_rate, configure_session, configure_retries, get_rate_limiter_stats,
+                            get_session_stats, set_response_recorder, SUPPORTED_MODES)
+from TopologyCache import TopologyCache
+from CrowdingSweeper import CrowdingSweeper
 from DataDumper import DataDumper
+from SweepScheduler import SweepScheduler
+from RowSpool import RowSpool
+from SpoolWriter import SpoolWriter
+from Metrics import registry, MetricsServer
+from ShardedCollection import ShardCoordinator, parse_address
+from CollectorCheckpoint import CollectorCheckpoint
+from ResponseArchive import ResponseArchive
+from StationMonitor import StationMonitor, format_events
+from AdaptivePoller import AdaptivePoller
+from utils import generate_epoch
 import argparse
+import os
 
 
 def main(pause_between_stations_sec=0.005, pause_between_state_draws_sec=45, save_interval_min=15, max_rows_in_commit=10,
          max_rows_in_table=4000, current_crowding_data_table=None, server_error_limit=5, error_del_time_min=180,
-         sleep_af_err_sec=65):
+         sleep_af_err_sec=65, max_concurrent_requests=1, max_requests_per_sec=None,
+         request_timeout_sec=30, topology_cache_path=None, topology_ttl_hours=24,
+         columnar_dumper=False, load_method='values', storage_mode='tables', parent_table='crowding_data',
+         partition_days=1, partitions_ahead=3, retention_days=None, detach_expired=False, db_pool_size=2,
+         cadence_sec=None, spool_dir=None, spool_max_mb=256, delta_table_prefix='crowding', request_burst=None,
+         max_request_retries=3, station_retries=1, sweep_deadline_sec=None, max_failed_fraction=0.1,
+         metrics_port=None, stats_file=None, alert_window_sec=30, max_alerts_per_hour=20, rollups=False,
+         modes=('tube',), shard_listen=None, shard_key=None, shard_local=False, shard_timeout_sec=30,
+         checkpoint_path=None, record_dir=None, stats_window=120, dropout_sweeps=40, stuck_sweeps=80,
+         store_dir='crowding_store', adaptive_polling=False, max_poll_interval=16, poll_change=0.01, poll_busy=None,
+         poll_fill='gap'):
 
-    dumper = DataDumper(save_interval_min)
+    set_request_rate(max_requests_per_sec, request_burst)
+    configure_retries(max_retries=max_request_retries)
+    configure_session(timeout_sec=request_timeout_sec, max_idle_per_host=max_concurrent_requests)
+    archive = ResponseArchive(record_dir) if record_dir else None
+    set_response_recorder(archive)
+    if shard_listen:
+        local_sweeper = None
+        if shard_local:
+            local_sweeper = CrowdingSweeper(max_concurrent_requests, pause_between_stations_sec, station_retries,
+                                            max_failed_fraction=1.0)
+        sweeper = ShardCoordinator(parse_address(shard_listen), shard_key.encode(), local_sweeper, shard_timeout_sec,
+                                   max_failed_fraction)
+    else:
+        sweeper = CrowdingSweeper(max_concurrent_requests, pause_between_stations_sec, station_retries,
+                                  sweep_deadline_sec, max_failed_fraction)
+    checkpoint = CollectorCheckpoint(checkpoint_path) if checkpoint_path else None
+    topology = TopologyCache(topology_cache_path, topology_ttl_hours, modes=modes, checkpoint=checkpoint,
+                             background_refresh=checkpoint is not None)
 
-    database_handler = DatabaseHandler(max_rows_in_commit, current_crowding_data_table, max_rows_in_table, db_params)
+    monitor = StationMonitor(stats_window, dropout_sweeps, stuck_sweeps)
+    dumper = DataDumper(save_interval_min, columnar_dumper, monitor=monitor)
+    poller = AdaptivePoller(max_poll_interval, change_threshold=poll_change, busy_threshold=poll_busy,
+                            fill=poll_fill) if adaptive_polling else None
 
-    email_informant = EmailInformant(smtp_server, smtp_port, smtp_email, email_password, recipient_email)
+    rollup = None
+    if rollups:
+        from CrowdingRollup import CrowdingRollup
+        rollup = CrowdingRollup()
+
+    if storage_mode == 'mmap':
+        from MmapStorageBackend import MmapStorageBackend
+        database_handler = MmapStorageBackend(max_rows_in_commit, store_dir, max_rows_in_table)
+    elif storage_mode == 'partitioned':
+        from PartitionedDatabaseHandler import PartitionedDatabaseHandler
+        database_handler = PartitionedDatabaseHandler(max_rows_in_commit, parent_table, db_params, load_method,
+                                                      partition_days, partitions_ahead, retention_days, detach_expired,
+                                                      db_pool_size, rollup=rollup)
+    elif storage_mode == 'delta':
+        from DeltaDatabaseHandler import DeltaDatabaseHandler
+        database_handler = DeltaDatabaseHandler(max_rows_in_commit, db_params, delta_table_prefix, db_pool_size,
+                                                rollup=rollup)
+    else:
+        from DatabaseHandler import DatabaseHandler
+        database_handler = DatabaseHandler(max_rows_in_commit, current_crowding_data_table, max_rows_in_table,
+                                           db_params, load_method, db_pool_size, rollup=rollup,
+                                           checkpoint=checkpoint)
+
+    email_informant = EmailInformant(smtp_server, smtp_port, smtp_email, email_password, recipient_email,
+                                     alert_window_sec, max_alerts_per_hour)
 
     server_error_counter = 0
     last_time_error_oc = None
     error_del_time_dif = timedelta(minutes=error_del_time_min)
 
+    scheduler = SweepScheduler(cadence_sec) if cadence_sec else None
+
+    spool = None
+    spool_writer = None
+    if spool_dir:
+        spool = RowSpool(spool_dir, spool_max_mb * 1024 * 1024)
+        spool_writer = SpoolWriter(spool, database_handler, save_interval_min * 60, max(max_rows_in_commit, 200),
+                                   sleep_af_err_sec)
+        spool_writer.start()
+
+    registry.add_collector('rate_limiter', get_rate_limiter_stats)
+    registry.add_collector('http_session', get_session_stats)
+    registry.add_collector('sweeper', sweeper.get_stats)
+    registry.add_collector('database', database_handler.get_metrics)
+    registry.add_collector('email', email_informant.get_stats)
+    registry.add_collector('stations', monitor.get_stats)
+    if poller is not None:
+        registry.add_collector('polling', poller.get_stats)
+    if archive is not None:
+        registry.add_collector('archive', archive.get_stats)
+    if scheduler is not None:
+        registry.add_collector('scheduler', scheduler.get_stats)
+    if spool is not None:
+        registry.add_collector('spool', lambda: {'pending_bytes': spool.pending_bytes(),
+                                                 'rows_written': spool_writer.rows_written})
+
+    metrics_server = None
+    if metrics_port is not None:
+        metrics_server = MetricsServer(registry, metrics_port)
+        metrics_server.start()
+
     dumper.set_save_time(datetime.now())
 
     while True:
         try:
-            tube_lines = get_lines()
-            naptan_ids = get_all_stations(tube_lines)
-            dumper.create_new_row()
+            skipped_ticks = scheduler.wait_for_next_tick() if scheduler is not None else 0
 
-            for naptan_id in naptan_ids:
-                crowding = get_crowding_data(naptan_id)
-                dumper.add_station_to_row(station_name=naptan_id, crowding_data=crowding)
-                time.sleep(pause_between_stations_sec)
+            naptan_ids = topology.get_stations()
+            dumper.set_stations(naptan_ids)
+            epoch = generate_epoch()
+            dumper.create_new_row(epoch)
 
-            time.sleep(pause_between_state_draws_sec)
+            if poller is not None:
+                poller.sweep(sweeper, naptan_ids, dumper)
+            else:
+                sweeper.sweep(naptan_ids, dumper)
+            dumper.close_row()
+            registry.inc('rows_sampled_total')
+            if archive is not None:
+                archive.mark_sweep(epoch, naptan_ids)
 
-            if dumper.is_time_to_save():
-                database_handler.insert_dumper(dumper.get_dumper())
+            station_events = monitor.end_sweep()
+            if station_events:
+                for kind, _, _ in station_events:
+                    registry.inc('station_events_total', kind=kind)
+                email_informant.send_email("At server: ", format_events(station_events))
+
+            if spool is not None:
+                for row in list(dumper.get_dumper()):
+                    spool.append(row)
+                    dumper.drop_first_rows(1)
+                for spool_error in spool_writer.pop_errors():
+                    registry.record_error(spool_error)
+                    email_informant.send_email("At server: ", str(spool_error))
+
+            if scheduler is None:
+                time.sleep(pause_between_state_draws_sec)
+            elif skipped_ticks:
+                stats = scheduler.get_stats()
+                email_informant.send_email("At server: ",
+                                           f"Sweep overran its slot, {skipped_ticks} tick(s) skipped. "
+                                           f"Cadence achieved/target: {stats['achieved_period_sec']:.2f}/"
+                                           f"{stats['target_period_sec']} s, overruns: {stats['overruns']}.")
+
+            if spool is None and dumper.is_time_to_save():
+                inserted_before = database_handler.rows_inserted
+                try:
+                    database_handler.insert_dumper(list(dumper.get_dumper()))
+                except Exception:
+                    database_handler.planned_to_insert = []
+                    raise
+                finally:
+                    dumper.drop_first_rows(database_handler.rows_inserted - inserted_before)
                 dumper.set_save_time(datetime.now())
-                dumper.clear_data()
 
             if last_time_error_oc and (datetime.now() - last_time_error_oc) >= error_del_time_dif:
                 email_informant.send_email("At server: ",
@@ -50,14 +182,35 @@ def main(pause_between_stations_sec=0.005, pause_between_state_draws_sec=45, sav
 
         except Exception as error:
             dumper.drop_last_row()
+            registry.inc('rows_dropped_total')
+            registry.record_error(error)
             email_informant.send_email("At server: ", str(error))
             time.sleep(sleep_af_err_sec)
+            if scheduler is not None:
+                scheduler.reset()
             server_error_counter += 1
             if server_error_limit == server_error_counter:
                 break
             last_time_error_oc = datetime.now()
 
+        if stats_file:
+            try:
+                registry.dump_json(stats_file)
+            except Exception as error:
+                registry.record_error(error)
+
+    sweeper.close()
+    if spool_writer is not None:
+        spool_writer.stop()
+        spool.close()
+    database_handler.close()
+    if metrics_server is not None:
+        metrics_server.stop()
     email_informant.send_email("At server: ", "Program stopped because error limit reached.")
+    email_informant.close()
+    if archive is not None:
+        set_response_recorder(None)
+        archive.close()
 
 
 if __name__ == "__main__":
@@ -81,9 +234,127 @@ if __name__ == "__main__":
                         help="Time after which error counter is set to 0 in minutes")
     parser.add_argument("-se", "--sleep_error", type=float, default=65,
                         help="Sleep time after each error in seconds")
+    parser.add_argument("-cr", "--concurrent_requests", type=int, default=1,
+                        help="Maximum number of crowding requests in flight at once during a sweep")
+    parser.add_argument("-rr", "--request_rate", type=float, default=None,
+                        help="Maximum number of requests per second sent to the TfL API")
+    parser.add_argument("-rt", "--request_timeout", type=float, default=30,
+                        help="Timeout of each request sent to the TfL API in seconds")
+    parser.add_argument("-tc", "--topology_cache", type=str, default=None,
+                        help="Path of the station topology cache file")
+    parser.add_argument("-tt", "--topology_ttl", type=float, default=24,
+                        help="Time after which the station topology is revalidated in hours")
+    parser.add_argument("-cd", "--columnar_dumper", action="store_true",
+                        help="Keep sampled rows in the compact columnar layout until they are saved")
+    parser.add_argument("-lm", "--load_method", type=str, default='values', choices=('values', 'copy', 'prepared'),
+                        help="How rows are loaded into the database, INSERT ... VALUES or COPY FROM STDIN")
+    parser.add_argument("-sm", "--storage_mode", type=str, default='tables',
+                        choices=('tables', 'partitioned', 'delta', 'mmap'),
+                        help="Rotate crowding_data_<timestamp> tables, write to one range partitioned table, "
+                             "store only changed station values or write memory-mapped column files without a "
+                             "database server")
+    parser.add_argument("-pt", "--parent_table", type=str, default='crowding_data',
+                        help="Name of the partitioned parent table")
+    parser.add_argument("-pl", "--partition_days", type=int, default=1,
+                        help="Number of days covered by one partition")
+    parser.add_argument("-pa", "--partitions_ahead", type=int, default=3,
+                        help="Number of partitions created ahead of the latest row")
+    parser.add_argument("-rd", "--retention_days", type=int, default=None,
+                        help="Days after which partitions are expired, kept forever if not set")
+    parser.add_argument("-de", "--detach_expired", action="store_true",
+                        help="Detach expired partitions instead of dropping them")
+    parser.add_argument("-dp", "--db_pool_size", type=int, default=2,
+                        help="Number of database connections kept open between flushes")
+    parser.add_argument("-ca", "--cadence", type=float, default=None,
+                        help="Start sweeps on wall-clock aligned ticks of this period in seconds instead of "
+                             "pausing between them")
+    parser.add_argument("-sd", "--spool_dir", type=str, default=None,
+                        help="Directory of a local spool the rows go through, written to the database by a "
+                             "background thread")
+    parser.add_argument("-sx", "--spool_max_mb", type=int, default=256,
+                        help="Maximum size of the spool file in megabytes")
+    parser.add_argument("-dt", "--delta_table_prefix", type=str, default='crowding',
+                        help="Prefix of the sweeps and changes tables of the delta storage mode")
+    parser.add_argument("-rb", "--request_burst", type=float, default=None,
+                        help="Number of requests that may be sent at once after an idle period")
+    parser.add_argument("-rm", "--max_request_retries", type=int, default=3,
+                        help="Number of retries of a throttled, failed or server error request")
+    parser.add_argument("-sr", "--station_retries", type=int, default=1,
+                        help="Number of retries of a failed station within a sweep")
+    parser.add_argument("-sdl", "--sweep_deadline", type=float, default=None,
+                        help="Time after which the stations still pending in a sweep are recorded as missing "
+                             "in seconds")
+    parser.add_argument("-mf", "--max_failed_fraction", type=float, default=0.1,
+                        help="Largest fraction of failed stations for which a sweep is kept, failed stations are "
+                             "recorded as missing")
+    parser.add_argument("-mp", "--metrics_port", type=int, default=None,
+                        help="Port of a local HTTP endpoint serving metrics in the Prometheus text format on "
+                             "/metrics and as JSON on /stats")
+    parser.add_argument("-sf", "--stats_file", type=str, default=None,
+                        help="Path of a JSON file the metrics are written to after each sweep")
+    parser.add_argument("-aw", "--alert_window", type=float, default=30,
+                        help="Time alerts are collected and identical ones merged before an email is sent in seconds")
+    parser.add_argument("-ah", "--max_alerts_per_hour", type=int, default=20,
+                        help="Maximum number of alert emails sent within an hour, later alerts are merged into "
+                             "the next email")
+    parser.add_argument("-ru", "--rollups", action="store_true",
+                        help="Maintain 5-minute, hourly and daily per-station rollups as rows are written")
+    parser.add_argument("-mo", "--modes", type=str, nargs='+', default=['tube'], choices=SUPPORTED_MODES,
+                        help="Transport modes whose stations are sampled")
+    parser.add_argument("-sh", "--shard_listen", type=str, default=None,
+                        help="Address host:port to accept shard workers on, the stations of each sweep are then "
+                             "spread over the workers started with ShardedCollection.py")
+    parser.add_argument("-sk", "--shard_key", type=str, default=os.environ.get('TUBE_CROWDING_SHARD_KEY'),
+                        help="Key shared by the coordinator and its workers, TUBE_CROWDING_SHARD_KEY by default")
+    parser.add_argument("-sc", "--shard_local", action="store_true",
+                        help="Sample a shard in the coordinator too, not only in the workers")
+    parser.add_argument("-st", "--shard_timeout", type=float, default=30,
+                        help="Time to wait for the shards of a sweep in seconds, stations of late workers are "
+                             "recorded as missing")
+    parser.add_argument("-cp", "--checkpoint", type=str, default=None,
+                        help="Path of a checkpoint file a restart resumes the current table and stations from "
+                             "without database introspection or a topology crawl, expired stations are then "
+                             "refreshed in the background")
+    parser.add_argument("-rec", "--record_dir", type=str, default=None,
+                        help="Directory of an append-only archive all TfL API responses are recorded into, to be "
+                             "replayed with ResponseArchive.py")
+    parser.add_argument("-sw", "--stats_window", type=int, default=120,
+                        help="Number of sweeps in the rolling per-station statistics")
+    parser.add_argument("-ds", "--dropout_sweeps", type=int, default=40,
+                        help="Number of sweeps in a row without data after which a station is reported as dropped out")
+    parser.add_argument("-ss", "--stuck_sweeps", type=int, default=80,
+                        help="Number of sweeps in a row with the same value after which a station is reported as stuck")
+    parser.add_argument("-md", "--store_dir", type=str, default='crowding_store',
+                        help="Directory of the memory-mapped segments of the mmap storage mode, each holding up to "
+                             "--max_table rows")
+    parser.add_argument("-ap", "--adaptive_polling", action="store_true",
+                        help="Poll changing and busy stations on every tick and back off stations that are unavailable "
+                             "or whose value does not change")
+    parser.add_argument("-mi", "--max_poll_interval", type=int, default=16,
+                        help="Longest polling interval of a backed off station in ticks, with --adaptive_polling")
+    parser.add_argument("-pc", "--poll_change", type=float, default=0.01,
+                        help="Smallest change of a station's value that resets its polling interval to one tick")
+    parser.add_argument("-pb", "--poll_busy", type=float, default=None,
+                        help="Value at or above which a station is polled on every tick, e.g. 0.8")
+    parser.add_argument("-pf", "--poll_fill", type=str, default='gap', choices=AdaptivePoller.fills,
+                        help="Add stations not polled on a tick as missing, or with their last value, which rollups "
+                             "then count as samples")
 
     args = parser.parse_args()
+    if args.shard_listen and not args.shard_key:
+        parser.error("a shard key is required with --shard_listen, pass --shard_key or set TUBE_CROWDING_SHARD_KEY")
 
     main(args.pause_stations, args.pause_draws, args.save_interval, args.max_commit,
          args.max_table, args.crowding_table, args.server_limit, args.error_del_time,
-         args.sleep_error)
+         args.sleep_error, args.concurrent_requests, args.request_rate,
+         args.request_timeout, args.topology_cache, args.topology_ttl,
+         args.columnar_dumper, args.load_method, args.storage_mode, args.parent_table,
+         args.partition_days, args.partitions_ahead, args.retention_days, args.detach_expired,
+         args.db_pool_size, args.cadence, args.spool_dir, args.spool_max_mb,
+         args.delta_table_prefix, args.request_burst, args.max_request_retries,
+         args.station_retries, args.sweep_deadline, args.max_failed_fraction, args.metrics_port,
+         args.stats_file, args.alert_window, args.max_alerts_per_hour, args.rollups,
+         tuple(args.modes), args.shard_listen, args.shard_key, args.shard_local, args.shard_timeout,
+         args.checkpoint, args.record_dir, args.stats_window, args.dropout_sweeps, args.stuck_sweeps,
+         args.store_dir, args.adaptive_polling, args.max_poll_interval, args.poll_change, args.poll_busy,
+         args.poll_fill)
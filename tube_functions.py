@@ -1,50 +1,273 @@
-import urllib.request
-import pandas as pd
 import json
+import random
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 from config import hdr
+from RateLimiter import RateLimiter
+from HttpSession import HttpSession
+from Metrics import registry
 
+TFL_API_BASE = "https://api.tfl.gov.uk"
+SUPPORTED_MODES = ('tube', 'dlr', 'overground', 'elizabeth-line')
 
-def get_response(url):
+_rate_limiter = RateLimiter()
+_session = HttpSession(headers=hdr)
+_retry_policy = {'max_retries': 3, 'backoff_base_sec': 0.5, 'backoff_max_sec': 30.0}
+_response_recorder = None
+_response_source = None
+
+
+def set_request_rate(requests_per_sec, burst=None):
+    """
+    Sets the global rate shared by all requests sent to the TfL API, e.g. the quota of the app key.
+
+    Parameters:
+    requests_per_sec (float or None): Maximum number of requests per second, None for no limit.
+    burst (float or None): Number of requests that may be sent at once after an idle period, unchanged if None.
+
+    Raises:
+     Exception: If the rate or the burst is not positive, with tag [set_request_rate].
+    """
+    try:
+        _rate_limiter.set_rate(requests_per_sec, burst)
+    except Exception as err:
+        raise Exception(f"[set_request_rate] {err}")
+
+
+def configure_retries(max_retries=None, backoff_base_sec=None, backoff_max_sec=None):
     """
-    Sends a GET request to the specified URL using urllib.request and returns the response object.
+    Configures the retries of throttled, failed or server error requests sent to the TfL API.
+
+    Parameters:
+    max_retries (int or None): Number of retries of a request, unchanged if None.
+    backoff_base_sec (float or None): Backoff before the first retry in seconds, doubled for each retry,
+                                      unchanged if None.
+    backoff_max_sec (float or None): Longest backoff in seconds, unchanged if None.
+    """
+    for key, value in (('max_retries', max_retries), ('backoff_base_sec', backoff_base_sec),
+                       ('backoff_max_sec', backoff_max_sec)):
+        if value is not None:
+            _retry_policy[key] = value
+
+
+def get_rate_limiter_stats():
+    """
+    Returns the state of the shared rate limiter.
+
+    Returns:
+    dict: Configured and current rate and the number of throttled responses.
+    """
+    return _rate_limiter.get_stats()
+
+
+def parse_retry_after(value):
+    """
+    Parses a Retry-After header given either in seconds or as an HTTP date.
+
+    Parameters:
+    value (str or None): Value of the header.
+
+    Returns:
+    float or None: Time to wait in seconds, or None if the header is missing or malformed.
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+        return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt):
+    """
+    Returns a jittered exponential backoff for a retry.
+
+    Parameters:
+    attempt (int): Number of the retry, starting at 0.
+
+    Returns:
+    float: Time to wait in seconds, drawn uniformly up to the exponential backoff.
+    """
+    ceiling = min(_retry_policy['backoff_max_sec'], _retry_policy['backoff_base_sec'] * 2 ** attempt)
+    return random.uniform(0, ceiling)
+
+
+def configure_session(timeout_sec=None, max_idle_per_host=None):
+    """
+    Configures the keep-alive HTTP session shared by all requests sent to the TfL API.
+
+    Parameters:
+    timeout_sec (float or None): Default request timeout in seconds, unchanged if None.
+    max_idle_per_host (int or None): Maximum number of idle connections kept per host, unchanged if None.
+    """
+    if timeout_sec is not None:
+        _session.timeout = timeout_sec
+    if max_idle_per_host is not None:
+        _session.max_idle_per_host = max_idle_per_host
+
+
+def get_session_stats():
+    """
+    Returns connection counters of the shared HTTP session.
+
+    Returns:
+    dict: Number of connections opened and reused.
+    """
+    return _session.get_stats()
+
+
+def set_response_recorder(recorder):
+    """
+    Sets the archive the final response of every request sent by get_response is recorded into.
+
+    Parameters:
+    recorder (ResponseArchive or None): Archive with a record(url, status, reason, body) method, None to stop recording.
+    """
+    global _response_recorder
+    _response_recorder = recorder
+
+
+def set_response_source(source):
+    """
+    Makes get_response serve responses from a source instead of the TfL API, without rate limiting or retries,
+    e.g. to replay recorded responses.
+
+    Parameters:
+    source (callable or None): Function returning the SessionResponse of a URL or raising if it has none,
+                               None to send requests to the TfL API again.
+    """
+    global _response_source
+    _response_source = source
+
+
+def record_response(url, status, reason, body=b''):
+    """
+    Records a final response in the response archive, if one is set.
+
+    Parameters:
+    url (str): The requested URL.
+    status (int): HTTP status code, 0 if the request failed without a response.
+    reason (str): HTTP reason phrase or the error of a failed request.
+    body (bytes): Decoded response body.
+    """
+    if _response_recorder is not None:
+        _response_recorder.record(url, status, reason, body)
+
+
+def get_response(url, timeout=None, headers=None):
+    """
+    Sends a GET request to the specified URL over the shared keep-alive session and returns the response object.
 
     Parameters:
     url (str): The URL to send the GET request to.
+    timeout (float or None): Request timeout in seconds, the session default if None.
+    headers (dict or None): Extra headers of this request, e.g. conditional request validators.
+
+    Throttled (429) responses slow down the shared rate limiter and honour Retry-After. Throttled, server error
+    and failed requests are retried with jittered exponential backoff. The final response is recorded in the
+    response archive if one is set, and a response source set by set_response_source replaces the request.
 
     Returns:
-    HTTPResponse: The response object containing the server's response to the request.
+    SessionResponse: The fully read response containing the server's response to the request.
 
     Raises:
-     Exception: If an error occurs while sending the request or processing the response, with tag [get_response].
+     Exception: If an error occurs while sending the request or processing the response,
+     or if the server responds with an error status after all retries, with tag [get_response].
     """
     try:
-        req = urllib.request.Request(url, headers=hdr)
-        req.get_method = lambda: 'GET'
-        response = urllib.request.urlopen(req)
-        return response
+        if _response_source is not None:
+            response = _response_source(url)
+            if response.status >= 400:
+                raise Exception(f"HTTP Error {response.status}: {response.reason}")
+            return response
+
+        attempt = 0
+        while True:
+            with registry.timer('rate_limit_wait'):
+                _rate_limiter.acquire()
+            try:
+                with registry.timer('http_request'):
+                    response = _session.request(url, headers=headers, timeout=timeout)
+            except Exception as request_err:
+                registry.inc('http_responses_total', status='error')
+                if attempt >= _retry_policy['max_retries']:
+                    record_response(url, 0, str(request_err))
+                    raise
+                time.sleep(backoff_delay(attempt))
+                attempt += 1
+                continue
+
+            registry.inc('http_responses_total', status=response.status)
+            if response.status == 429 or response.status >= 500:
+                retry_after = parse_retry_after(response.getheader('Retry-After'))
+                if response.status == 429:
+                    _rate_limiter.on_throttled(retry_after)
+                if attempt >= _retry_policy['max_retries']:
+                    record_response(url, response.status, response.reason, response.body)
+                    raise Exception(f"HTTP Error {response.status}: {response.reason}")
+                time.sleep(max(retry_after or 0.0, backoff_delay(attempt)))
+                attempt += 1
+                continue
+
+            record_response(url, response.status, response.reason, response.body)
+            if response.status >= 400:
+                raise Exception(f"HTTP Error {response.status}: {response.reason}")
+            _rate_limiter.on_success()
+            return response
     except Exception as err:
         raise Exception(f"[get_response] {err}")
 
 
-def get_lines():
+def lines_url(modes=('tube',)):
     """
-    Retrieves information about the present London Underground lines from the TfL API.
+    Returns the TfL API URL listing the lines of the given transport modes.
+
+    Parameters:
+    modes (tuple): TfL mode names, e.g. ('tube', 'dlr', 'overground', 'elizabeth-line').
 
     Returns:
-    pandas.DataFrame: DataFrame containing information about Tube lines including id, name and mode.
+    str: The URL of the lines endpoint.
+    """
+    return f"{TFL_API_BASE}/Line/Mode/{','.join(modes)}/Status"
+
+
+def line_stations_url(line_id):
+    """
+    Returns the TfL API URL listing the stop points of a given line ID.
+
+    Parameters:
+    line_id (str): The ID of the line.
+
+    Returns:
+    str: The URL of the line's stop points endpoint.
+    """
+    return f"{TFL_API_BASE}/Line/{line_id}/StopPoints"
+
+
+def parse_lines(json_lines, modes=('tube',)):
+    """
+    Builds a DataFrame of lines from a decoded lines response of the TfL API.
+
+    Parameters:
+    json_lines (list): Decoded JSON body of the lines endpoint.
+    modes (tuple): TfL mode names the lines are expected to have.
+
+    Returns:
+    pandas.DataFrame: DataFrame containing information about the lines including id, name and mode.
 
     Raises:
-     Exception: If an error occurs during the API request or processing the response,
-     or if the DataFrame for output is empty, with tag [get_lines].
+     Exception: If a line has missing fields or is not of the expected modes, or if the DataFrame for output is empty,
+     with tag [parse_lines].
     """
     try:
-        url = "https://api.tfl.gov.uk/Line/Mode/tube/Status"
-        response = get_response(url)
+        import pandas as pd
 
-        if response.getcode() != 200:
-            raise Exception(f"Failed to retrieve lines. Status code: {response.getcode()}")
-
-        json_lines = json.load(response)
         lines = []
 
         for line in json_lines:
@@ -55,8 +278,8 @@ def get_lines():
             if "NaN" in (line_id, name, mode_name):
                 raise ValueError(f"One or more required fields of a line are missing. " +
                                  f"(id: {line_id},name: {name}, modeName: {mode_name})")
-            if mode_name != "tube":
-                raise ValueError(f"The modeName of a line is not 'tube'. " +
+            if mode_name not in modes:
+                raise ValueError(f"The modeName of a line is not one of {', '.join(modes)}. " +
                                  f"(id: {line_id},name: {name}, modeName: {mode_name})")
 
             lines.append([line_id, name, mode_name])
@@ -68,32 +291,52 @@ def get_lines():
 
         return df
     except Exception as err:
-        raise Exception(f"[get_lines] {err}")
+        raise Exception(f"[parse_lines] {err}")
 
 
-def get_line_stations(line_id):
+def get_lines(modes=('tube',)):
     """
-    Retrieve information about the stations of a given line ID.
+    Retrieves information about the present lines of the given transport modes from the TfL API.
 
     Parameters:
-    line_id (str): The ID of the line to retrieve stations for.
+    modes (tuple): TfL mode names, London Underground only by default.
 
     Returns:
-    pandas.DataFrame: A DataFrame containing information about the stations,
-                      including Naptan ID, common name, status, and Wi-Fi availability.
+    pandas.DataFrame: DataFrame containing information about the lines including id, name and mode.
 
     Raises:
      Exception: If an error occurs during the API request or processing the response,
-     or if the DataFrame for output is empty, with tag [get_line_stations].
+     or if the DataFrame for output is empty, with tag [get_lines].
     """
     try:
-        url = f"https://api.tfl.gov.uk/Line/{line_id}/StopPoints"
-        response = get_response(url)
+        response = get_response(lines_url(modes))
 
         if response.getcode() != 200:
-            raise Exception(f"Failed to retrieve stations. Status code: {response.getcode()}")
+            raise Exception(f"Failed to retrieve lines. Status code: {response.getcode()}")
+
+        return parse_lines(json.load(response), modes)
+    except Exception as err:
+        raise Exception(f"[get_lines] {err}")
+
+
+def parse_line_stations(stop_points):
+    """
+    Builds a DataFrame of stations from a decoded stop points response of the TfL API.
+
+    Parameters:
+    stop_points (list): Decoded JSON body of a line's stop points endpoint.
+
+    Returns:
+    pandas.DataFrame: A DataFrame containing information about the stations,
+                      including Naptan ID, common name, status, and Wi-Fi availability.
+
+    Raises:
+     Exception: If a station has missing fields or an unknown Wi-Fi status, or if the DataFrame for output is empty,
+     with tag [parse_line_stations].
+    """
+    try:
+        import pandas as pd
 
-        stop_points = json.load(response)
         stop_data = []
 
         for stop_point in stop_points:
@@ -127,39 +370,86 @@ def get_line_stations(line_id):
             raise ValueError(f"Dataframe for output is empty.")
 
         return df
+    except Exception as err:
+        raise Exception(f"[parse_line_stations] {err}")
+
+
+def get_line_stations(line_id):
+    """
+    Retrieve information about the stations of a given line ID.
+
+    Parameters:
+    line_id (str): The ID of the line to retrieve stations for.
+
+    Returns:
+    pandas.DataFrame: A DataFrame containing information about the stations,
+                      including Naptan ID, common name, status, and Wi-Fi availability.
+
+    Raises:
+     Exception: If an error occurs during the API request or processing the response,
+     or if the DataFrame for output is empty, with tag [get_line_stations].
+    """
+    try:
+        response = get_response(line_stations_url(line_id))
+
+        if response.getcode() != 200:
+            raise Exception(f"Failed to retrieve stations. Status code: {response.getcode()}")
+
+        return parse_line_stations(json.load(response))
     except Exception as err:
         raise Exception(f"[get_line_stations] {err}")
 
 
-def get_all_stations(lines_df):
+def select_wifi_stations(line_stations_dfs):
     """
-    Retrieve information about stop points for all London Underground lines with Wi-Fi set to "yes".
+    Merges stations of several lines into unique 'naptanId' values of stations with Wi-Fi set to "yes",
+    keeping the order in which the stations are first seen.
 
     Parameters:
-    lines_df (pandas.DataFrame): DataFrame containing information about Tube lines.
+    line_stations_dfs (iterable): DataFrames of line stations as returned by get_line_stations.
 
     Returns:
     tuple: A tuple containing unique 'naptanId' values of stations with Wi-Fi across all lines.
 
     Raises:
-     Exception: If an error occurs while retrieving information about stop points for all London Underground lines.
+     Exception: If there are no stations with Wi-Fi, with tag [select_wifi_stations].
     """
     try:
-        all_lines_df = pd.DataFrame(columns=['naptanId', 'commonName', 'status', 'WiFi'])
+        seen_ids = set()
+        naptan_ids = []
 
-        for line_id in lines_df['id']:
-            line_stations = get_line_stations(line_id)
+        for line_stations in line_stations_dfs:
+            for naptan_id, wifi_status in zip(line_stations['naptanId'].tolist(), line_stations['WiFi'].tolist()):
+                if wifi_status == 'yes' and naptan_id not in seen_ids:
+                    seen_ids.add(naptan_id)
+                    naptan_ids.append(naptan_id)
 
-            for index, station_row in line_stations.iterrows():
-                if station_row['WiFi'] == 'yes' and station_row['naptanId'] not in all_lines_df['naptanId'].tolist():
-                    all_lines_df = pd.concat([all_lines_df, station_row.to_frame().T], ignore_index=True)
-
-        naptan_ids_tuple = tuple(all_lines_df['naptanId'])
+        naptan_ids_tuple = tuple(naptan_ids)
 
         if len(naptan_ids_tuple) == 0:
             raise Exception('No stations.')
 
         return naptan_ids_tuple
+    except Exception as err:
+        raise Exception(f"[select_wifi_stations] {err}")
+
+
+def get_all_stations(lines_df):
+    """
+    Retrieve information about stop points for all London Underground lines with Wi-Fi set to "yes".
+
+    Parameters:
+    lines_df (pandas.DataFrame): DataFrame containing information about Tube lines.
+
+    Returns:
+    tuple: A tuple containing unique 'naptanId' values of stations with Wi-Fi across all lines.
+
+    Raises:
+     Exception: If an error occurs while retrieving information about stop points for all London Underground lines.
+    """
+    try:
+        with registry.timer('topology_fetch'):
+            return select_wifi_stations(get_line_stations(line_id) for line_id in lines_df['id'])
     except Exception as err:
         raise Exception(f"[get_all_stations] {err}")
 
@@ -178,7 +468,7 @@ def get_crowding_data(naptan_id):
      Exception: If an error occurs during the API request or processing the response, with tag [get_crowding_data].
     """
     try:
-        url = f"https://api.tfl.gov.uk/crowding/{naptan_id}/Live"
+        url = f"{TFL_API_BASE}/crowding/{naptan_id}/Live"
         response = get_response(url)
 
         crowding = None
@@ -1,4 +1,5 @@
 from datetime import datetime
+import time
 import pytz
 
 timestamp_format = 'YYYY-MM-DD HH24:MI:SS'
@@ -27,3 +28,35 @@ def generate_timestamp(timezone_str='Europe/London'):
         return timestamp_str
     except Exception as err:
         raise Exception(f'[generate_timestamp] {err}')
+
+
+def generate_epoch():
+    """
+        Generates the current time as whole seconds since the Unix epoch.
+
+        Returns:
+        - epoch (int): Seconds since the Unix epoch.
+    """
+    return int(time.time())
+
+
+def epoch_to_timestamp(epoch, timezone_str='Europe/London'):
+    """
+        Converts seconds since the Unix epoch to a timestamp string in the format 'YYYY-MM-DD HH:MM:SS'
+        in the specified timezone, matching the strings made by generate_timestamp.
+
+        Parameters:
+        - epoch (int): Seconds since the Unix epoch.
+        - timezone_str (str): The timezone of the timestamp. Default is 'Europe/London'.
+
+        Returns:
+        - timestamp_str (str): Timestamp string representing the given time in the specified timezone.
+
+        Raises:
+        - Exception: If an error occurs while converting the epoch or if the timezone is invalid.
+    """
+    try:
+        timezone = pytz.timezone(timezone_str)
+        return datetime.fromtimestamp(int(epoch), timezone).strftime('%Y-%m-%d %H:%M:%S')
+    except Exception as err:
+        raise Exception(f'[epoch_to_timestamp] {err}')